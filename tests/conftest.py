@@ -228,13 +228,20 @@ def match_sample():
 def db_name():
     return uuid()
 
-@pytest.fixture(scope='function', params=['elasticsearch'])
-def traxit_db(request, db_name):
+@pytest.fixture(scope='function')
+def make_db(request, db_name):
+    """Factory of in memory databases named db_name, deleted at the end of the test."""
     from traxit_manage.in_memory_db import DbInMemory
-    db = DbInMemory(db_name)
 
-    def fin():
-        db.delete_all()
+    def make(**kwargs):
+        db = DbInMemory(db_name, **kwargs)
+        if not db.read_only:
+            request.addfinalizer(db.delete_all)
+        return db
+
+    return make
 
-    request.addfinalizer(fin)
-    return db
+
+@pytest.fixture(scope='function', params=['elasticsearch'])
+def traxit_db(make_db):
+    return make_db()
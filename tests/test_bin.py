@@ -154,3 +154,20 @@ def test_delete_broadcast(create_corpus_broadcast):
     runner = CliRunner()
     runner.invoke(delete_broadcast, [corpus_name, broadcast_name])
     assert not os.path.exists(os.path.join(cwd, corpus_name, broadcast_name))
+
+
+def test_db_export_import(fingerprints, traxit_db, db_name, tmpdir):
+    from traxit_manage.bin import db
+    from traxit_manage.in_memory_db import DbInMemory
+    traxit_db.insert_fingerprints(fingerprints)
+    runner = CliRunner()
+    path = str(tmpdir.join('db.traxit'))
+    result = runner.invoke(db, ['export', db_name, path])
+    assert result.exit_code == 0
+    result = runner.invoke(db, ['import', path, '--dbname', db_name + '_imported'])
+    assert result.exit_code == 0
+    imported_db = DbInMemory(db_name + '_imported')
+    try:
+        assert imported_db.get_fp_ids() == traxit_db.get_fp_ids()
+    finally:
+        imported_db.delete_all()
@@ -0,0 +1,107 @@
+import io
+import struct
+import wave
+
+import numpy as np
+import pytest
+
+from traxit_manage.decode import WaveSource
+
+
+def _write_wave(path, samples, rate=11025, channels=1):
+    f = wave.open(path, 'wb')
+    f.setnchannels(channels)
+    f.setsampwidth(2)
+    f.setframerate(rate)
+    f.writeframes(samples.astype('<i2').tobytes())
+    f.close()
+
+
+def test_wave_source(tmpdir):
+    path = str(tmpdir.join('audio.wav'))
+    samples = np.arange(-500, 500, dtype=np.int16)
+    _write_wave(path, samples)
+    source = WaveSource(path, samplerate_assert=11025)
+    assert source.n_frames == 1000
+    assert source.length == 1000 / 11025.
+    audio, is_end = source.read(10, 20)
+    assert audio.tolist() == samples[10:20].tolist() and not is_end
+    assert not audio.flags.writeable
+    audio, is_end = source.read(990, 2000)
+    assert audio.tolist() == samples[990:].tolist() and is_end
+    assert len(source.read(2000, 3000)[0]) == 0
+    assert source.read()[0].tolist() == samples.tolist()
+    with pytest.raises(AssertionError):
+        WaveSource(path, samplerate_assert=44100)
+
+
+def test_wave_source_stereo_and_extra_chunks(tmpdir):
+    path = str(tmpdir.join('audio.wav'))
+    samples = np.arange(20, dtype=np.int16)
+    _write_wave(path, samples, channels=2)
+    # Insert a LIST chunk of odd size (padded) before the data
+    with open(path, 'rb') as f:
+        content = f.read()
+    data = content.index(b'data')
+    content = content[:data] + b'LIST' + struct.pack('<I', 3) + b'abc\x00' + content[data:]
+    content = content[:4] + struct.pack('<I', len(content) - 8) + content[8:]
+    with open(path, 'wb') as f:
+        f.write(content)
+    source = WaveSource(path)
+    assert source.channels == 2 and source.n_frames == 10
+    assert source.read(1, 3)[0].tolist() == [2, 3, 4, 5]
+
+
+def test_wave_source_invalid(tmpdir):
+    path = str(tmpdir.join('audio.wav'))
+    with open(path, 'wb') as f:
+        f.write(b'not a wave file at all')
+    with pytest.raises(ValueError):
+        WaveSource(path)
+
+
+def test_stream_source_raw():
+    from traxit_manage.decode import StreamSource
+    samples = np.arange(100, dtype=np.int16)
+    # An incomplete frame at the end is ignored
+    source = StreamSource(io.BytesIO(samples.astype('<i2').tobytes() + b'\x01'), rate=10)
+    assert source.n_frames == 6 and not source.ended
+    audio, is_end = source.read(10, 20)
+    assert audio.tolist() == samples[10:20].tolist() and not is_end
+    # Only the frames needed were read
+    assert source.n_frames == 20
+    source.discard(15)
+    assert source.read(15, 17)[0].tolist() == [15, 16]
+    with pytest.raises(ValueError):
+        source.read(10, 20)
+    assert not source.wait(200)
+    audio, is_end = source.read(90, 200)
+    assert audio.tolist() == samples[90:].tolist() and is_end
+    assert source.ended and source.length == 10.
+
+
+def test_stream_source_wave(tmpdir):
+    from traxit_manage.decode import StreamSource
+    path = str(tmpdir.join('audio.wav'))
+    samples = np.arange(20, dtype=np.int16)
+    _write_wave(path, samples, rate=8000, channels=2)
+    with open(path, 'rb') as f:
+        source = StreamSource(f)
+        assert source.rate == 8000 and source.channels == 2
+        assert source.read(1, 3)[0].tolist() == [2, 3, 4, 5]
+        assert source.read()[0].tolist() == samples.tolist()
+
+
+def test_stream_source_follow(tmpdir):
+    from traxit_manage.decode import StreamSource
+    path = str(tmpdir.join('audio.raw'))
+    with open(path, 'wb') as writer:
+        writer.write(np.arange(10, dtype='<i2').tobytes())
+        writer.flush()
+        with open(path, 'rb') as f:
+            source = StreamSource(f, follow=True, poll_interval=0.01, idle_timeout=0.1)
+            assert source.wait(10) and not source.ended
+            writer.write(np.arange(10, 15, dtype='<i2').tobytes())
+            writer.flush()
+            assert not source.wait(20)
+            assert source.ended and source.n_frames == 15
@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 import pandas as pd
 import pytest
@@ -34,6 +36,18 @@ def test_query_fingerprint(fingerprints, traxit_db):
         assert (fp == fp_bis).all().all()
 
 
+def test_query_fingerprint_deleted_key(fingerprints, make_db):
+    db = make_db(compaction_threshold=None)
+    db.insert_fingerprints(fingerprints)
+    track_id1 = fingerprints[0][0]
+    db.delete_key(1)
+    for loaded_db in (db, make_db(read_only=True)):
+        fp = loaded_db.query_fingerprint(track_id1)
+        assert fp['key'].tolist() == [2, 4]
+        assert fp.index.tolist() == [1, 2]
+    assert db.query_fingerprint('unknown').empty
+
+
 def test_query_keys(fingerprints, traxit_db):
     for track_id, fp in fingerprints:
         traxit_db.insert_fingerprint(fp, track_id)
@@ -94,3 +108,636 @@ def test_is_ingested_fingerprint(fingerprint, traxit_db):
     assert traxit_db.is_ingested_fingerprint(track_id)
     traxit_db.delete_fingerprint(track_id)
     assert not traxit_db.is_ingested_fingerprint(track_id)
+
+
+def test_query_after_delete_fingerprint(fingerprints, traxit_db):
+    for track_id, fp in fingerprints:
+        traxit_db.insert_fingerprint(fp, track_id)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    traxit_db.delete_fingerprint(track_id1)
+    assert traxit_db.query_track_ids({1, 2, 4}, 2) == [track_id2]
+    assert list(traxit_db.query_keys({1, 2, 4}, [track_id1, track_id2])) == [track_id2]
+
+
+def test_load_existing(fingerprints, traxit_db, make_db):
+    for track_id, fp in fingerprints:
+        traxit_db.insert_fingerprint(fp, track_id)
+    loaded_db = make_db()
+    assert set(loaded_db.get_fp_ids()) == set(traxit_db.get_fp_ids())
+    assert (loaded_db.query_track_ids({3}, 2) == traxit_db.query_track_ids({3}, 2) == [fingerprints[1][0]])
+
+
+def test_load_memory_mapped(fingerprints, traxit_db, make_db):
+    for track_id, fp in fingerprints:
+        traxit_db.insert_fingerprint(fp, track_id)
+    loaded_db = make_db()
+    assert isinstance(loaded_db._index.keys, np.memmap)
+    track_id = fingerprints[0][0]
+    assert (loaded_db.query_fingerprint(track_id) == fingerprints[0][1]).all().all()
+
+
+def test_migrate_csv(fingerprint, traxit_db, make_db):
+    import os
+    import shutil
+    track_id, fp = fingerprint
+    # Stores of the CSV format only hold one file per track
+    shutil.rmtree(traxit_db.store_in)
+    os.mkdir(traxit_db.store_in)
+    fp.assign(index_ref=fp.index).to_csv(os.path.join(traxit_db.store_in, track_id), index=False)
+    migrated_db = make_db()
+    assert migrated_db.is_ingested_fingerprint(track_id)
+    assert not os.path.exists(os.path.join(traxit_db.store_in, track_id))
+    assert make_db().query_track_ids({1}, 1) == [track_id]
+
+
+def test_insert_fingerprints(fingerprints, traxit_db, make_db):
+    traxit_db.insert_fingerprints(iter(fingerprints))
+    fp = pd.DataFrame({'key': [1, 5, 3, 1]})
+    traxit_db.insert_fingerprints([(fingerprints[0][0], fp)], override=True)
+    loaded_db = make_db()
+    for db in (traxit_db, loaded_db):
+        assert set(db.get_fp_ids()) == set(track_id for track_id, _ in fingerprints)
+        assert db.query_track_ids({5}, 2) == [fingerprints[0][0]]
+        assert db.query_keys({1, 4}, [fingerprints[0][0]])[fingerprints[0][0]][1]['index'].tolist() == [0, 3]
+
+
+def test_compact_storage(traxit_db):
+    fp = pd.DataFrame({'key': np.arange(-100, 100, dtype=np.int64)})
+    traxit_db.insert_fingerprint(fp, '1')
+    usage = traxit_db.memory_usage()
+    assert usage['keys_dtype'] == 'int8'
+    assert usage['codes_dtype'] == 'uint8'
+    assert usage['indexes_dtype'] == 'uint8'
+    assert usage['postings'] == 200
+    assert usage['total'] >= usage['keys'] + usage['codes'] + usage['indexes'] == 600
+    traxit_db.insert_fingerprint(pd.DataFrame({'key': [70000]}), '2')
+    assert traxit_db.memory_usage()['keys_dtype'] == 'int32'
+    assert traxit_db.query_track_ids([70000, -100], 2) == ['1', '2']
+
+
+def test_insert_fingerprint_not_integer(traxit_db, make_db):
+    with pytest.raises(TypeError):
+        traxit_db.insert_fingerprint(pd.DataFrame({'key': ['a', 'b']}), 'trackid')
+    # The rejected track is not registered, so it can be inserted again
+    assert not traxit_db.is_ingested_fingerprint('trackid')
+    assert traxit_db.stats()['postings'] == 0
+    traxit_db.insert_fingerprint(pd.DataFrame({'key': [1, 2]}), 'trackid')
+    with pytest.raises(TypeError):
+        traxit_db.insert_fingerprints([('other', pd.DataFrame({'key': [1.5]}))])
+    # An overridden track is kept if its new fingerprint is rejected
+    with pytest.raises(TypeError):
+        traxit_db.insert_fingerprint(pd.DataFrame({'key': [0.5]}), 'trackid', override=True)
+    for db in (traxit_db, make_db()):
+        assert db.get_fp_ids() == ['trackid']
+        assert db.query_track_ids({2}, 1) == ['trackid']
+
+
+def test_insert_fingerprints_mixed_dtypes(make_db):
+    # Keys above 2 ** 32 are stored unsigned, negative keys signed
+    db = make_db()
+    db.insert_fingerprints([('large', pd.DataFrame({'key': [2 ** 40, 7]})),
+                            ('negative', pd.DataFrame({'key': [-1, 7]}))])
+    for db in (db, make_db(read_only=True)):
+        assert db.query_track_ids({2 ** 40}, 2) == ['large']
+        assert db.query_track_ids({-1}, 2) == ['negative']
+        assert sorted(db.query_track_ids({7}, 2)) == ['large', 'negative']
+
+
+def test_key_frequencies_mixed_dtypes(make_db):
+    db = make_db()
+    db.insert_fingerprint(pd.DataFrame({'key': [-5, 2, 3]}), 'negative')
+    db.insert_fingerprint(pd.DataFrame({'key': [2 ** 40, 3]}), 'large')
+    for db in (db, make_db(read_only=True)):
+        assert db.key_frequencies([-5, 3, 2 ** 40, 4]).tolist() == [1, 2, 1, 0]
+        assert db.query_track_ids({2 ** 40}, 2) == ['large']
+
+
+def test_query_track_ids_order(traxit_db):
+    traxit_db.insert_fingerprints([('1', pd.DataFrame({'key': [1, 2]})),
+                                   ('2', pd.DataFrame({'key': [1, 2, 3]})),
+                                   ('3', pd.DataFrame({'key': [2, 4]})),
+                                   ('4', pd.DataFrame({'key': [5]}))])
+    assert traxit_db.query_track_ids({1, 2, 3, 4}, 10) == ['2', '1', '3']
+    assert traxit_db.query_track_ids({1, 2, 3, 4}, 2, quality=1) == ['2', '1']
+    assert traxit_db.query_track_ids({6}, 10) == []
+    with pytest.raises(ValueError):
+        traxit_db.query_track_ids({1}, 1, quality=0)
+
+
+def test_top_k_ties():
+    from traxit_manage.in_memory_db import _top_k
+    # Codes 2 to 5 are tied at the boundary of the pool
+    counts = np.array([1, 3, 2, 2, 2, 2, 3, 0])
+    assert _top_k(counts, 3).tolist() == [1, 6, 2]
+    assert _top_k(counts, 2, pool=3).tolist() == [1, 6]
+    rng = np.random.RandomState(0)
+    for _ in range(200):
+        counts = rng.randint(0, 4, size=30)
+        size = rng.randint(1, 10)
+        expected = [code for code in np.argsort(-counts, kind='mergesort').tolist() if counts[code]][:size]
+        assert _top_k(counts, size).tolist() == expected
+
+
+def test_query_keys_arrays(fingerprints, traxit_db):
+    traxit_db.insert_fingerprints(fingerprints)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    matches = traxit_db.query_keys_arrays({1, 2, 3, 5}, [track_id2, track_id1])
+    assert [matches.track_ids[code] for code in matches.codes] == [track_id1, track_id1, track_id2, track_id2, track_id2]
+    assert matches.keys.tolist() == [1, 2, 1, 2, 3]
+    assert matches.offsets.tolist() == [0, 2, 3, 5, 6, 7]
+    assert matches.indexes.tolist() == [0, 3, 1, 0, 3, 1, 2]
+
+
+def test_read_only(fingerprints, traxit_db, make_db):
+    import pickle
+    traxit_db.insert_fingerprints(fingerprints)
+    for db in (make_db(read_only=True), pickle.loads(pickle.dumps(traxit_db))):
+        assert db.read_only
+        assert isinstance(db._index.codes, np.memmap)
+        assert db.query_track_ids({3}, 1) == [fingerprints[1][0]]
+        with pytest.raises(ValueError):
+            db.insert_fingerprint(fingerprints[0][1], 'trackid')
+        with pytest.raises(ValueError):
+            db.delete_all()
+
+
+def test_read_only_empty(fingerprints, make_db):
+    import pickle
+    db = make_db()
+    # A new database can be attached to before anything is inserted
+    for attached_db in (make_db(read_only=True), pickle.loads(pickle.dumps(db))):
+        assert attached_db.get_fp_ids() == []
+        assert attached_db.query_track_ids({1}, 1) == []
+    db.insert_fingerprints(fingerprints)
+    db.delete_all()
+    assert make_db(read_only=True).get_fp_ids() == []
+
+
+def test_read_only_missing(make_db):
+    with pytest.raises(ValueError):
+        make_db(read_only=True)
+
+
+def test_query_many(traxit_db):
+    rng = np.random.RandomState(0)
+    traxit_db.insert_fingerprints((str(i), pd.DataFrame({'key': rng.randint(0, 300, size=200)}))
+                                  for i in range(20))
+    list_of_keys = [rng.randint(0, 300, size=50) for _ in range(5)] + [[], {1000}]
+    list_of_track_ids = traxit_db.query_track_ids_many(list_of_keys, 3)
+    assert list_of_track_ids == [traxit_db.query_track_ids(keys, 3) for keys in list_of_keys]
+    list_of_matches = traxit_db.query_keys_many(list_of_keys, list_of_track_ids)
+    for keys, track_ids, matches in zip(list_of_keys, list_of_track_ids, list_of_matches):
+        expected = traxit_db.query_keys_arrays(keys, track_ids)
+        assert set(matches) == set(track_ids)
+        for track_id in track_ids:
+            code = traxit_db._track_codes[track_id]
+            for key, value in matches[track_id].items():
+                entry = np.flatnonzero((expected.codes == code) & (expected.keys == key))[0]
+                assert value['index'].tolist() == expected.indexes[expected.offsets[entry]:expected.offsets[entry + 1]].tolist()
+
+
+@pytest.mark.parametrize('options', [{}, {'idf_weighting': True}])
+def test_query_many_same_results(make_db, options):
+    rng = np.random.RandomState(1)
+    db = make_db(compaction_threshold=None, **options)
+    for _ in range(20):
+        db.delete_all()
+        n_tracks = rng.randint(1, 30)
+        db.insert_fingerprints(('t' + str(i), pd.DataFrame({'key': rng.randint(0, 40, size=rng.randint(1, 20))}))
+                               for i in range(n_tracks))
+        db.delete_fingerprint('t0')
+        list_of_keys = [rng.randint(0, 40, size=rng.randint(0, 10)) for _ in range(5)]
+        for size, quality in ((1, 1), (3, 1), (3, 5)):
+            assert (db.query_track_ids_many(list_of_keys, size, quality=quality) ==
+                    [db.query_track_ids(keys, size, quality=quality) for keys in list_of_keys])
+
+
+def test_query_cache(fingerprints, make_db):
+    db = make_db(cache_size=2)
+    assert db.cache_info()['hits'] == 0
+    db.insert_fingerprints(fingerprints)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    assert db.query_track_ids([3, 1, 3], 1) == [track_id2]
+    assert db.query_track_ids({1, 3}, 1) == [track_id2]
+    db.query_keys({1, 2}, [track_id1])
+    db.query_keys([2, 1], [track_id1])
+    assert db.cache_info() == {'hits': 2, 'misses': 2, 'size': 2, 'max_entries': 2}
+    db.query_track_ids({1, 3}, 2)
+    assert db.cache_info()['size'] == 2
+    db.delete_fingerprint(track_id2)
+    assert db.cache_info()['size'] == 0
+    assert db.query_track_ids({1, 3}, 1) == [track_id1]
+
+
+def test_delete_fingerprint_tombstone(fingerprints, make_db):
+    db = make_db(compaction_threshold=None)
+    db.insert_fingerprints(fingerprints)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    db.delete_fingerprint(track_id1)
+    # The postings are still there, only the tombstone was written
+    assert len(db._index) == 8
+    assert db.query_track_ids({1, 2, 4}, 2) == [track_id2]
+    assert db.query_track_ids_many([{4}, {1}], 2) == [[], [track_id2]]
+    assert make_db().query_track_ids({1, 2, 4}, 2) == [track_id2]
+    assert make_db().get_fp_ids() == [track_id2]
+
+    db.compact()
+    assert len(db._index) == 4
+    assert db._track_ids == [track_id2]
+    loaded_db = make_db()
+    assert loaded_db.query_track_ids({1, 2, 4}, 2) == [track_id2]
+    assert (loaded_db.query_fingerprint(track_id2) == fingerprints[1][1]).all().all()
+
+
+def test_compaction_threshold(fingerprints, make_db):
+    db = make_db(compaction_threshold=0.5)
+    db.insert_fingerprints(fingerprints)
+    db.delete_fingerprint(fingerprints[0][0])
+    assert len(db._index) == 4
+    assert db.memory_usage()['deleted_postings'] == 0
+
+
+def test_delete_key(fingerprints, make_db):
+    db = make_db(compaction_threshold=None)
+    db.insert_fingerprints(fingerprints)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    db.delete_key(4)
+    assert db.query_track_ids({4}, 2) == []
+    assert db.query_track_ids({3, 4}, 2) == [track_id2]
+    assert list(db.query_keys({2, 4}, [track_id1])[track_id1]) == [2]
+    assert make_db().query_track_ids({4}, 2) == []
+    db.compact()
+    assert len(db._index) == 7
+    assert db.query_track_ids({4}, 2) == []
+
+
+def test_get_fp_ids_pagination(fingerprints, make_db):
+    db = make_db(compaction_threshold=None)
+    fps = [(track_id + str(i), fp) for i in range(3) for track_id, fp in fingerprints]
+    db.insert_fingerprints(fps)
+    track_ids = [track_id for track_id, _ in fps]
+    assert db.get_fp_ids(size=10) == track_ids
+    assert db.get_fp_ids(offset=2, size=3) == track_ids[2:5]
+    db.delete_fingerprint(track_ids[1])
+    assert db.get_fp_ids(offset=1, size=2) == track_ids[2:4]
+
+
+def test_stats(fingerprints, make_db):
+    db = make_db(compaction_threshold=None)
+    db.insert_fingerprints(fingerprints)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    stats = db.stats()
+    assert (stats['tracks'], stats['postings'], stats['keys'], stats['distinct_keys']) == (2, 8, 6, 4)
+    assert stats['per_track'][track_id1] == {'postings': 4, 'keys': 3}
+    assert db.track_stats(track_id2) == {'code': 1, 'postings': 4, 'keys': 3}
+    assert db.track_stats('unknown') is None
+
+    db.delete_key(1)
+    db.delete_fingerprint(track_id1)
+    stats = db.stats()
+    assert (stats['tracks'], stats['postings'], stats['keys'], stats['distinct_keys']) == (1, 2, 2, 3)
+    assert stats['per_track'] == {track_id2: {'postings': 2, 'keys': 2}}
+    assert make_db().stats() == stats
+    db.compact()
+    stats = db.stats()
+    assert (stats['postings'], stats['keys'], stats['distinct_keys'], stats['deleted_postings']) == (2, 2, 2, 0)
+
+
+def test_warm(fingerprints, traxit_db, make_db):
+    assert traxit_db.warm() == 0
+    traxit_db.insert_fingerprints(fingerprints)
+    loaded_db = make_db()
+    progress = []
+    assert loaded_db.warm(n_jobs=2, progress=progress.append) == loaded_db.memory_usage()['postings_bytes']
+    assert sum(progress) == loaded_db.memory_usage()['postings_bytes']
+    assert loaded_db.query_track_ids({3}, 2) == [fingerprints[1][0]]
+
+
+def test_key_frequencies(fingerprints, traxit_db, make_db):
+    traxit_db.insert_fingerprints(fingerprints)
+    assert traxit_db.key_frequencies([1, 2, 3, 4, 5]).tolist() == [2, 2, 1, 1, 0]
+    assert make_db().key_frequencies([1, 3]).tolist() == [2, 1]
+    traxit_db.delete_fingerprint(fingerprints[0][0])
+    assert traxit_db.key_frequencies([1, 2, 3, 4, 5]).tolist() == [1, 1, 1, 0, 0]
+
+
+def test_cutoff_frequency(fingerprints, make_db):
+    db = make_db(cutoff_frequency=0.5)
+    fps = fingerprints + [('other', pd.DataFrame({'key': [5, 6]}))]
+    db.insert_fingerprints(fps)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    # Keys 1 and 2 are in two tracks out of three
+    assert db.query_track_ids({1, 2}, 2) == []
+    assert db.query_track_ids({1, 2, 4}, 2) == [track_id1]
+    assert db.query_track_ids_many([{1, 2}, {1, 3}], 2) == [[], [track_id2]]
+    assert make_db(cutoff_frequency=2).query_track_ids({1, 2}, 2) == [track_id1, track_id2]
+
+
+def test_idf_weighting(fingerprints, make_db):
+    db = make_db(idf_weighting=True)
+    fps = fingerprints + [('other', pd.DataFrame({'key': [1, 1, 1, 1]})),
+                          ('other2', pd.DataFrame({'key': [1]})),
+                          ('other3', pd.DataFrame({'key': [1]}))]
+    db.insert_fingerprints(fps)
+    # Without weighting, the four postings of the common key 1 win
+    assert make_db().query_track_ids({1, 4}, 1) == ['other']
+    assert db.query_track_ids({1, 4}, 1) == [fingerprints[0][0]]
+    assert db.query_track_ids_many([{1, 4}], 1) == [[fingerprints[0][0]]]
+    track_id, score = db.query_track_scores({4}, 1)[0]
+    assert score == pytest.approx(np.log1p(5.0))
+
+
+def test_recover_interrupted_insert(fingerprints, make_db):
+
+    def interrupted():
+        for track_id, fp in fingerprints:
+            yield track_id, fp
+        raise KeyboardInterrupt
+
+    db = make_db()
+    with pytest.raises(KeyboardInterrupt):
+        db.insert_fingerprints(interrupted())
+    # Not persisted yet, only logged
+    assert not os.path.exists(os.path.join(db._snapshot_path(), 'keys.npy'))
+    recovered_db = make_db()
+    assert recovered_db.get_fp_ids() == [track_id for track_id, _ in fingerprints]
+    assert recovered_db.query_track_ids({3}, 2) == [fingerprints[1][0]]
+    assert (recovered_db.query_fingerprint(fingerprints[0][0]) == fingerprints[0][1]).all().all()
+    # The recovered changes were written in a snapshot
+    assert not os.path.exists(recovered_db._wal.path)
+
+
+def test_recover_mixed_dtypes(make_db):
+
+    def interrupted():
+        yield 'negative', pd.DataFrame({'key': [-5, 2, 3]})
+        yield 'large', pd.DataFrame({'key': [2 ** 40, 3]})
+        raise KeyboardInterrupt
+
+    db = make_db()
+    db.insert_fingerprint(pd.DataFrame({'key': [1]}), 'first')
+    with pytest.raises(KeyboardInterrupt):
+        db.insert_fingerprints(interrupted())
+    # Attaching replays the log without persisting it
+    for recovered_db in (make_db(read_only=True), make_db()):
+        assert recovered_db.get_fp_ids() == ['first', 'negative', 'large']
+        assert recovered_db.query_track_ids({2 ** 40}, 2) == ['large']
+        assert recovered_db.key_frequencies([3]).tolist() == [2]
+
+
+def test_recover_interrupted_save(fingerprints, make_db):
+    from mock import patch
+    from traxit_manage.in_memory_db import ForwardIndex
+    db = make_db()
+    db.insert_fingerprints(fingerprints[:1])
+    snapshot = db._snapshot_path()
+    # The postings of the new snapshot are written, not the postings by track
+    with patch.object(ForwardIndex, 'save', side_effect=IOError('No space left on device')):
+        with pytest.raises(IOError):
+            db.insert_fingerprints(fingerprints[1:])
+    assert os.path.exists(os.path.join(db._snapshot_path(db._snapshot + 1), 'keys.npy'))
+    assert os.path.exists(os.path.join(snapshot, 'keys.npy'))
+    # The previous snapshot is loaded, and completed from the log
+    recovered_db = make_db()
+    assert recovered_db.get_fp_ids() == [track_id for track_id, _ in fingerprints]
+    assert recovered_db.query_track_ids({3}, 2) == [fingerprints[1][0]]
+    assert (recovered_db.query_fingerprint(fingerprints[0][0]) == fingerprints[0][1]).all().all()
+    # The interrupted snapshot is removed with the previous one
+    assert sorted(os.listdir(recovered_db.store_in)) == sorted([os.path.basename(recovered_db._snapshot_path()),
+                                                                'tracks.json'])
+
+
+def test_snapshots(fingerprints, make_db):
+    import json
+    db = make_db()
+    db.insert_fingerprints(fingerprints[:1])
+    previous = db._snapshot_path()
+    attached_db = make_db(read_only=True)
+    db.insert_fingerprints(fingerprints[1:])
+    # The catalog points to the new snapshot, the previous one is removed
+    with open(os.path.join(db.store_in, 'tracks.json')) as f:
+        assert os.path.join(db.store_in, 'snapshot-{0}'.format(json.load(f)['snapshot'])) == db._snapshot_path()
+    assert not os.path.exists(previous)
+    # Attached processes keep seeing the database as it was
+    assert attached_db.get_fp_ids() == [fingerprints[0][0]]
+    assert attached_db.query_track_ids({1}, 2) == [fingerprints[0][0]]
+    assert make_db(read_only=True).get_fp_ids() == [track_id for track_id, _ in fingerprints]
+
+
+def test_columns_in_store(fingerprints, make_db):
+    import json
+    db = make_db()
+    db.insert_fingerprints(fingerprints[:1])
+    # Stores saved before the snapshots kept the columns in the store directory
+    snapshot = db._snapshot_path()
+    for name in os.listdir(snapshot):
+        os.rename(os.path.join(snapshot, name), os.path.join(db.store_in, name))
+    os.rmdir(snapshot)
+    with open(os.path.join(db.store_in, 'tracks.json')) as f:
+        catalog = json.load(f)
+    del catalog['snapshot']
+    catalog['version'] = 3
+    with open(os.path.join(db.store_in, 'tracks.json'), 'w') as f:
+        json.dump(catalog, f)
+
+    db = make_db()
+    assert db._snapshot_path() == db.store_in
+    assert db.query_track_ids({1}, 2) == [fingerprints[0][0]]
+    db.insert_fingerprints(fingerprints[1:])
+    assert sorted(os.listdir(db.store_in)) == sorted([os.path.basename(db._snapshot_path()), 'tracks.json'])
+    assert make_db(read_only=True).query_track_ids({3}, 2) == [fingerprints[1][0]]
+
+
+def test_insert_fingerprints_iterable_raises(fingerprints, make_db):
+    def failing():
+        for track_id, fp in fingerprints:
+            yield track_id, fp
+        raise ValueError('Cannot read the next fingerprint')
+
+    db = make_db()
+    with pytest.raises(ValueError):
+        db.insert_fingerprints(failing())
+    # The tracks read before the error have their postings
+    assert db.query_track_ids({3}, 2) == [fingerprints[1][0]]
+    db.insert_fingerprint(pd.DataFrame({'key': [5]}), 'other')
+    loaded_db = make_db()
+    assert loaded_db.get_fp_ids() == [track_id for track_id, _ in fingerprints] + ['other']
+    assert loaded_db.query_track_ids({4}, 2) == [fingerprints[0][0]]
+    assert loaded_db.stats()['postings'] == 9
+
+
+def test_recover_snapshot_and_torn_log(fingerprints, make_db):
+
+    def interrupted():
+        for i in range(3):
+            for track_id, fp in fingerprints:
+                yield track_id + str(i), fp
+        raise KeyboardInterrupt
+
+    db = make_db(snapshot_every=4)
+    with pytest.raises(KeyboardInterrupt):
+        db.insert_fingerprints(interrupted())
+    # The first 4 tracks are in a snapshot, the last 2 only in the log
+    assert make_db(read_only=True).keys_count() == 6
+    with open(db._wal.path, 'r+b') as f:
+        f.truncate(os.path.getsize(db._wal.path) - 1)
+    assert make_db().keys_count() == 5
+
+
+def test_memory_budget(fingerprints, traxit_db, make_db):
+    from traxit_manage.in_memory_db import POSTINGS_CACHE_ENTRY_BYTES
+    traxit_db.insert_fingerprints(fingerprints)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    # Each posting takes 2 bytes: the posting lists of key 1 (4 postings) and key 3 (1 posting) do not both fit
+    db = make_db(memory_budget=9 + POSTINGS_CACHE_ENTRY_BYTES)
+    assert db.query_track_ids({1, 3}, 2) == traxit_db.query_track_ids({1, 3}, 2) == [track_id2, track_id1]
+    assert db._resident.info()['misses'] == 2
+    assert db.memory_usage()['resident'] == 2 + POSTINGS_CACHE_ENTRY_BYTES
+    # The resident posting lists are copies of postings already counted
+    assert db.memory_usage()['total'] == traxit_db.memory_usage()['total']
+    assert db.query_track_ids({3}, 2) == [track_id2]
+    assert db._resident.info()['hits'] == 1
+    matches, expected = db.query_keys_arrays({1, 2}, [track_id1]), traxit_db.query_keys_arrays({1, 2}, [track_id1])
+    assert all((values == expected_values).all() for values, expected_values in zip(matches[1:], expected[1:]))
+    assert db.query_track_ids_many([{4}, set()], 2) == [[track_id1], []]
+
+
+def test_postings_cache_absent_keys():
+    from traxit_manage.in_memory_db import InvertedIndex
+    from traxit_manage.in_memory_db import PostingsCache
+    index = InvertedIndex(np.array([1, 1, 3]), np.array([0, 1, 1]), np.array([0, 0, 1]))
+    resident = PostingsCache(10 ** 6)
+    values, lengths = index.take(np.array([1, 2, 5, 3]), ('codes',), resident)
+    assert values['codes'].tolist() == [0, 1, 1] and lengths.tolist() == [2, 0, 0, 1]
+    # The empty lists of the absent keys are not cached
+    assert resident.info()['size'] == 2
+
+
+def test_searchsorted_narrow_dtype():
+    from traxit_manage.in_memory_db import _searchsorted
+    sorted_values = np.array([0, 3, 3, 255], dtype=np.uint8)
+    values = np.array([-1, 0, 3, 4, 255, 256, 1000], dtype=np.int64)
+    for side in ('left', 'right'):
+        assert (_searchsorted(sorted_values, values, side=side).tolist() ==
+                np.searchsorted(sorted_values.astype(np.int64), values, side=side).tolist())
+
+
+def test_export_import(fingerprints, traxit_db, db_name, tmpdir):
+    from traxit_manage.in_memory_db import export_database
+    from traxit_manage.in_memory_db import import_database
+    traxit_db.insert_fingerprints(fingerprints)
+    traxit_db.delete_key(4)
+    path = str(tmpdir.join('db.traxit'))
+    assert export_database(db_name, path) == os.path.getsize(path)
+    with pytest.raises(ValueError):
+        import_database(path)
+    imported_db = import_database(path, db_name=db_name + '_imported')
+    try:
+        assert isinstance(imported_db._index.keys, np.memmap)
+        assert imported_db.get_fp_ids() == traxit_db.get_fp_ids()
+        assert imported_db.query_track_ids({3, 4}, 2) == [fingerprints[1][0]]
+        assert imported_db.stats() == traxit_db.stats()
+    finally:
+        imported_db.delete_all()
+
+
+def test_import_corrupted(fingerprints, traxit_db, db_name, tmpdir):
+    from traxit_manage.in_memory_db import export_database
+    from traxit_manage.in_memory_db import import_database
+    traxit_db.insert_fingerprints(fingerprints)
+    path = str(tmpdir.join('db.traxit'))
+    export_database(db_name, path)
+    with open(path, 'r+b') as f:
+        f.seek(4096 + 10)
+        f.write(b'!')
+    with pytest.raises(ValueError):
+        import_database(path, db_name=db_name + '_imported')
+    assert not os.path.exists('/tmp/' + db_name + '_imported')
+
+
+@pytest.mark.parametrize('name', ['../evil.npy', '/tmp/evil.npy', 'snapshot-1/../../evil.npy', 'evil.npy',
+                                  'other/keys.npy'])
+def test_import_unexpected_file(fingerprints, traxit_db, db_name, tmpdir, name):
+    import json
+    from traxit_manage.in_memory_db import ARCHIVE_HEADER
+    from traxit_manage.in_memory_db import export_database
+    from traxit_manage.in_memory_db import import_database
+    traxit_db.insert_fingerprints(fingerprints)
+    path = str(tmpdir.join('db.traxit'))
+    export_database(db_name, path)
+    with open(path, 'r+b') as f:
+        magic, version, offset, length = ARCHIVE_HEADER.unpack(f.read(ARCHIVE_HEADER.size))
+        f.seek(offset)
+        manifest = json.loads(f.read(length).decode('utf-8'))
+        manifest['files'][-1]['name'] = name
+        manifest = json.dumps(manifest).encode('utf-8')
+        f.seek(offset)
+        f.write(manifest)
+        f.truncate()
+        f.seek(0)
+        f.write(ARCHIVE_HEADER.pack(magic, version, offset, len(manifest)))
+    with pytest.raises(ValueError):
+        import_database(path, db_name=db_name + '_imported')
+    assert not os.path.exists('/tmp/' + db_name + '_imported')
+    assert not os.path.exists('/tmp/evil.npy')
+
+
+def test_bloom_filter():
+    from traxit_manage.in_memory_db import BloomFilter
+    keys = np.arange(0, 20000, 2)
+    bloom = BloomFilter.from_keys(keys[:5000], capacity=len(keys))
+    bloom.add(keys[5000:])
+    assert bloom.contains(keys).all()
+    assert bloom.contains(np.array([-2 ** 40, 2 ** 62])).shape == (2,)
+    assert bloom.contains(np.array([], dtype=np.int64)).shape == (0,)
+    # About 1% of false positives
+    assert bloom.contains(keys + 1).mean() < 0.03
+
+
+def test_bloom_filter_persisted(fingerprints, traxit_db, make_db, mocker):
+    traxit_db.insert_fingerprints(fingerprints)
+    assert traxit_db._bloom.contains(np.array([1, 2, 3, 4])).all()
+    assert os.path.exists(os.path.join(traxit_db._snapshot_path(), 'bloom.npy'))
+    loaded_db = make_db(read_only=True)
+    assert (loaded_db._bloom.bits == traxit_db._bloom.bits).all()
+    assert loaded_db.memory_usage()['bloom'] == traxit_db._bloom.nbytes
+    # Absent keys do not reach the postings
+    take = mocker.spy(loaded_db._index, 'take')
+    assert loaded_db.query_track_ids({3, 1000, 1001}, 2) == [fingerprints[1][0]]
+    assert take.call_args[0][0].tolist() == [3]
+
+
+def test_bloom_filter_grows(fingerprint, make_db):
+    db = make_db()
+    db.insert_fingerprint(fingerprint[1], fingerprint[0])
+    capacity = db._bloom.capacity
+    keys = np.arange(100, 100 + 4 * capacity)
+    db.insert_fingerprint(pd.DataFrame({'key': keys}), 'many_keys')
+    assert db._bloom.capacity > capacity
+    assert db.query_track_ids(set(keys.tolist()), 1) == ['many_keys']
+    assert make_db()._bloom.contains(keys).all()
+    db.delete_fingerprint('many_keys')
+    db.compact()
+    assert db._bloom.capacity == capacity
+
+
+def test_forward_index(fingerprints, make_db, mocker):
+    db = make_db(compaction_threshold=None)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    db.insert_fingerprints(fingerprints)
+    db.insert_fingerprint(pd.DataFrame({'key': [300, 3, 70000, 3]}), '3')
+    db.insert_fingerprint(pd.DataFrame({'key': [3]}), track_id1, override=True)
+    # Candidates are searched in their own postings only
+    take = mocker.spy(db._index, 'take')
+    expected = {'3': {3: [1, 3], 300: [0]}, track_id1: {3: [0]}, track_id2: {1: [0, 3], 3: [2]}}
+    for loaded_db in (db, make_db(read_only=True)):
+        result = loaded_db.query_keys({1, 3, 300, 5}, ['3', track_id1, track_id2, 'unknown'])
+        assert dict((track_id, dict((key, value['index'].tolist()) for key, value in matches.items()))
+                    for track_id, matches in result.items()) == expected
+    assert not take.called
+    db.delete_key(1)
+    db.delete_fingerprint('3')
+    db.compact()
+    assert db._forward.offsets.tolist() == [0, 2, 3]
+    assert db.query_keys({1, 2, 3}, [track_id1, track_id2])[track_id2][2]['index'].tolist() == [1]
+    assert db.query_keys({1, 2, 3}, [track_id1, '3']).keys() == {track_id1: None}.keys()
@@ -70,7 +70,9 @@ def test_ingest_references(cli, db_name,
                       cli=cli,
                       db_name=db_name,
                       erase=False)
+    inserted = [fp for args, _ in mock_db_config.insert_fingerprints.call_args_list
+                for fp in args[0]]
     if is_ingested:
-        assert (mock_db_config.insert_fingerprint.call_args_list == [])
+        assert inserted == []
     else:
-        assert (len(mock_db_config.insert_fingerprint.call_args_list) == 2)
+        assert len(inserted) == 2
@@ -0,0 +1,115 @@
+import pandas as pd
+import pytest
+
+
+@pytest.yield_fixture(scope='function')
+def sharded_db(db_name):
+    from traxit_manage.sharded_db import ShardedDb
+    db = ShardedDb(db_name, n_shards=3)
+    yield db
+    db.delete_all()
+    db.close()
+
+
+def test_insert_and_query(fingerprints, sharded_db):
+    sharded_db.insert_fingerprints(fingerprints)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    assert sharded_db.keys_count() == 2
+    assert sharded_db.is_ingested_fingerprint(track_id1)
+    assert not sharded_db.is_ingested_fingerprint('unknown')
+    assert sharded_db.query_track_ids({3}, 2) == [track_id2]
+    assert sharded_db.query_track_scores({1, 3}, 2)[0] == (track_id2, 3)
+    result = sharded_db.query_keys({1, 2, 3}, [track_id1, track_id2])
+    assert result[track_id1][1]['index'].tolist() == [0, 3]
+    assert result[track_id2][3]['index'].tolist() == [2]
+    assert (sharded_db.query_fingerprint(track_id1) == fingerprints[0][1]).all().all()
+    assert sorted(sharded_db.get_fp_ids()) == sorted([track_id1, track_id2])
+    assert len(sharded_db.get_fp_ids(offset=1)) == 1
+
+
+def test_same_results_as_one_database(fingerprints, sharded_db, traxit_db):
+    fps = [(track_id + str(i), fp) for i in range(5) for track_id, fp in fingerprints]
+    sharded_db.insert_fingerprints(fps)
+    traxit_db.insert_fingerprints(fps)
+    for keys in ({1}, {3}, {4}, {2, 3}):
+        assert (sorted(sharded_db.query_track_scores(keys, 10)) ==
+                sorted(traxit_db.query_track_scores(keys, 10)))
+    # Ties may be broken differently, but not the counts
+    assert ([count for _, count in sharded_db.query_track_scores({2, 3}, 4)] ==
+            [count for _, count in traxit_db.query_track_scores({2, 3}, 4)])
+
+
+def test_insert_fingerprints_batches(db_name, mocker):
+    from traxit_manage.sharded_db import ShardedDb
+    db = ShardedDb(db_name, n_shards=2, batch_size=2)
+    try:
+        scatter = mocker.spy(db, '_scatter')
+
+        def fps():
+            for i in range(10):
+                yield str(i), pd.DataFrame({'key': [i]})
+            raise ValueError('Cannot read the next fingerprint')
+
+        with pytest.raises(ValueError):
+            db.insert_fingerprints(fps())
+        # No shard is sent more than batch_size tracks at once
+        batches = [request[1][0] for call in scatter.call_args_list for request in call[0][0].values()]
+        assert max(len(batch) for batch in batches) == 2
+        # The tracks read before the error are inserted
+        assert sorted(db.get_fp_ids(size=20)) == [str(i) for i in range(10)]
+        assert db.query_track_ids({7}, 1) == ['7']
+    finally:
+        db.delete_all()
+        db.close()
+
+
+def test_delete_fingerprint(fingerprints, sharded_db):
+    sharded_db.insert_fingerprints(fingerprints)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    sharded_db.delete_fingerprint(track_id1)
+    assert sharded_db.query_track_ids({1, 2, 4}, 2) == [track_id2]
+    assert sharded_db.keys_count() == 1
+
+
+def test_shard_error(sharded_db):
+    with pytest.raises(TypeError):
+        sharded_db.insert_fingerprint('a', 'trackid')
+
+
+def test_pickle(fingerprints, sharded_db):
+    import pickle
+    sharded_db.insert_fingerprints(fingerprints)
+    copy = pickle.loads(pickle.dumps(sharded_db))
+    try:
+        assert copy.n_shards == 3
+        assert copy.query_track_ids({3}, 2) == [fingerprints[1][0]]
+    finally:
+        copy.close()
+    # Closing the copy only disconnects it
+    assert sharded_db.query_track_ids({3}, 2) == [fingerprints[1][0]]
+
+
+def _fake_tracklist_file(broadcast, cli, corpus_path, filepath, fingerprinting_instance, introspect_trackids,
+                         matching_instance, *args):
+    # The workers query the shards at the same time: a reply read by the wrong worker would be the other track
+    key = 4 if filepath.startswith('/a') else 3
+    return [matching_instance.query_track_ids({key}, 1)[0] for _ in range(50)]
+
+
+def test_get_tracklist_jobs(mocker, fingerprints, sharded_db):
+    from traxit_manage.tracklist import get_tracklist
+    sharded_db.insert_fingerprints(fingerprints)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    list_of_files = ['/a{0}.mp3'.format(i) for i in range(4)] + ['/b{0}.mp3'.format(i) for i in range(4)]
+    mocker.patch('traxit_manage.tracklist.clean_list_of_files', return_value=list_of_files)
+    mocker.patch('traxit_manage.tracklist.configure_fingerprinting')
+    mocker.patch('traxit_manage.tracklist.configure_matching',
+                 side_effect=lambda pipeline, fingerprinting_instance, db_instance: db_instance)
+    mocker.patch('traxit_manage.tracklist.configure_tracklisting')
+    mocker.patch('traxit_manage.tracklist.get_tracklist_file', side_effect=_fake_tracklist_file)
+
+    files, tls = get_tracklist(list_of_files, sharded_db, None, None, None, '/the_corpus_path', 'broadcast', jobs=4)
+
+    assert tls == [[track_id1] * 50] * 4 + [[track_id2] * 50] * 4
+    # The shards still answer the parent process
+    assert sharded_db.query_track_ids({3}, 2) == [track_id2]
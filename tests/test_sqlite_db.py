@@ -0,0 +1,100 @@
+import os
+import pickle
+
+import pandas as pd
+import pytest
+
+
+@pytest.yield_fixture(scope='function')
+def sqlite_db(db_name):
+    from traxit_manage.sqlite_db import DbSqlite
+    db = DbSqlite(db_name, commit_every=2)
+    yield db
+    db.delete_all()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db.path + suffix):
+            os.remove(db.path + suffix)
+
+
+def test_insert_and_query(fingerprints, sqlite_db):
+    sqlite_db.insert_fingerprints(fingerprints)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    assert sqlite_db.keys_count() == 2
+    assert sqlite_db.is_ingested_fingerprint(track_id1)
+    assert not sqlite_db.is_ingested_fingerprint('unknown')
+    assert sqlite_db.query_track_ids({3}, 2) == [track_id2]
+    assert sqlite_db.query_track_ids({1, 2}, 2) == [track_id1, track_id2]
+    assert sqlite_db.query_track_scores({1, 3}, 2) == [(track_id2, 3), (track_id1, 2)]
+    result = sqlite_db.query_keys({1, 2, 3}, [track_id1, track_id2, 'unknown'])
+    assert result[track_id1][1]['index'].tolist() == [0, 3]
+    assert 3 not in result[track_id1]
+    assert result[track_id2][3]['index'].tolist() == [2]
+    assert (sqlite_db.query_fingerprint(track_id1) == fingerprints[0][1]).all().all()
+    assert sqlite_db.get_fp_ids() == [track_id1, track_id2]
+    assert sqlite_db.get_fp_ids(offset=1) == [track_id2]
+
+
+def test_same_results_as_in_memory_db(fingerprints, sqlite_db, traxit_db):
+    fps = [(track_id + str(i), fp) for i in range(3) for track_id, fp in fingerprints]
+    sqlite_db.insert_fingerprints(fps)
+    traxit_db.insert_fingerprints(fps)
+    for keys in ({1}, {3}, {4}, {2, 3}, {5}):
+        assert sqlite_db.query_track_scores(keys, 4) == traxit_db.query_track_scores(keys, 4)
+        track_ids = sqlite_db.query_track_ids(keys, 4)
+        assert (dict((track_id, dict((key, value['index'].tolist()) for key, value in matches.items()))
+                     for track_id, matches in sqlite_db.query_keys(keys, track_ids).items()) ==
+                dict((track_id, dict((key, value['index'].tolist()) for key, value in matches.items()))
+                     for track_id, matches in traxit_db.query_keys(keys, track_ids).items()))
+
+
+def test_override(fingerprints, sqlite_db):
+    track_id, fp = fingerprints[0]
+    sqlite_db.insert_fingerprint(fp, track_id)
+    sqlite_db.insert_fingerprint(fingerprints[1][1], track_id)
+    assert sqlite_db.query_track_ids({3}, 1) == []
+    sqlite_db.insert_fingerprint(fingerprints[1][1], track_id, override=True)
+    assert sqlite_db.query_track_ids({3}, 1) == [track_id]
+    assert sqlite_db.keys_count() == 1
+
+
+def test_failed_insert_is_rolled_back(fingerprints, sqlite_db):
+    fps = list(fingerprints) + [('trackid', pd.DataFrame({'key': ['a', 'b']}))]
+    with pytest.raises(TypeError):
+        sqlite_db.insert_fingerprints(fps)
+    # The first transaction was committed
+    assert sqlite_db.keys_count() == 2
+    assert not sqlite_db.is_ingested_fingerprint('trackid')
+    with pytest.raises(TypeError):
+        sqlite_db.insert_fingerprint('a', 'trackid')
+    with pytest.raises(ValueError):
+        sqlite_db.query_track_ids({1}, 1, quality=0)
+
+
+def test_delete(fingerprints, sqlite_db):
+    sqlite_db.insert_fingerprints(fingerprints)
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    sqlite_db.delete_key(3)
+    assert sqlite_db.query_track_ids({3}, 2) == []
+    sqlite_db.delete_fingerprint(track_id1)
+    assert sqlite_db.query_track_ids({1, 2, 4}, 2) == [track_id2]
+    assert sqlite_db.keys_count() == 1
+
+
+def test_reader_sees_new_tracks(fingerprints, sqlite_db):
+    from traxit_manage.sqlite_db import DbSqlite
+    track_id1, track_id2 = fingerprints[0][0], fingerprints[1][0]
+    sqlite_db.insert_fingerprints(fingerprints[:1])
+    reader = DbSqlite(sqlite_db.db_name)
+    assert reader.query_track_ids({1}, 2) == [track_id1]
+    assert reader.query_keys({1}, [track_id1])[track_id1][1]['index'].tolist() == [0, 3]
+    # Committed by another connection after the first queries of the reader
+    sqlite_db.insert_fingerprints(fingerprints[1:])
+    assert reader.query_track_ids({3}, 2) == [track_id2]
+    assert reader.keys_count() == 2
+
+
+def test_pickle(fingerprints, sqlite_db):
+    sqlite_db.insert_fingerprints(fingerprints)
+    db = pickle.loads(pickle.dumps(sqlite_db))
+    assert db.commit_every == 2
+    assert db.query_track_ids({3}, 2) == [fingerprints[1][0]]
@@ -1,4 +1,7 @@
+import time
+
 from mock import MagicMock
+import numpy as np
 import pandas as pd
 import pytest
 
@@ -80,9 +83,7 @@ def test_get_tracklist(mocker,
     mock_os_remove = mocker.patch('os.remove')
     mocker.patch('traxit_manage.tracklist.clean_list_of_files',
                  return_value=list_of_files)
-    mocker.patch('traxit_manage.tracklist.decode_wave',
-                 return_value=('audio', True))
-    mocker.patch('traxit_manage.tracklist.length_wave')
+    mocker.patch('traxit_manage.tracklist.WaveSource').return_value.read.return_value = ('audio', True)
     mocker.patch('traxit_manage.tracklist.Decode')
     mock_fingerprinting = mocker.patch('traxit_manage.tracklist.configure_fingerprinting').return_value
     mock_fingerprinting.how_much_audio.return_value = (0, 10)
@@ -100,8 +101,153 @@ def test_get_tracklist(mocker,
                   reset_history_tracklist=reset_history_tracklist,
                   cli=cli)
 
+    # The checkpoint and its matches are removed with the tracklist
     if reset_cache and paths_exist:
-        assert len(mock_os_remove.call_args_list) == 2
+        assert len(mock_os_remove.call_args_list) == 4
 
     elif reset_history_tracklist and paths_exist:
-        assert len(mock_os_remove.call_args_list) == 1
+        assert len(mock_os_remove.call_args_list) == 3
+
+
+def _fake_tracklist_file(broadcast, cli, corpus_path, filepath, *args):
+    # The first file finishes last
+    if filepath == '/a.mp3':
+        time.sleep(0.2)
+    return 'tl' + filepath
+
+
+def test_get_tracklist_jobs(mocker):
+    list_of_files = ['/a.mp3', '/b.mp3', '/c.mp3']
+    mocker.patch('traxit_manage.tracklist.clean_list_of_files', return_value=list_of_files)
+    mocker.patch('traxit_manage.tracklist.configure_fingerprinting')
+    mocker.patch('traxit_manage.tracklist.configure_matching')
+    mocker.patch('traxit_manage.tracklist.configure_tracklisting')
+    mock_file = mocker.patch('traxit_manage.tracklist.get_tracklist_file', side_effect=_fake_tracklist_file)
+
+    files, tls = get_tracklist(list_of_files, 'db', None, None, None, '/the_corpus_path', 'broadcast', jobs=3)
+
+    assert files == list_of_files
+    assert tls == ['tl/a.mp3', 'tl/b.mp3', 'tl/c.mp3']
+    # The files were tracklisted in the workers
+    assert not mock_file.called
+
+
+def _fake_match_chunk(fingerprinting_instance, matching_instance, source, start, end, introspect_trackids):
+    # The first segments finish last
+    time.sleep(0.05 * (4 - start))
+    return pd.DataFrame({'track_id': [source.path], 'score': [start]})
+
+
+def test_iter_matches_pool(mocker, tmpdir):
+    from scipy.io import wavfile
+    from traxit_manage.decode import WaveSource
+    from multiprocessing import Pool
+    from traxit_manage.tracklist import _init_worker
+    from traxit_manage.tracklist import iter_matches
+    from traxit_manage.tracklist import post_process_chunks
+    mocker.patch('traxit_manage.tracklist.configure_fingerprinting')
+    mocker.patch('traxit_manage.tracklist.configure_matching')
+    mocker.patch('traxit_manage.tracklist.configure_tracklisting')
+    mock_match = mocker.patch('traxit_manage.tracklist.match_chunk', side_effect=_fake_match_chunk)
+    tracklisting_instance = MagicMock()
+    times = [(i, i + 1) for i in range(5)]
+    filecache = str(tmpdir.join('file.cache.wav'))
+    wavfile.write(filecache, 11025, np.zeros(11025, dtype=np.int16))
+    pool = Pool(3, _init_worker, ('db', None))
+    try:
+        chunks = iter_matches(times, None, None, WaveSource(filecache), None, pool=pool, lookahead=3)
+        matches = post_process_chunks(tracklisting_instance, chunks)
+    finally:
+        pool.terminate()
+    assert [match['score'][0] for match in matches] == [0, 1, 2, 3, 4]
+    assert matches[0]['track_id'][0] == filecache
+    assert [call[0][1:] for call in tracklisting_instance.post_processing.call_args_list] == times
+    # The segments were matched in the workers
+    assert not mock_match.called
+
+
+def test_get_tracklist_jobs_and_chunk_jobs():
+    with pytest.raises(ValueError):
+        get_tracklist([], 'db', None, None, None, '/the_corpus_path', 'broadcast', jobs=2, chunk_jobs=2)
+
+
+class _FakeFingerprinting(object):
+    def how_much_audio(self, start, end):
+        return int(start * 10), int(end * 10)
+
+
+def test_tracklist_stream(mocker):
+    import io
+    from traxit_manage.decode import StreamSource
+    from traxit_manage.tracklist import tracklist_stream
+    from traxit_manage.tracklisting import TracklistingV1
+
+    class Tracklisting(TracklistingV1):
+        def pre_processing(self, t1=None, t2=None):
+            if not t2:
+                return 0, 2
+            return t1 + 1, t2 + 1
+
+        def post_processing(self, match, t1, t2):
+            track_id = 'track{0}'.format(match[0])
+            if not self.history_tracklist or self.history_tracklist[-1]['track_id'] != track_id:
+                self.history_tracklist.append({'track_id': track_id, 'start': t1, 'end': t2, 'start_th': t1,
+                                               'shift': 0, 'm': 1., 'score': 1})
+
+    def fake_match_chunk(fingerprinting_instance, matching_instance, source, start, end, introspect_trackids):
+        buf_start, buf_end = fingerprinting_instance.how_much_audio(start, end)
+        return source.read(buf_start, buf_end)[0]
+
+    mocker.patch('traxit_manage.tracklist.match_chunk', side_effect=fake_match_chunk)
+    # 10 s of track 1 then 5.5 s of track 2, at 10 Hz
+    samples = np.array([1] * 100 + [2] * 55, dtype='<i2')
+    stream = io.BytesIO(samples.tobytes())
+    source = StreamSource(stream, rate=10)
+    tracklisting_instance = Tracklisting()
+    items = tracklist_stream(source, _FakeFingerprinting(), None, tracklisting_instance)
+
+    first = next(items)
+    assert (first['id'], first['start'], first['end']) == ('track1', 0, 10)
+    # Only the entry of the current item is kept
+    assert [entry['track_id'] for entry in tracklisting_instance.history_tracklist] == ['track2']
+    # The first item was final before the end of the stream
+    assert stream.tell() < len(samples) * 2
+    last, = list(items)
+    assert (last['id'], last['start'], last['end']) == ('track2', 10, 15.5)
+    assert source.ended
+    # The samples before the last segment were dropped
+    assert source._first_frame > 100
+
+
+def test_tracklist_checkpoint(tmpdir):
+    from traxit_manage.tracklist import TracklistCheckpoint
+    path = str(tmpdir.join('checkpoint_file_.json'))
+    times = [(0, 2), (1, 3), (2, 4), (3, 5)]
+    tracklisting_instance = MagicMock()
+    tracklisting_instance.checkpoint.return_value = {'history_tracklist': [{'track_id': '1'}]}
+    checkpoint = TracklistCheckpoint(path, tracklisting_instance, 5., interval=0)
+    assert checkpoint.load(times) == []
+    for start, end in times[:2]:
+        checkpoint.add(pd.DataFrame({'track_id': ['00{0}'.format(start)], 'score': [start]}), start, end)
+    # The third segment is lost in a crash before the next checkpoint
+    checkpoint.interval = 1000
+    checkpoint.add(pd.DataFrame({'track_id': ['002'], 'score': [2]}), 2, 4)
+    checkpoint._matches_file.flush()
+
+    tracklisting_instance = MagicMock()
+    tracklisting_instance.checkpoint.return_value = {'history_tracklist': []}
+    checkpoint = TracklistCheckpoint(path, tracklisting_instance, 5., interval=0)
+    matches = checkpoint.load(times)
+    assert [match['track_id'][0] for match in matches] == ['000', '001']
+    tracklisting_instance.restore.assert_called_once_with({'history_tracklist': [{'track_id': '1'}]})
+    checkpoint.add(pd.DataFrame({'track_id': ['002'], 'score': [2]}), 2, 4)
+    # Closing does not save the segments added since the last checkpoint
+    checkpoint.interval = 1000
+    checkpoint.add(pd.DataFrame({'track_id': ['003'], 'score': [3]}), 3, 5)
+    checkpoint.close()
+    assert len(TracklistCheckpoint(path, MagicMock(), 5.).load(times)) == 3
+
+    # The audio file changed
+    checkpoint = TracklistCheckpoint(path, MagicMock(), 6.)
+    assert checkpoint.load(times) == []
+    assert not tmpdir.listdir()
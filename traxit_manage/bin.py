@@ -101,8 +101,11 @@ def ingest(corpus, broadcast, dbname, erase, fingerprinting_class_path, database
 @click.option('--matching-class-path', help='Path to a matching class using dot notation. Example: myalgorithm.Matching', default=None, required=False)
 @click.option('--tracklisting-class-path', help='Path to a tracklisting class using dot notation. Example: myalgorithm.Tracklisting', default=None, required=False)
 @click.option('--database-class-path', help='Path to a database class using dot notation. Example: myalgorithm.Database', default=None, required=False)
+@click.option('--jobs', default=1, type=int, help='Number of audio files tracklisted in parallel processes.')
+@click.option('--chunk-jobs', default=1, type=int, help='Number of processes matching the segments of each audio file ahead. Cannot be used with --jobs.')
 def tracklist(corpus, broadcast, dbname,
-              reset_cache, reset_history_tracklist, globaldb, pipeline, introspect_trackids, fingerprinting_class_path, matching_class_path, tracklisting_class_path, database_class_path):
+              reset_cache, reset_history_tracklist, globaldb, pipeline, introspect_trackids, fingerprinting_class_path,
+              matching_class_path, tracklisting_class_path, database_class_path, jobs, chunk_jobs):
     """Tracklists according to a list of references that have been previously ingested
 
     By default the database wrapper used is DbElastic
@@ -125,9 +128,58 @@ def tracklist(corpus, broadcast, dbname,
                      matching_class_path=matching_class_path,
                      tracklisting_class_path=tracklisting_class_path,
                      database_class_path=database_class_path,
+                     jobs=jobs,
+                     chunk_jobs=chunk_jobs,
                      )
 
 
+@main.command()
+@click.argument('corpus')
+@click.argument('broadcast')
+@click.argument('stream', type=click.File('rb'))
+@click.option('--dbname', help='DB name. If not set, the name of the database will be chosen according to the algorithm name and parameters.')
+@click.option('--globaldb', is_flag=True, help='Use the corpus database.')
+@click.option('--pipeline', help='Pipeline name to use from traxit_algorithm.pipeline.')
+@click.option('--introspect-trackids', help='Comma-separated track_ids to introspect.')
+@click.option('--fingerprinting-class-path', default=None, required=False,
+              help='Path to a fingerprinting class using dot notation. Example: myalgorithm.Fingerprinting')
+@click.option('--matching-class-path', help='Path to a matching class using dot notation. Example: myalgorithm.Matching', default=None, required=False)
+@click.option('--tracklisting-class-path', default=None, required=False,
+              help='Path to a tracklisting class using dot notation. Example: myalgorithm.Tracklisting')
+@click.option('--database-class-path', help='Path to a database class using dot notation. Example: myalgorithm.Database', default=None, required=False)
+@click.option('--rate', default=11025, type=int, help='Sample rate of a raw PCM stream.')
+@click.option('--follow', is_flag=True, help='Wait for more data at the end of the stream, for a file which is still being written.')
+@click.option('--idle-timeout', default=None, type=float, help='With --follow, stop after this many seconds without data.')
+@click.option('--output', type=click.File('w'), default='-', help='File where the tracklist items are written, one JSON object per line. Defaults to stdout.')
+def tracklist_live(corpus, broadcast, stream, dbname, globaldb, pipeline, introspect_trackids, fingerprinting_class_path,
+                   matching_class_path, tracklisting_class_path, database_class_path, rate, follow, idle_timeout, output):
+    """Tracklists a live stream, writing each tracklist item as soon as it is final
+
+    STREAM is a 16 bit mono wave file or raw PCM (s16le), - for stdin. For instance:
+    ffmpeg -i <url> -f s16le -ac 1 -ar 11025 - | traxit tracklist_live CORPUS BROADCAST -
+    """
+    from traxit_manage.tracklist import live_tracklist_helper
+    from traxit_manage.utility import json_dumps
+    if introspect_trackids:
+        introspect_trackids = introspect_trackids.split(',')
+    for item in live_tracklist_helper(corpus=corpus,
+                                      broadcast=broadcast,
+                                      stream=stream,
+                                      globaldb=globaldb,
+                                      db_name=dbname,
+                                      pipeline=pipeline,
+                                      introspect_trackids=introspect_trackids,
+                                      fingerprinting_class_path=fingerprinting_class_path,
+                                      matching_class_path=matching_class_path,
+                                      tracklisting_class_path=tracklisting_class_path,
+                                      database_class_path=database_class_path,
+                                      rate=rate,
+                                      follow=follow,
+                                      idle_timeout=idle_timeout):
+        output.write(json_dumps(item) + '\n')
+        output.flush()
+
+
 @main.command()
 @click.argument('corpus')
 def init_corpus(corpus):
@@ -235,3 +287,35 @@ def delete_broadcast(corpus, broadcast):
     """
     from traxit_manage.broadcast import delete_broadcast_helper
     delete_broadcast_helper(broadcast, corpus)
+
+
+@main.group()
+def db():
+    """Manage fingerprint databases
+
+    """
+
+
+@db.command('export')
+@click.argument('dbname')
+@click.argument('filename')
+def export_db(dbname, filename):
+    """Exports an in memory database into a single file
+
+    """
+    from traxit_manage.in_memory_db import export_database
+    size = export_database(dbname, filename)
+    click.echo(u'Database {0} exported into {1} ({2} bytes)'.format(dbname, filename, size))
+
+
+@db.command('import')
+@click.argument('filename')
+@click.option('--dbname', help='Name of the imported database. Defaults to the name of the exported database.')
+@click.option('--force', is_flag=True, help='Replace the database if it already exists.')
+def import_db(filename, dbname, force):
+    """Imports a database exported with "db export"
+
+    """
+    from traxit_manage.in_memory_db import import_database
+    db_instance = import_database(filename, db_name=dbname, force=force)
+    click.echo(u'Database {0} imported from {1}'.format(db_instance.db_name, filename))
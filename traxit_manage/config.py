@@ -18,6 +18,10 @@ def configure_database(db_name, db_class=None, **kwargs):
         db_name: the name of the database to use
         db_class: can be a class, or a fully-qualified class name (as a
           string). Defaults to traxit_databases.config.indexing_db.
+        kwargs: passed to the database class. For instance ``read_only=True``
+          attaches to an in-memory database built by another process without
+          copying it. With ``db_class='traxit_manage.sharded_db.ShardedDb'``,
+          ``n_shards=4`` spreads the tracks over 4 shard processes.
     """
 
     try:
@@ -27,9 +31,9 @@ def configure_database(db_name, db_class=None, **kwargs):
         logger.warning('traxit_databases is not installed. ')
         if db_class is None:
             logger.warning('Instanciating an in-memory database.')
-            return DbInMemory(db_name)
+            return DbInMemory(db_name, **kwargs)
         else:
-            return _import(db_class)(db_name)
+            return _import(db_class)(db_name, **kwargs)
 
 
 def configure_fingerprinting(pipeline=None, fingerprinting_class_path=None):
@@ -1,4 +1,7 @@
 import logging
+import os
+import struct
+import time
 import wave
 
 import numpy as np
@@ -164,3 +167,220 @@ if not traxit_decode:
         rate = infile.getframerate()
         n_frames = infile.getnframes()
         return float(n_frames) / rate
+
+
+class WaveSource(object):
+    """PCM payload of a 16 bit wave file, memory-mapped once.
+
+    ``read`` returns views on the memory-mapped samples instead of re-opening and copying the file for each
+    segment. The views are read-only. The pages are shared with the other processes mapping the same file.
+
+    Args:
+        path: Path to the wave file.
+        samplerate_assert (int or None): Assert the sample rate takes a specific value. Do not assert if None
+            (default)
+
+    Raises:
+        ValueError: The file is not a 16 bit PCM wave file
+    """
+
+    def __init__(self, path, samplerate_assert=None):
+        self.path = path
+        with open(path, 'rb') as f:
+            riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+            if riff != b'RIFF' or wave_id != b'WAVE':
+                raise ValueError(u'{0} is not a wave file'.format(path))
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise ValueError(u'No data in the wave file {0}'.format(path))
+                chunk_id, chunk_size = struct.unpack('<4sI', header)
+                if chunk_id == b'fmt ':
+                    fmt = struct.unpack('<HHIIHH', f.read(16))
+                    f.seek(chunk_size - 16 + chunk_size % 2, os.SEEK_CUR)
+                elif chunk_id == b'data':
+                    offset = f.tell()
+                    break
+                else:
+                    # Chunks are padded to an even size
+                    f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+        if fmt is None:
+            raise ValueError(u'No format in the wave file {0}'.format(path))
+        format_tag, self.channels, self.rate, _, _, width = fmt
+        if format_tag not in (1, 0xFFFE) or width != 16:
+            raise ValueError(u'Invalid wave {0}: samples must be 16 bit PCM'.format(path))
+        if samplerate_assert is not None:
+            assert self.rate == samplerate_assert
+        # Writers which stream the file may leave the size of the data unset
+        size = min(chunk_size, os.path.getsize(path) - offset)
+        self.n_frames = size // (2 * self.channels)
+        self._samples = (np.memmap(path, dtype='<i2', mode='r', offset=offset,
+                                   shape=(self.n_frames * self.channels,))
+                         if self.n_frames else np.zeros(0, dtype=np.int16))
+
+    @property
+    def length(self):
+        """Length in seconds, see ``length_wave``."""
+        return float(self.n_frames) / self.rate
+
+    def read(self, buf_start=0, buf_end=None):
+        """Reads frames between buf_start and buf_end (not included), like ``decode_wave``.
+
+        Args:
+            buf_start (int): Start in buffer unit. Defaults to 0
+            buf_end (int or None): End in buffer unit. Read until the end if None (default)
+
+        Returns:
+            tuple: samples (np.array of int16, interleaved if there are several channels, read-only view) and
+                True if the end of the file was reached
+        """
+        buf_end = self.n_frames if buf_end is None else min(buf_end, self.n_frames)
+        buf_start = min(max(buf_start, 0), buf_end)
+        return self._samples[buf_start * self.channels:buf_end * self.channels], buf_end == self.n_frames
+
+    def close(self):
+        """Unmaps the file. The views returned by ``read`` stay valid until they are released."""
+        self._samples = np.zeros(0, dtype=np.int16)
+        self.n_frames = 0
+
+
+class StreamSource(object):
+    """16 bit PCM read from a stream as it arrives: a pipe, a FIFO or a file which is still being written.
+
+    The stream is raw little-endian PCM (for instance ``ffmpeg -i <url> -f s16le -ac 1 -ar 11025 -``), or a wave
+    file whose header gives the format. Samples are read only when a segment needs them, and the samples before
+    the segments still needed are dropped, so the memory used does not grow with the length of the stream.
+    ``read`` has the same interface as ``WaveSource.read``.
+
+    Args:
+        f: File object to read from, opened in binary mode.
+        rate (Optional[int]): Sample rate of raw PCM. Defaults to 11025.
+        channels (Optional[int]): Number of channels of raw PCM. Defaults to 1.
+        follow (Optional[bool]): At the end of the stream, wait for more data, as ``tail -f`` does. Use it for
+            a file which is still being written. Defaults to False.
+        poll_interval (Optional[float]): Seconds between two reads of the stream when following. Defaults to 1.
+        idle_timeout (Optional[float]): When following, the stream ends after this many seconds without data.
+            Defaults to None: follow until interrupted.
+
+    Raises:
+        ValueError: The stream is a wave file whose samples are not 16 bit PCM
+    """
+
+    def __init__(self, f, rate=11025, channels=1, follow=False, poll_interval=1., idle_timeout=None):
+        self.f = f
+        self.path = getattr(f, 'name', None)
+        self.rate = rate
+        self.channels = channels
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.ended = False
+        self.n_frames = 0  # Frames received so far
+        self._first_frame = 0  # Frame of the first sample in the buffer
+        self._samples = np.zeros(0, dtype=np.int16)
+        self._pending = b''  # Bytes of an incomplete frame
+        header = self._read_bytes(12)
+        if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+            self._read_wave_header()
+        else:
+            self._append(header)
+
+    def _read_bytes(self, size):
+        """Reads size bytes, or less at the end of the stream."""
+        data = b''
+        idle_since = time.time()
+        while len(data) < size:
+            chunk = self.f.read(size - len(data))
+            if chunk:
+                data += chunk
+                idle_since = time.time()
+            elif not self.follow or (self.idle_timeout is not None and
+                                     time.time() - idle_since >= self.idle_timeout):
+                self.ended = True
+                break
+            else:
+                time.sleep(self.poll_interval)
+        return data
+
+    def _read_wave_header(self):
+        """Reads the chunks of a wave header until the samples."""
+        fmt = None
+        while True:
+            header = self._read_bytes(8)
+            if len(header) < 8:
+                raise ValueError(u'No data in the wave stream {0}'.format(self.path))
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            if chunk_id == b'data':
+                break
+            content = self._read_bytes(chunk_size + chunk_size % 2)
+            if chunk_id == b'fmt ':
+                fmt = struct.unpack('<HHIIHH', content[:16])
+        if fmt is None:
+            raise ValueError(u'No format in the wave stream {0}'.format(self.path))
+        format_tag, self.channels, self.rate, _, _, width = fmt
+        if format_tag not in (1, 0xFFFE) or width != 16:
+            raise ValueError(u'Invalid wave stream {0}: samples must be 16 bit PCM'.format(self.path))
+
+    def _append(self, data):
+        """Adds bytes read from the stream to the buffer."""
+        data = self._pending + data
+        frame_size = 2 * self.channels
+        complete = len(data) - len(data) % frame_size
+        self._pending = data[complete:]
+        if complete:
+            self._samples = np.concatenate((self._samples, np.frombuffer(data[:complete], dtype='<i2')))
+            self.n_frames += complete // frame_size
+
+    @property
+    def length(self):
+        """Length in seconds of the audio received so far."""
+        return float(self.n_frames) / self.rate
+
+    def wait(self, buf_end):
+        """Reads the stream until frame buf_end is received, or until the stream ends.
+
+        Args:
+            buf_end (int): End in buffer unit (not included).
+
+        Returns:
+            bool: True if the frames until buf_end were received
+        """
+        if buf_end > self.n_frames and not self.ended:
+            self._append(self._read_bytes((buf_end - self.n_frames) * 2 * self.channels - len(self._pending)))
+        return buf_end <= self.n_frames
+
+    def read(self, buf_start=0, buf_end=None):
+        """Reads frames between buf_start and buf_end (not included), waiting for them if needed.
+
+        Args:
+            buf_start (int): Start in buffer unit. Must not be before the frames dropped with ``discard``.
+                Defaults to 0
+            buf_end (int or None): End in buffer unit. Read until the end of the stream if None (default)
+
+        Returns:
+            tuple: samples (np.array of int16, interleaved if there are several channels) and True if the end of
+                the stream was reached
+
+        Raises:
+            ValueError: The frames at buf_start were dropped
+        """
+        if buf_end is None:
+            while not self.ended:
+                self.wait(self.n_frames + self.rate)
+            buf_end = self.n_frames
+        self.wait(buf_end)
+        buf_end = min(buf_end, self.n_frames)
+        buf_start = min(max(buf_start, 0), buf_end)
+        if buf_start < self._first_frame:
+            raise ValueError('Frames before {0} were already dropped'.format(self._first_frame))
+        start, end = buf_start - self._first_frame, buf_end - self._first_frame
+        return (self._samples[start * self.channels:end * self.channels],
+                self.ended and buf_end == self.n_frames)
+
+    def discard(self, buf_start):
+        """Drops the frames before buf_start, which will not be read anymore."""
+        drop = min(buf_start, self.n_frames) - self._first_frame
+        if drop > 0:
+            self._samples = self._samples[drop * self.channels:].copy()
+            self._first_frame += drop
@@ -1,6 +1,16 @@
+from collections import namedtuple
+from collections import OrderedDict
+import hashlib
+import io
+import json
 import logging
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import os
 import shutil
+import struct
+import sys
+import zlib
 
 import numpy as np
 import pandas as pd
@@ -8,23 +18,1124 @@ import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+KeyMatches = namedtuple('KeyMatches', ['track_ids', 'codes', 'keys', 'offsets', 'indexes'])
+
+STORE_VERSION = 4
+CATALOG_FILE = 'tracks.json'
+SNAPSHOT_PREFIX = 'snapshot-'
+TOMBSTONES_FILE = 'deleted.npy'
+WAL_FILE = 'wal.log'
+BLOOM_FILE = 'bloom.npy'
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7  # Optimal for 10 bits per key: 10 * log(2)
+POSTINGS_COLUMNS = ('keys', 'codes', 'indexes')
+FORWARD_COLUMNS = ('forward_keys', 'forward_indexes', 'forward_offsets')
+FREQUENCIES_COLUMNS = ('df_keys', 'df_counts')
+WARM_CHUNK_SIZE = 16 * 1024 * 1024
+# Bytes charged per posting list kept by a PostingsCache: headers of its two arrays, its tuple and its entry
+POSTINGS_CACHE_ENTRY_BYTES = 2 * sys.getsizeof(np.zeros(0)) + sys.getsizeof((None, None)) + 64
+ARCHIVE_MAGIC = b'TRAXITDB'
+ARCHIVE_VERSION = 1
+ARCHIVE_HEADER = struct.Struct('<8sIQI')  # magic, version, offset and length of the manifest
+ARCHIVE_ALIGNMENT = 4096
+
+
+def _as_array(keys):
+    """Converts an iterable of keys (set, list, pandas.Series...) into a numpy array."""
+    if isinstance(keys, (set, frozenset)):
+        keys = list(keys)
+    keys = np.asarray(keys)
+    if not len(keys):
+        keys = keys.astype(np.int64)
+    return keys
+
+
+def _narrowest_dtype(low, high):
+    """Finds the narrowest integer dtype holding all the values between low and high.
+
+    Args:
+        low (int): Smallest value.
+        high (int): Largest value.
+
+    Returns:
+        np.dtype
+    """
+    dtypes = (np.uint8, np.uint16, np.uint32, np.uint64) if low >= 0 else (np.int8, np.int16, np.int32, np.int64)
+    for dtype in dtypes:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise ValueError('No integer dtype can hold values between {0} and {1}'.format(low, high))
+
+
+def _compact(values):
+    """Casts an array of integers into the narrowest integer dtype holding all its values.
+
+    Args:
+        values (np.array): Integer values.
+
+    Returns:
+        np.array
+
+    Raises:
+        TypeError: The values are not integers
+    """
+    values = np.asarray(values)
+    if not len(values):
+        return values.astype(np.uint8)
+    if values.dtype.kind not in 'iub':
+        raise TypeError('Fingerprint keys and indexes must be integers, not {0}'.format(values.dtype))
+    return values.astype(_narrowest_dtype(values.min(), values.max()), copy=False)
+
+
+def _concatenate(arrays):
+    """Concatenates arrays of integers into the narrowest integer dtype holding all their values.
+
+    ``np.concatenate`` would cast unsigned 64 bits integers and signed integers to float64.
+
+    Args:
+        arrays (list of np.array): Integer values.
+
+    Returns:
+        np.array
+    """
+    arrays = [values for values in arrays if len(values)]
+    if not arrays:
+        return np.array([], dtype=np.uint8)
+    dtype = _narrowest_dtype(min(int(values.min()) for values in arrays), max(int(values.max()) for values in arrays))
+    return np.concatenate([values.astype(dtype, copy=False) for values in arrays])
+
+
+def _ranges(starts, ends):
+    """Concatenates the integer ranges ``[starts[i], ends[i])`` into a single array.
+
+    Args:
+        starts (np.array): Start of each range (included).
+        ends (np.array): End of each range (excluded).
+
+    Returns:
+        np.array: All the integers of the ranges, in order.
+    """
+    lengths = ends - starts
+    non_empty = lengths > 0
+    starts = starts[non_empty]
+    lengths = lengths[non_empty]
+    if not len(lengths):
+        return np.array([], dtype=np.int64)
+    # Offset of the first element of each range in the output
+    shifts = starts - np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.repeat(shifts, lengths) + np.arange(lengths.sum())
+
+
+def _top_k(counts, size, pool=None):
+    """Finds the codes with the highest counts.
+
+    Args:
+        counts (np.array): Count of each code.
+        size (int): Number of codes to return.
+        pool (Optional[int]): Number of candidates selected with a partial sort before sorting them.
+            Defaults to ``size``.
+
+    Returns:
+        np.array: Codes with a positive count, by decreasing count then increasing code.
+    """
+    pool = max(size, pool or size)
+    candidates = np.flatnonzero(counts)
+    if pool < len(candidates):
+        # Keep all the candidates tied with the last one of the pool, so that ties are broken by code and not
+        # by the partial sort
+        kth = np.partition(-counts[candidates], pool - 1)[pool - 1]
+        candidates = candidates[-counts[candidates] <= kth]
+    order = np.lexsort((candidates, -counts[candidates]))
+    return candidates[order][:size]
+
+
+def _key_matches(track_ids, codes, keys, indexes):
+    """Builds a KeyMatches from postings sorted by code then key.
+
+    Args:
+        track_ids (list): Track id of each code.
+        codes (np.array): Track code of each posting.
+        keys (np.array): Key of each posting.
+        indexes (np.array): index_ref of each posting.
+
+    Returns:
+        KeyMatches
+    """
+    boundaries = (codes[1:] != codes[:-1]) | (keys[1:] != keys[:-1])
+    starts = np.flatnonzero(np.concatenate(([len(codes) > 0], boundaries)))
+    offsets = np.append(starts, len(codes))
+    entry_codes = codes[starts]
+    return KeyMatches(dict((code, track_ids[code]) for code in np.unique(entry_codes).tolist()),
+                      entry_codes,
+                      keys[starts],
+                      offsets,
+                      indexes)
+
+
+def _matches_to_dict(matches):
+    """Converts a KeyMatches into a dictionary {track_id: {key: [{"index": np.array}, ...] }}."""
+    result = {}
+    for i, (code, key) in enumerate(zip(matches.codes.tolist(), matches.keys.tolist())):
+        result.setdefault(matches.track_ids[code], {})[key] = {
+            'index': matches.indexes[matches.offsets[i]:matches.offsets[i + 1]]
+        }
+    return result
+
+
+def _searchsorted(sorted_values, values, side='left'):
+    """Same as ``np.searchsorted``, without copying the sorted values.
+
+    ``np.searchsorted`` casts both arrays to a common dtype: when the sorted values (the postings) have a
+    narrower dtype than the searched values (the keys of a query), the whole postings column is copied on each
+    call. The searched values are cast to the dtype of the sorted values instead.
+
+    Args:
+        sorted_values (np.array): Sorted integers.
+        values (np.array): Integers to search.
+        side (Optional[str]): 'left' or 'right', see ``np.searchsorted``. Defaults to 'left'.
+
+    Returns:
+        np.array: Insertion position of each value.
+    """
+    values = np.asarray(values)
+    if values.dtype == sorted_values.dtype or sorted_values.dtype.kind not in 'iu' or values.dtype.kind not in 'iub':
+        return np.searchsorted(sorted_values, values, side=side)
+    info = np.iinfo(sorted_values.dtype)
+    below, above = values < info.min, values > info.max
+    positions = np.searchsorted(sorted_values, np.clip(values, info.min, info.max).astype(sorted_values.dtype),
+                                side=side)
+    return np.where(below, 0, np.where(above, len(sorted_values), positions))
+
+
+def _in_sorted(values, sorted_values):
+    """Boolean mask of the values which are in an array of sorted values."""
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.minimum(_searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return sorted_values[positions] == values
+
+
+def _count_keys(keys, codes, n_codes):
+    """Counts the postings and the distinct keys of each track code.
+
+    Args:
+        keys (np.array): Key of each posting.
+        codes (np.array): Track code of each posting.
+        n_codes (int): Number of track codes.
+
+    Returns:
+        tuple of np.array: Number of postings and number of distinct keys of each code.
+    """
+    order = np.lexsort((codes, keys))
+    keys, codes = keys[order], codes[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = (keys[1:] != keys[:-1]) | (codes[1:] != codes[:-1])
+    return np.bincount(codes, minlength=n_codes), np.bincount(codes[first], minlength=n_codes)
+
+
+def _key_frequencies(keys, codes):
+    """Counts the tracks in which each key appears (its document frequency).
+
+    Args:
+        keys (np.array): Key of each posting.
+        codes (np.array): Track code of each posting.
+
+    Returns:
+        tuple of np.array: Distinct keys, sorted, and the number of tracks of each one.
+    """
+    order = np.lexsort((codes, keys))
+    keys, codes = keys[order], codes[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = (keys[1:] != keys[:-1]) | (codes[1:] != codes[:-1])
+    df_keys, df_counts = np.unique(keys[first], return_counts=True)
+    return _compact(df_keys), _compact(df_counts)
+
+
+def _save_npy(path, values):
+    """Saves an array and waits for it to be on the disk."""
+    with open(path, 'wb') as f:
+        np.save(f, values)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _fsync_directory(path):
+    """Waits for the entries of a directory (created, renamed or removed files) to be on the disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _read_chunk(chunk):
+    """Reads a chunk of a file, so that it is loaded in the page cache.
+
+    Args:
+        chunk (tuple): Path of the file, offset and length of the chunk.
+
+    Returns:
+        int: Number of bytes read.
+    """
+    path, offset, length = chunk
+    buf = bytearray(min(length, 1024 * 1024))
+    done = 0
+    with io.open(path, 'rb', buffering=0) as f:
+        f.seek(offset)
+        while done < length:
+            n = f.readinto(memoryview(buf)[:min(len(buf), length - done)])
+            if not n:
+                break
+            done += n
+    return done
+
+
+def _digest(*parts):
+    """Digest of byte strings, used as a cache key."""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part)
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class QueryCache(object):
+    """Least recently used cache of query results.
+
+    Args:
+        max_entries (int): Number of results kept. The least recently used result is evicted beyond that.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key):
+        """Returns the result cached for a key, or None."""
+        result = self._results.pop(key, None)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._results[key] = result
+        return result
+
+    def put(self, key, result):
+        """Caches the result of a key."""
+        self._results.pop(key, None)
+        self._results[key] = result
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    def clear(self):
+        """Drops all the cached results. Counters are kept."""
+        self._results.clear()
+
+    def info(self):
+        """Returns the counters and the size of the cache.
+
+        Returns:
+            dict: hits, misses, size and max_entries
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._results),
+                'max_entries': self.max_entries}
+
+
+class PostingsCache(object):
+    """Posting lists of the most used keys, copied in memory within a budget of bytes.
+
+    The other posting lists are read from the memory-mapped postings, then promoted. The least recently used
+    lists are evicted beyond the budget. Each list is charged ``POSTINGS_CACHE_ENTRY_BYTES`` on top of its
+    postings. The empty lists of absent keys are not kept.
+
+    Args:
+        budget (int): Number of bytes of posting lists kept in memory.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lists = OrderedDict()
+
+    def get(self, key, start, end, index):
+        """Returns the codes and indexes of the postings of a key.
+
+        Args:
+            key (int): Key to look up.
+            start (int): Position of the first posting of the key in the index.
+            end (int): Position after the last posting of the key in the index.
+            index (InvertedIndex): Index to read the posting list from when it is not in memory.
+
+        Returns:
+            tuple of np.array: codes and indexes of the postings of the key.
+        """
+        postings = self._lists.pop(key, None)
+        if postings is not None:
+            self.hits += 1
+            self._lists[key] = postings
+            return postings
+        self.misses += 1
+        postings = (np.array(index.codes[start:end]), np.array(index.indexes[start:end]))
+        size = self._size(postings)
+        if start < end and size <= self.budget:
+            self._lists[key] = postings
+            self.nbytes += size
+            while self.nbytes > self.budget:
+                _, evicted = self._lists.popitem(last=False)
+                self.nbytes -= self._size(evicted)
+        return postings
+
+    @staticmethod
+    def _size(postings):
+        """Bytes charged for a posting list."""
+        return postings[0].nbytes + postings[1].nbytes + POSTINGS_CACHE_ENTRY_BYTES
+
+    def clear(self):
+        """Drops all the posting lists. Counters are kept."""
+        self._lists.clear()
+        self.nbytes = 0
+
+    def info(self):
+        """Returns the counters and the size of the cache.
+
+        Returns:
+            dict: hits, misses, number of lists, bytes used and budget
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._lists),
+                'nbytes': self.nbytes,
+                'budget': self.budget}
+
+
+class BloomFilter(object):
+    """Compact probabilistic set of integer keys.
+
+    ``contains`` never misses a key which was added, and wrongly reports a key which was not added with a
+    probability of about 1% at ``BLOOM_BITS_PER_KEY`` bits per key, as long as no more than ``capacity`` keys
+    were added. Keys cannot be removed.
+
+    The ``n_hashes`` bit positions of a key are derived from two 64 bits hashes (double hashing), so a whole
+    array of keys is hashed at once.
+
+    Args:
+        capacity (int): Number of keys the filter is sized for.
+        bits (Optional[np.array]): Bits of a saved filter, as uint8. Defaults to an empty filter.
+    """
+
+    def __init__(self, capacity, bits=None):
+        self.capacity = capacity
+        self.n_hashes = BLOOM_HASHES
+        if bits is None:
+            bits = np.zeros(max(1, -(-capacity * BLOOM_BITS_PER_KEY // 8)), dtype=np.uint8)
+        self.bits = bits
+        self.n_bits = np.uint64(len(bits) * 8)
+
+    @classmethod
+    def from_keys(cls, keys, capacity=None):
+        """Builds a filter holding keys.
+
+        Args:
+            keys (np.array): Keys to add.
+            capacity (Optional[int]): Number of keys the filter is sized for. Defaults to the number of keys.
+        """
+        bloom = cls(max(capacity or 0, len(keys)))
+        bloom.add(keys)
+        return bloom
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def _positions(self, keys):
+        """Returns the bit positions of keys, one row per hash."""
+        with np.errstate(over='ignore'):
+            x = np.asarray(keys).astype(np.int64).view(np.uint64)
+            h1 = x * np.uint64(0x9E3779B97F4A7C15)
+            h1 ^= h1 >> np.uint64(29)
+            h2 = (x ^ (x >> np.uint64(31))) * np.uint64(0xBF58476D1CE4E5B9)
+            h2 ^= h2 >> np.uint64(32)
+            h2 |= np.uint64(1)
+            return np.array([(h1 + np.uint64(i) * h2) % self.n_bits for i in range(self.n_hashes)])
+
+    def add(self, keys):
+        """Adds keys to the filter."""
+        positions = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                         np.left_shift(1, (positions & np.uint64(7)).astype(np.uint8)).astype(np.uint8))
+
+    def contains(self, keys):
+        """Tests keys.
+
+        Args:
+            keys (np.array): Keys to test.
+
+        Returns:
+            np.array: False for the keys which were never added, True for the others.
+        """
+        positions = self._positions(keys)
+        found = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return found.all(axis=0).astype(bool)
+
+
+class WriteAheadLog(object):
+    """Append-only log of the changes made to a database since its last snapshot.
+
+    Each record is framed by its length and its CRC32, followed by a JSON header line (sequence number,
+    operation and its arguments) and the raw bytes of its arrays. A record which was not completely written,
+    for instance because the process was killed, fails the check: it and everything after it are ignored.
+
+    Args:
+        path: Path of the log file.
+    """
+
+    FRAME = struct.Struct('<II')
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def append(self, header, arrays=(), sync=False):
+        """Appends a record to the log.
+
+        Args:
+            header (dict): JSON serializable description of the change. It must hold its sequence number ``seq``.
+            arrays (Optional[list of np.array]): Arrays of the change.
+            sync (Optional[bool]): Waits for the record to be on the disk. Otherwise it is only handed to the
+                operating system, which is enough to survive the death of the process. Defaults to False.
+        """
+        arrays = [np.ascontiguousarray(values) for values in arrays]
+        header = dict(header, arrays=[[values.dtype.str, len(values)] for values in arrays])
+        payload = b''.join([json.dumps(header).encode('utf-8'), b'\n'] + [values.tobytes() for values in arrays])
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.write(self.FRAME.pack(len(payload), zlib.crc32(payload) & 0xffffffff) + payload)
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def records(self):
+        """Reads the valid records of the log.
+
+        Yields:
+            tuple: header (dict) and arrays (list of np.array) of each record, in order.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            while True:
+                frame = f.read(self.FRAME.size)
+                if len(frame) < self.FRAME.size:
+                    break
+                length, checksum = self.FRAME.unpack(frame)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) & 0xffffffff != checksum:
+                    logger.warning(u'Ignoring the truncated end of {0}'.format(self.path))
+                    break
+                end = payload.index(b'\n')
+                header = json.loads(payload[:end].decode('utf-8'))
+                arrays, offset = [], end + 1
+                for dtype, size in header.pop('arrays'):
+                    values = np.frombuffer(payload, dtype=np.dtype(dtype), count=size, offset=offset)
+                    arrays.append(values)
+                    offset += values.nbytes
+                yield header, arrays
+
+    def truncate(self):
+        """Empties the log, once its records are in a snapshot."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        """Closes the log file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class InvertedIndex(object):
+    """Inverted index from keys to their posting lists.
+
+    A posting is a (track code, index_ref) pair. The postings are sorted by key so that the posting list
+    of a key is a contiguous slice, found with a binary search. A stable sort is used so that the postings
+    of a key stay in insertion order.
+
+    Args:
+        keys (np.array): Key of each posting.
+        codes (np.array): Track code of each posting.
+        indexes (np.array): index_ref of each posting.
+    """
+
+    def __init__(self, keys, codes, indexes):
+        order = np.argsort(keys, kind='mergesort')
+        self.keys = keys[order]
+        self.codes = codes[order]
+        self.indexes = indexes[order]
+
+    @classmethod
+    def from_sorted(cls, keys, codes, indexes):
+        """Builds an index from postings that are already sorted by key."""
+        index = cls.__new__(cls)
+        index.keys = keys
+        index.codes = codes
+        index.indexes = indexes
+        return index
+
+    @classmethod
+    def open(cls, directory):
+        """Opens an index saved with ``save``. The postings are memory-mapped, read-only.
+
+        Args:
+            directory: Directory holding one ``.npy`` file per column.
+
+        Returns:
+            InvertedIndex or None if no postings were saved in the directory.
+        """
+        paths = [os.path.join(directory, column + '.npy') for column in POSTINGS_COLUMNS]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        return cls.from_sorted(*[np.load(path, mmap_mode='r') for path in paths])
+
+    def save(self, directory):
+        """Saves the postings, one ``.npy`` file per column.
+
+        The files are overwritten in place: readers are only pointed at the directory once it is complete, see
+        ``DbInMemory._save``.
+
+        Args:
+            directory: Directory to save the postings into.
+        """
+        for column in POSTINGS_COLUMNS:
+            _save_npy(os.path.join(directory, column + '.npy'), getattr(self, column))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def take(self, keys, columns, resident=None):
+        """Gathers the postings of keys.
+
+        Without a cache, all the keys are looked up with a single binary search.
+
+        Args:
+            keys (np.array): Keys to look up. A key may appear several times.
+            columns (tuple of str): Columns to gather, among ``POSTINGS_COLUMNS``.
+            resident (Optional[PostingsCache]): Posting lists held in memory.
+
+        Returns:
+            tuple: {column: np.array} with the postings grouped by key, in the order of ``keys``, and the number
+                of postings of each key.
+        """
+        starts = _searchsorted(self.keys, keys, side='left')
+        ends = _searchsorted(self.keys, keys, side='right')
+        if resident is None:
+            positions = _ranges(starts, ends)
+            return dict((column, getattr(self, column)[positions]) for column in columns), ends - starts
+
+        lists = [resident.get(key, start, end, self)
+                 for key, start, end in zip(keys.tolist(), starts.tolist(), ends.tolist())]
+        lengths = np.array([len(codes) for codes, _ in lists], dtype=np.int64)
+        values = {}
+        for column, position in (('codes', 0), ('indexes', 1)):
+            if column in columns:
+                values[column] = (np.concatenate([postings[position] for postings in lists]) if lists
+                                  else getattr(self, column)[:0])
+        if 'keys' in columns:
+            values['keys'] = np.repeat(keys, lengths).astype(self.keys.dtype)
+        return values, lengths
+
+    def merge(self, other):
+        """Returns a new index holding the postings of this index followed by the postings of another one.
+
+        Both indexes are already sorted, so this is a linear merge rather than a new sort.
+
+        Args:
+            other (InvertedIndex): Index to merge into this one. For equal keys, its postings come last.
+
+        Returns:
+            InvertedIndex
+        """
+        positions = _searchsorted(self.keys, other.keys, side='right')
+        columns = []
+        for column in POSTINGS_COLUMNS:
+            values, new_values = getattr(self, column), getattr(other, column)
+            if not len(values):
+                values = values.astype(new_values.dtype)
+            elif len(new_values):
+                dtype = _narrowest_dtype(min(values.min(), new_values.min()), max(values.max(), new_values.max()))
+                values = values.astype(dtype, copy=False)
+            columns.append(np.insert(values, positions, new_values))
+        return InvertedIndex.from_sorted(*columns)
+
+    def select(self, mask):
+        """Returns a new index holding only the postings selected by a boolean mask."""
+        # Selecting keeps the postings sorted
+        return InvertedIndex.from_sorted(self.keys[mask], self.codes[mask], self.indexes[mask])
+
+
+class ForwardIndex(object):
+    """Postings grouped by track, the postings of each track sorted by key.
+
+    The postings of the track of code ``c`` are ``keys[offsets[c]:offsets[c + 1]]`` and the matching
+    ``indexes``. A stable sort is used so that the indexes of a key stay in insertion order. Looking up keys in
+    a few candidate tracks is then a binary search in each of them, whatever the size of the database.
+
+    Args:
+        keys (np.array): Key of each posting.
+        indexes (np.array): index_ref of each posting.
+        offsets (np.array): Position of the first posting of each code, followed by the number of postings.
+    """
+
+    def __init__(self, keys, indexes, offsets):
+        self.keys = keys
+        self.indexes = indexes
+        self.offsets = offsets
+
+    @classmethod
+    def from_postings(cls, keys, codes, indexes, n_codes):
+        """Builds an index from postings in any order.
+
+        Args:
+            keys (np.array): Key of each posting.
+            codes (np.array): Track code of each posting.
+            indexes (np.array): index_ref of each posting.
+            n_codes (int): Number of track codes, including the codes without postings.
+        """
+        order = np.lexsort((keys, codes))
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=n_codes)))).astype(np.int64)
+        return cls(keys[order], indexes[order], offsets)
+
+    @classmethod
+    def open(cls, directory):
+        """Opens an index saved with ``save``. The postings are memory-mapped, read-only.
+
+        Args:
+            directory: Directory holding one ``.npy`` file per column.
+
+        Returns:
+            ForwardIndex or None if no postings were saved in the directory.
+        """
+        paths = [os.path.join(directory, column + '.npy') for column in FORWARD_COLUMNS]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        return cls(*[np.load(path, mmap_mode='r') for path in paths])
+
+    def save(self, directory):
+        """Saves the postings, one ``.npy`` file per column, see ``InvertedIndex.save``."""
+        for column, values in zip(FORWARD_COLUMNS, (self.keys, self.indexes, self.offsets)):
+            _save_npy(os.path.join(directory, column + '.npy'), values)
+
+    @property
+    def n_codes(self):
+        return len(self.offsets) - 1
+
+    def append(self, other):
+        """Returns a new index holding the tracks of this index followed by the tracks of another one.
+
+        Args:
+            other (ForwardIndex): Index of the new tracks. Its codes below ``n_codes`` must have no postings.
+
+        Returns:
+            ForwardIndex
+        """
+        columns = []
+        for values, new_values in ((self.keys, other.keys), (self.indexes, other.indexes)):
+            if not len(values):
+                values = values.astype(new_values.dtype)
+            elif len(new_values):
+                dtype = _narrowest_dtype(min(values.min(), new_values.min()), max(values.max(), new_values.max()))
+                values, new_values = values.astype(dtype, copy=False), new_values.astype(dtype, copy=False)
+            columns.append(np.concatenate((values, new_values)))
+        offsets = np.concatenate((self.offsets, other.offsets[self.n_codes + 1:] + self.offsets[-1]))
+        return ForwardIndex(columns[0], columns[1], offsets)
+
+    def take(self, codes, keys):
+        """Gathers the postings of keys in some tracks.
+
+        Args:
+            codes (np.array): Codes of the tracks, sorted.
+            keys (np.array): Keys to look up, sorted and unique.
+
+        Returns:
+            tuple of np.array: code, key and index_ref of each posting, sorted by code then key.
+        """
+        codes = codes[codes < self.n_codes]
+        starts = [np.array([], dtype=np.int64)]
+        ends = [np.array([], dtype=np.int64)]
+        for code in codes.tolist():
+            start, end = self.offsets[code], self.offsets[code + 1]
+            track_keys = self.keys[start:end]
+            starts.append(start + _searchsorted(track_keys, keys, side='left'))
+            ends.append(start + _searchsorted(track_keys, keys, side='right'))
+        starts, ends = np.concatenate(starts), np.concatenate(ends)
+        lengths = ends - starts
+        return (np.repeat(np.repeat(codes, len(keys)), lengths),
+                np.repeat(np.tile(keys, len(codes)), lengths).astype(self.keys.dtype),
+                self.indexes[_ranges(starts, ends)])
+
+
 class DbInMemory:
-    """In memory fingerprint database."""
-    def __init__(self, db_name):
+    """In memory fingerprint database.
+
+    Fingerprints are held in an ``InvertedIndex`` to find candidate tracks, and in a ``ForwardIndex`` to look up
+    keys in the candidates (``query_keys``). Track ids are mapped to integer codes so that the postings do not
+    repeat the track id strings. Keys, codes and indexes are stored in the narrowest integer dtype holding their
+    values, see ``memory_usage``.
+
+    The database is persisted in a columnar format: one ``.npy`` file per postings column and a
+    ``tracks.json`` catalog holding the track id of each code, along with a Bloom filter of the keys
+    (``bloom.npy``) which rejects most absent keys of a query before the postings are searched. Opening an
+    existing database memory-maps the columns, so it is almost instant and the pages are shared between the
+    processes using it.
+
+    Each snapshot is written in a new ``snapshot-<n>`` directory, and the catalog, renamed over the previous
+    one, points to it. Only then is the previous snapshot removed: a save interrupted at any point leaves the
+    previous snapshot, whose changes are completed from the write-ahead log.
+
+    Many processes can attach to the same database with ``read_only=True``: they only memory-map the saved
+    columns, without copying them. Pickling an instance (for instance to send it to a worker of a
+    ``multiprocessing.Pool``) only sends its name, and the worker attaches to it read-only.
+    The files of a snapshot are never replaced, so attached processes keep seeing the database as it was when
+    they attached, except for the tombstones: ``delete_fingerprint`` updates them in place, so the deletes are
+    seen at once.
+
+    Results of ``query_track_ids`` and ``query_keys`` can be cached, which helps with overlapping windows and
+    repeated jingles or ads. The cache is cleared whenever the database is modified, see ``cache_info``.
+
+    Changes are first appended to a write-ahead log (``wal.log``, see ``WriteAheadLog``), then written in
+    snapshots: at the end of each ``insert_fingerprints`` and every ``snapshot_every`` tracks during it. When
+    the database is opened, the changes of the log which are not in the last snapshot are replayed, so an
+    interrupted ingest does not start over.
+
+    Deletes are logical: a deleted track is flagged in a tombstone bitmap on track codes (``deleted.npy``, updated
+    in place) and a deleted key in the catalog. Queries skip them immediately. ``compact`` rewrites the postings
+    without them; it runs automatically once the deleted postings exceed ``compaction_threshold`` of all postings.
+
+    Args:
+        db_name: Name of the database, persisted in ``/tmp/<db_name>``.
+        read_only (Optional[bool]): Attach to an existing database without modifying it. Defaults to False.
+        cache_size (Optional[int]): Number of query results to cache. Defaults to 0 (no cache).
+        compaction_threshold (Optional[float]): Fraction of deleted postings triggering a compaction. If None,
+            compact only when ``compact`` is called. Defaults to 0.25.
+        cutoff_frequency (Optional[float or int]): Keys appearing in more tracks than this are ignored when
+            looking for candidate tracks. Below 1, it is a fraction of the number of tracks. Defaults to None
+            (no cutoff).
+        idf_weighting (Optional[bool]): Weight each matching posting by the inverse document frequency of its
+            key, ``log(1 + tracks / key_frequency)``, when looking for candidate tracks. Defaults to False.
+        snapshot_every (Optional[int]): Number of tracks inserted between two snapshots. Defaults to 10000.
+        memory_budget (Optional[int]): Bytes of posting lists held in memory. The posting lists of the most
+            used keys are copied in memory, the others are read from the memory-mapped postings, see
+            ``PostingsCache``. Defaults to None: all the posting lists are read from the memory-mapped postings
+            and the operating system decides which pages stay in memory.
+
+    Raises:
+        ValueError: read_only is True and the database was not saved in the columnar format
+    """
+    def __init__(self, db_name, read_only=False, cache_size=0, compaction_threshold=0.25, cutoff_frequency=None,
+                 idf_weighting=False, snapshot_every=10000, memory_budget=None):
+        self.db_name = db_name
+        self.read_only = read_only
+        self.compaction_threshold = compaction_threshold
+        self.cutoff_frequency = cutoff_frequency
+        self.idf_weighting = idf_weighting
+        self.snapshot_every = snapshot_every
+        self._cache = QueryCache(cache_size) if cache_size else None
+        self._resident = PostingsCache(memory_budget) if memory_budget else None
         self.store_in = os.path.join('/tmp', db_name)
-        if not os.path.exists(self.store_in):
+        self._wal = WriteAheadLog(os.path.join(self.store_in, WAL_FILE))
+        self._sequence = 0  # Sequence number of the last change
+        self._snapshot = 0  # Number of the last snapshot. 0 if the columns are in store_in, as in older stores.
+        self._index = None
+        self._forward = None  # Postings by track, see ForwardIndex
+        self._track_ids = []  # Track id of each code. None once the track is deleted.
+        self._track_codes = {}
+        self._postings_count = []  # Number of postings of each code
+        self._keys_count = []  # Number of distinct keys of each code
+        self._postings_total = 0  # Postings of the tracks which are not deleted
+        self._keys_total = 0
+        self._distinct_keys = 0
+        self._deleted = np.zeros(0, dtype=bool)  # Tombstone of each code
+        self._deleted_postings = 0
+        self._deleted_keys = np.array([], dtype=np.int64)  # Sorted
+        self._deleted_keys_postings = 0  # Postings of the deleted keys, in the tracks which are not deleted
+        # Number of tracks of each key, including the deleted tracks until the next compaction
+        self._df_keys = np.array([], dtype=np.int64)
+        self._df_counts = np.array([], dtype=np.int64)
+        self._bloom = None  # Bloom filter of the keys of the postings, see BloomFilter
+        if os.path.exists(os.path.join(self.store_in, CATALOG_FILE)):
+            self._load()
+        elif read_only:
+            raise ValueError('No database to attach to in {0}'.format(self.store_in))
+        elif not os.path.exists(self.store_in):
             os.mkdir(self.store_in)
-            self._fps = None
-        else:  # Load existing fingerprints
-            fp_files = [f for f in os.listdir(self.store_in) if os.path.isfile(os.path.join(self.store_in, f))]
-            fps = []
-            for fp_file in fp_files:
-                fp = pd.read_csv(os.path.join(self.store_in, fp_file))
-                fp['track_id'] = fp_file
-                fps.append(fp)
-            if fps:
-                self._fps = pd.concat(fps)
+            # Saved empty, so that other processes can attach to it at once
+            self._save()
+        elif not os.path.exists(self._wal.path):
+            self._migrate_csv()
+        self._recover()
+
+    def __getstate__(self):
+        """Only the name of the database and its query options are pickled."""
+        return {'db_name': self.db_name,
+                'cache_size': self._cache.max_entries if self._cache is not None else 0,
+                'cutoff_frequency': self.cutoff_frequency,
+                'idf_weighting': self.idf_weighting,
+                'memory_budget': self._resident.budget if self._resident is not None else None}
+
+    def __setstate__(self, state):
+        """Attaches read-only to the pickled database."""
+        self.__init__(state.pop('db_name'), read_only=True, **state)
+
+    def _check_writable(self):
+        """Raises a ValueError if the database is read-only."""
+        if self.read_only:
+            raise ValueError('The database {0} is attached read-only'.format(self.db_name))
+
+    def _load(self):
+        """Loads the catalog and memory-maps the postings and the tombstones of the last snapshot."""
+        while True:
+            catalog = self._read_catalog()
+            try:
+                self._open_snapshot(catalog)
+            except (IOError, OSError):
+                # The snapshot was removed by a save in another process, before its files were opened
+                if self._read_catalog().get('snapshot', 0) == catalog.get('snapshot', 0):
+                    raise
+                continue
+            # A snapshot is only removed once the catalog points to the next one: if it still points to the same
+            # snapshot, all of its files were there when they were opened.
+            if self._read_catalog().get('snapshot', 0) == catalog.get('snapshot', 0):
+                return
+
+    def _read_catalog(self):
+        """Reads the catalog of the database."""
+        with open(os.path.join(self.store_in, CATALOG_FILE), 'r') as f:
+            return json.load(f)
+
+    def _snapshot_path(self, snapshot=None):
+        """Directory of a snapshot, the last one by default."""
+        snapshot = self._snapshot if snapshot is None else snapshot
+        if not snapshot:
+            return self.store_in
+        return os.path.join(self.store_in, '{0}{1}'.format(SNAPSHOT_PREFIX, snapshot))
+
+    def _open_snapshot(self, catalog):
+        """Loads a catalog and memory-maps the postings and the tombstones of its snapshot."""
+        if catalog['version'] not in (1, 2, 3, STORE_VERSION):
+            raise ValueError('Unsupported in memory database version {0} in {1}'.format(catalog['version'],
+                                                                                        self.store_in))
+        self._snapshot = catalog.get('snapshot', 0)
+        directory = self._snapshot_path()
+        self._track_ids = catalog['track_ids']
+        self._sequence = catalog.get('sequence', 0)
+        self._open_postings(directory)
+        self._deleted_keys = np.array(catalog.get('deleted_keys', []), dtype=np.int64)
+        if catalog['version'] < 3:
+            self._count_postings(catalog)
+        self._postings_count = catalog['postings']
+        self._keys_count = catalog['keys']
+        self._distinct_keys = catalog['distinct_keys']
+        self._deleted_keys_postings = catalog.get('deleted_keys_postings', 0)
+        self._open_frequencies(directory, catalog.get('bloom_capacity'))
+
+        tombstones_path = os.path.join(directory, TOMBSTONES_FILE)
+        if os.path.exists(tombstones_path):
+            self._deleted = np.load(tombstones_path, mmap_mode='r' if self.read_only else 'r+')
+        else:
+            self._deleted = np.array([track_id is None for track_id in self._track_ids], dtype=bool)
+        for code in np.flatnonzero(self._deleted).tolist():
+            self._track_ids[code] = None
+        self._track_codes = dict((track_id, code) for code, track_id in enumerate(self._track_ids)
+                                 if track_id is not None)
+        deleted = np.asarray(self._deleted, dtype=bool)
+        postings_count = np.array(self._postings_count, dtype=np.int64)
+        self._deleted_postings = self._deleted_keys_postings + int(postings_count[deleted].sum())
+        self._postings_total = int(postings_count[~deleted].sum())
+        self._keys_total = int(np.array(self._keys_count, dtype=np.int64)[~deleted].sum())
+
+    def _open_postings(self, directory):
+        """Memory-maps the postings and the postings by track of a snapshot."""
+        self._index = InvertedIndex.open(directory)
+        self._forward = ForwardIndex.open(directory)
+        if self._forward is None and self._index is not None:
+            # Stores saved before the postings by track were kept
+            self._forward = ForwardIndex.from_postings(self._index.keys, self._index.codes, self._index.indexes,
+                                                       len(self._track_ids))
+
+    def _count_postings(self, catalog):
+        """Adds the counts of the postings to the catalog of versions 1 and 2, which do not have all of them."""
+        keys = codes = np.array([], dtype=np.int64)
+        if self._index is not None:
+            keys, codes = self._index.keys, self._index.codes
+        kept = ~_in_sorted(keys, self._deleted_keys)
+        postings, keys_count = _count_keys(keys[kept], codes[kept], len(self._track_ids))
+        catalog['postings'], catalog['keys'] = postings.tolist(), keys_count.tolist()
+        catalog['distinct_keys'] = len(np.unique(keys[kept]))
+
+    def _open_frequencies(self, directory, bloom_capacity):
+        """Memory-maps the key frequencies of a snapshot and loads its Bloom filter."""
+        paths = [os.path.join(directory, column + '.npy') for column in FREQUENCIES_COLUMNS]
+        if all(os.path.exists(path) for path in paths):
+            self._df_keys, self._df_counts = [np.load(path, mmap_mode='r') for path in paths]
+        elif self._index is not None:
+            # Stores saved before the key frequencies were kept
+            self._df_keys, self._df_counts = _key_frequencies(self._index.keys, self._index.codes)
+        bloom_path = os.path.join(directory, BLOOM_FILE)
+        if bloom_capacity is not None and os.path.exists(bloom_path):
+            self._bloom = BloomFilter(bloom_capacity, np.load(bloom_path))
+        elif len(self._df_keys):
+            # Stores saved before the Bloom filter was kept
+            self._update_bloom()
 
+    def _migrate_csv(self):
+        """Loads a database stored with one CSV file per track and converts it to the columnar format."""
+        own_files = ([column + '.npy' for column in POSTINGS_COLUMNS + FORWARD_COLUMNS + FREQUENCIES_COLUMNS] +
+                     [TOMBSTONES_FILE, WAL_FILE, BLOOM_FILE])
+        fp_files = [f for f in os.listdir(self.store_in)
+                    if os.path.isfile(os.path.join(self.store_in, f)) and f not in own_files and not f.endswith('.tmp')]
+        postings = []
+        if fp_files:
+            logger.info('Converting {0} CSV fingerprints in {1}'.format(len(fp_files), self.store_in))
+            # Parsing is spread over threads, the tracks are still encoded in order
+            pool = ThreadPool(min(cpu_count(), len(fp_files)))
+            try:
+                fps = pool.imap(pd.read_csv, [os.path.join(self.store_in, fp_file) for fp_file in fp_files])
+                for i, (fp_file, fp) in enumerate(zip(fp_files, fps)):
+                    postings.append(self._encode(fp['key'].values, fp['index_ref'].values, fp_file))
+                    if (i + 1) % 1000 == 0:
+                        logger.info('Converted {0}/{1} CSV fingerprints'.format(i + 1, len(fp_files)))
+            finally:
+                pool.close()
+        if postings:
+            keys, codes, indexes = [_concatenate(columns) for columns in zip(*postings)]
+            self._index = InvertedIndex(keys, codes, indexes)
+            self._forward = ForwardIndex.from_postings(keys, codes, indexes, len(self._track_ids))
+            self._df_keys, self._df_counts = _key_frequencies(self._index.keys, self._index.codes)
+            self._update_bloom()
+        self._save()
+        for fp_file in fp_files:
+            os.remove(os.path.join(self.store_in, fp_file))
+
+    def _save(self):
+        """Persists the postings, the tombstones and the catalog in a new snapshot, then memory-maps it.
+
+        The files of the snapshot are written and synced before the catalog is renamed to point to it, so that a
+        save interrupted at any point leaves the previous snapshot. The write-ahead log and the previous snapshot
+        are only removed after that.
+        """
+        directory = self._snapshot_path(self._snapshot + 1)
+        if os.path.exists(directory):
+            # Left by an interrupted save
+            shutil.rmtree(directory)
+        os.mkdir(directory)
+        if self._index is not None and len(self._index):
+            self._index.save(directory)
+            self._index = InvertedIndex.open(directory)
+            self._forward.save(directory)
+            self._forward = ForwardIndex.open(directory)
+        else:
+            self._index = self._forward = None
+
+        for column in FREQUENCIES_COLUMNS:
+            path = os.path.join(directory, column + '.npy')
+            _save_npy(path, getattr(self, '_' + column))
+            setattr(self, '_' + column, np.load(path, mmap_mode='r'))
+        if self._bloom is not None:
+            _save_npy(os.path.join(directory, BLOOM_FILE), self._bloom.bits)
+
+        self._grow_tombstones()
+        path = os.path.join(directory, TOMBSTONES_FILE)
+        _save_npy(path, np.asarray(self._deleted, dtype=bool))
+        self._deleted = np.load(path, mmap_mode='r+')
+        _fsync_directory(directory)
+
+        # The catalog is switched last: it is what marks the snapshot as saved
+        self._snapshot += 1
+        self._save_catalog()
+        self._wal.truncate()
+        self._remove_snapshots()
+
+    def _remove_snapshots(self):
+        """Removes the files of the snapshots older than the last one, including the columns of older stores."""
+        current = os.path.basename(self._snapshot_path())
+        own_files = ([column + '.npy' for column in POSTINGS_COLUMNS + FORWARD_COLUMNS + FREQUENCIES_COLUMNS] +
+                     [TOMBSTONES_FILE, BLOOM_FILE])
+        for name in os.listdir(self.store_in):
+            path = os.path.join(self.store_in, name)
+            if name.startswith(SNAPSHOT_PREFIX) and name != current:
+                shutil.rmtree(path)
+            elif name in own_files:
+                os.remove(path)
+
+    def _recover(self):
+        """Replays the changes of the write-ahead log which are not in the last snapshot."""
+        replayed = 0
+        postings = []
+        for header, arrays in self._wal.records():
+            if header['seq'] <= self._sequence:
+                continue
+            self._sequence = header['seq']
+            # Deletes are persisted in place as well, so they may already be applied
+            if header['op'] == 'insert':
+                postings.append(self._encode(arrays[0], arrays[1], header['track_id']))
+                replayed += 1
+            elif header['op'] == 'delete':
+                replayed += self._remove(header['track_id'])
+            elif header['op'] == 'delete_key':
+                if postings:
+                    self._merge(postings)
+                    postings = []
+                replayed += self._remove_key(header['key'])
+        if postings:
+            self._merge(postings)
+        if replayed:
+            logger.info(u'Recovered {0} changes of {1} from its log'.format(replayed, self.db_name))
+        if not self.read_only and os.path.exists(self._wal.path):
+            self._persist() if replayed else self._wal.truncate()
+
+    def _log(self, op, arrays=(), sync=False, **kwargs):
+        """Appends a change to the write-ahead log."""
+        self._sequence += 1
+        self._wal.append(dict(kwargs, seq=self._sequence, op=op), arrays, sync=sync)
+
+    def _persist(self):
+        """Writes a snapshot of the database, compacting it first if needed."""
+        if not self._compact_if_needed():
+            self._save()
+
+    def _save_catalog(self):
+        """Persists the catalog."""
+        path = os.path.join(self.store_in, CATALOG_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'version': STORE_VERSION,
+                       'snapshot': self._snapshot,
+                       'sequence': self._sequence,
+                       'track_ids': self._track_ids,
+                       'postings': self._postings_count,
+                       'keys': self._keys_count,
+                       'distinct_keys': self._distinct_keys,
+                       'deleted_keys': self._deleted_keys.tolist(),
+                       'deleted_keys_postings': self._deleted_keys_postings,
+                       'bloom_capacity': self._bloom.capacity if self._bloom is not None else None}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(path + '.tmp', path)
+        _fsync_directory(self.store_in)
+
+    def _grow_tombstones(self):
+        """Extends the tombstone bitmap to the codes registered since the last save."""
+        if len(self._deleted) < len(self._track_ids):
+            self._deleted = np.concatenate((self._deleted, np.zeros(len(self._track_ids) - len(self._deleted),
+                                                                    dtype=bool)))
 
     def __repr__(self):
         """Representation of the in memory DB"""
@@ -32,7 +1143,223 @@ class DbInMemory:
 
     def __str__(self):
         """Representation of the in memory DB"""
-        return 'In memory database persisted in directory {0}'.format(self.store_in)
+        return 'In memory database persisted in directory {0}{1}'.format(self.store_in,
+                                                                         ' (read-only)' if self.read_only else '')
+
+    def _encode(self, keys, indexes, track_id):
+        """Registers a new track and builds its postings.
+
+        Args:
+            keys (np.array): Keys of the fingerprint.
+            indexes (np.array): index_ref of each key.
+            track_id: The id referencing the fingerprint.
+
+        Returns:
+            tuple of np.array: keys, codes and indexes of the postings.
+
+        Raises:
+            TypeError: The keys or the indexes are not integers. The track is not registered.
+        """
+        # Validated before the track is registered, so that a rejected track is not ingested
+        keys, indexes = _compact(keys), _compact(indexes)
+        if len(self._deleted_keys):
+            kept = ~_in_sorted(keys, self._deleted_keys)
+            keys, indexes = keys[kept], indexes[kept]
+        code = len(self._track_ids)
+        self._track_ids.append(track_id)
+        self._track_codes[track_id] = code
+        self._postings_count.append(len(keys))
+        self._keys_count.append(len(np.unique(keys)))
+        self._postings_total += self._postings_count[code]
+        self._keys_total += self._keys_count[code]
+        return keys, np.full(len(keys), code, dtype=_narrowest_dtype(0, code)), indexes
+
+    def _live_keys(self, keys):
+        """Drops the deleted keys from the keys of a query."""
+        if not len(self._deleted_keys):
+            return keys
+        keys = _as_array(keys)
+        return keys[~_in_sorted(keys, self._deleted_keys)]
+
+    def _add_key_frequencies(self, df_keys, df_counts):
+        """Adds the key frequencies of new tracks to the key frequencies of the database."""
+        keys, inverse = np.unique(_concatenate((self._df_keys, df_keys)), return_inverse=True)
+        counts = np.bincount(inverse, weights=_concatenate((self._df_counts, df_counts)))
+        self._df_keys, self._df_counts = _compact(keys), _compact(counts.astype(np.int64))
+
+    def _update_bloom(self, keys=None):
+        """Adds keys to the Bloom filter, or rebuilds it from the key frequencies.
+
+        The filter is rebuilt when keys is None, or when the database holds more keys than the filter was sized
+        for. It is then sized for twice as many keys, so that it is not rebuilt on each insert.
+
+        Args:
+            keys (Optional[np.array]): New keys, already added to the key frequencies.
+        """
+        if keys is None or self._bloom is None or len(self._df_keys) > self._bloom.capacity:
+            self._bloom = BloomFilter.from_keys(self._df_keys, 2 * len(self._df_keys))
+        else:
+            self._bloom.add(keys)
+
+    def key_frequencies(self, keys):
+        """Counts the tracks in which keys appear (their document frequency).
+
+        The deleted tracks are still counted until the next compaction.
+
+        Args:
+            keys (iterable of int): Keys to count.
+
+        Returns:
+            np.array: Number of tracks of each key, 0 for the keys which are not in the database.
+        """
+        keys = _as_array(keys)
+        if not len(self._df_keys):
+            return np.zeros(len(keys), dtype=np.int64)
+        positions = np.minimum(_searchsorted(self._df_keys, keys), len(self._df_keys) - 1)
+        return np.where(self._df_keys[positions] == keys, self._df_counts[positions], 0)
+
+    def _postings(self, list_of_keys, columns, candidates=False):
+        """Gathers the postings of many sets of keys.
+
+        The deleted keys are skipped, and so are the keys rejected by the Bloom filter without searching the
+        postings: most keys of a window of silence or of unknown music are in no track. To select candidates,
+        so are the keys above ``cutoff_frequency``, and the postings are weighted if ``idf_weighting``.
+
+        Args:
+            list_of_keys (list of iterables of int): Sets of keys to look up. Duplicates are ignored.
+            columns (tuple of str): Columns to gather, among ``POSTINGS_COLUMNS``.
+            candidates (Optional[bool]): The postings are used to select candidates. Defaults to False.
+
+        Returns:
+            tuple: {column: np.array} with the postings grouped by set then by key in ascending order, the number
+                of the set each posting matched, and the weight of each posting (None unless ``idf_weighting``).
+        """
+        list_of_keys = [np.unique(_as_array(self._live_keys(keys))) for keys in list_of_keys]
+        keys = np.concatenate(list_of_keys) if list_of_keys else np.array([], dtype=np.int64)
+        sets = np.repeat(np.arange(len(list_of_keys)), [len(set_keys) for set_keys in list_of_keys])
+        if self._bloom is not None:
+            present = self._bloom.contains(keys)
+            keys, sets = keys[present], sets[present]
+
+        candidates = candidates and (self.cutoff_frequency is not None or self.idf_weighting)
+        if candidates:
+            n_tracks = max(len(self._track_codes), 1)
+            frequencies = self.key_frequencies(keys)
+            if self.cutoff_frequency is not None:
+                cutoff = self.cutoff_frequency * n_tracks if self.cutoff_frequency < 1 else self.cutoff_frequency
+                kept = frequencies <= cutoff
+                keys, sets, frequencies = keys[kept], sets[kept], frequencies[kept]
+
+        values, lengths = self._index.take(keys, columns, self._resident)
+        weights = None
+        if candidates and self.idf_weighting:
+            weights = np.repeat(np.log1p(n_tracks / np.maximum(frequencies, 1).astype(np.float64)), lengths)
+        return values, np.repeat(sets, lengths), weights
+
+    def _invalidate_cache(self):
+        """Drops the cached query results and posting lists, after the database was modified."""
+        if self._cache is not None:
+            self._cache.clear()
+        if self._resident is not None:
+            self._resident.clear()
+
+    def cache_info(self):
+        """Returns the counters of the query cache.
+
+        Returns:
+            dict: hits, misses, size and max_entries of the cache, or None if there is no cache.
+        """
+        return self._cache.info() if self._cache is not None else None
+
+    def _cached(self, compute, method, keys, *args):
+        """Returns the cached result of a query, or computes and caches it.
+
+        Args:
+            compute (callable): Computes the result when it is not cached.
+            method (str): Name of the query.
+            keys (set of int): Keys of the query.
+            args: Other arguments of the query, JSON serializable.
+        """
+        if self._cache is None:
+            return compute()
+        cache_key = _digest(method.encode('utf-8'),
+                            np.unique(_as_array(keys)).astype(np.int64).tobytes(),
+                            json.dumps(args).encode('utf-8'))
+        result = self._cache.get(cache_key)
+        if result is None:
+            result = compute()
+            self._cache.put(cache_key, result)
+        return result
+
+    def _postings_columns(self):
+        """Returns the name and the values (None without postings) of each column of both indexes."""
+        return ([(column, getattr(self._index, column, None)) for column in POSTINGS_COLUMNS] +
+                [(column, getattr(self._forward, column[len('forward_'):], None)) for column in FORWARD_COLUMNS])
+
+    def memory_usage(self):
+        """Reports the memory used by the database, in bytes.
+
+        Memory-mapped postings are included: they are loaded in the page cache once queried. The posting lists
+        copied in memory within ``memory_budget`` are counted in ``resident``, but not in ``total``: they are
+        copies of postings already counted in ``postings_bytes``.
+
+        Returns:
+            dict: Bytes used by each postings column (of the inverted index then of the postings by track), by all
+                of them (``postings_bytes``), by the posting lists copied in memory (``resident``), by the track
+                catalog, by the Bloom filter of the keys (``bloom``) and in total, along with the number of postings
+                and the dtype of each column.
+        """
+        usage = {'postings': 0}
+        for column, values in self._postings_columns():
+            usage[column] = values.nbytes if values is not None else 0
+            usage[column + '_dtype'] = str(values.dtype) if values is not None else None
+        if self._index is not None:
+            usage['postings'] = len(self._index)
+        usage['catalog'] = (sys.getsizeof(self._track_ids) + sys.getsizeof(self._track_codes) +
+                            sum(sys.getsizeof(track_id) for track_id in self._track_codes))
+        usage['tombstones'] = self._deleted.nbytes + self._deleted_keys.nbytes
+        usage['deleted_postings'] = self._deleted_postings
+        usage['postings_bytes'] = sum(usage[column] for column in POSTINGS_COLUMNS + FORWARD_COLUMNS)
+        usage['resident'] = self._resident.nbytes if self._resident is not None else 0
+        usage['bloom'] = self._bloom.nbytes if self._bloom is not None else 0
+        usage['total'] = usage['postings_bytes'] + usage['catalog'] + usage['tombstones'] + usage['bloom']
+        return usage
+
+    def warm(self, n_jobs=None, progress=None):
+        """Loads the postings in memory ahead of the first queries.
+
+        Opening the database only memory-maps the postings: each page is read from the disk the first time a
+        query touches it. This reads the postings files in chunks spread over ``n_jobs`` threads, so that they
+        are in the page cache (shared by all the processes using the database) before querying.
+
+        Args:
+            n_jobs (Optional[int]): Number of threads reading the files. Defaults to the number of CPUs.
+            progress (Optional[callable]): Called with the number of bytes read after each chunk, for instance
+                the ``update`` method of a ``click.progressbar`` of length ``memory_usage()['postings_bytes']``.
+
+        Returns:
+            int: Number of bytes read.
+        """
+        chunks = []
+        for _, values in self._postings_columns():
+            if not isinstance(values, np.memmap):
+                continue
+            end = values.offset + values.nbytes
+            chunks.extend((values.filename, offset, min(WARM_CHUNK_SIZE, end - offset))
+                          for offset in range(values.offset, end, WARM_CHUNK_SIZE))
+        if not chunks:
+            return 0
+        pool = ThreadPool(min(n_jobs or cpu_count(), len(chunks)))
+        read = 0
+        try:
+            for n in pool.imap_unordered(_read_chunk, chunks):
+                read += n
+                if progress is not None:
+                    progress(n)
+        finally:
+            pool.close()
+        logger.info(u'Loaded {0} bytes of postings of {1}'.format(read, self.db_name))
+        return read
 
     def keys_count(self):
         """Counts the number of distinct track ids in the database.
@@ -40,44 +1367,199 @@ class DbInMemory:
         Returns:
             int: Total number of keys
         """
-        return len(self._fps.track_id.unique())
+        return len(self._track_codes)
+
+    def track_stats(self, track_id):
+        """Counts the postings and the distinct keys of a track, from the catalog.
+
+        Args:
+            track_id: id of the fingerprint
+
+        Returns:
+            dict: code, postings and keys of the track, or None if the track is not ingested.
+        """
+        code = self._track_codes.get(track_id)
+        if code is None:
+            return None
+        return {'code': code, 'postings': self._postings_count[code], 'keys': self._keys_count[code]}
+
+    def stats(self):
+        """Reports the global and per-track counts of the database, from the catalog.
+
+        The counts are maintained on insert and delete, so this does not scan the postings. Until the next
+        compaction, ``distinct_keys`` still includes the keys which only appear in deleted tracks.
+
+        Returns:
+            dict: Number of tracks, of postings, of keys (summed over the tracks) and of distinct keys, number of
+                deleted postings waiting for a compaction, and ``per_track``: {track_id: {'postings': int,
+                'keys': int}}.
+        """
+        return {
+            'tracks': len(self._track_codes),
+            'postings': self._postings_total,
+            'keys': self._keys_total,
+            'distinct_keys': self._distinct_keys,
+            'deleted_postings': self._deleted_postings,
+            'per_track': dict((track_id, {'postings': self._postings_count[code], 'keys': self._keys_count[code]})
+                              for track_id, code in self._track_codes.items()),
+        }
 
 
     def insert_fingerprint(self, fp, track_id, override=False):
         """Inserts a fingerprint into the in memory database.
 
         If a fingerprint with a given track_id exists, it is replaced if override is True.
-        If one exists but is partial (because the insert failed half way for some reason),
-        then it will be completely replaced.
+        A fingerprint is never partial: it is logged in a single checksummed record of the write-ahead log.
+
+        To insert many fingerprints, use ``insert_fingerprints`` which persists the database only once.
 
         Args:
             fp: A pandas dataframes with a column named `key`.
             track_id: The id referencing the fingerprint.
             override: Boolean to replace a previously existing fingerprint.
         """
-        if not isinstance(fp, pd.DataFrame):
-            raise TypeError('fp must be a pandas dataframe')
+        self.insert_fingerprints([(track_id, fp)], override=override)
 
-        logger.info('Making a copy of the fingerprint.')
-        fp = fp.copy()
+    def insert_fingerprints(self, fps, override=False):
+        """Inserts many fingerprints into the in memory database.
 
-        logger.info('Constructing the documents.')
+        The fingerprints are logged and buffered, then merged into the index and persisted once every
+        ``snapshot_every`` tracks and at the end. The total cost is therefore linear in the number of postings,
+        instead of copying the whole database for each track. The iterable is consumed lazily, so
+        ``is_ingested_fingerprint`` already sees the tracks buffered before. If the iterable raises, the tracks
+        buffered before are merged into the index, and persisted by the next snapshot. If the process dies, the
+        tracks already logged are recovered when the database is opened again.
+
+        Args:
+            fps (iterable): Iterable of tuples (track_id, fp) where fp is a pandas dataframe with a column named `key`.
+            override: Boolean to replace previously existing fingerprints.
+        """
+        self._check_writable()
+        postings = []
+        try:
+            for track_id, fp in fps:
+                if not isinstance(fp, pd.DataFrame):
+                    raise TypeError('fp must be a pandas dataframe')
+                # index_ref is the index of the fingerprint. Checked before an overridden track is deleted.
+                keys, indexes = _compact(fp['key'].values), _compact(fp.index.values)
 
-        # Setting index_ref as a column equal to the index
-        fp['index_ref'] = fp.index
+                if track_id in self._track_codes:
+                    if not override:
+                        logger.warning(u'Fingerprint {0} already ingested. Skipping.'.format(track_id))
+                        continue
+                    self._log('delete', track_id=track_id)
+                    self._remove(track_id)
 
-        fp.to_csv(os.path.join(self.store_in, track_id), index=False)
+                logger.info(u'Constructing the documents for {0}.'.format(track_id))
+                postings.append(self._encode(keys, indexes, track_id))
+                self._log('insert', [postings[-1][0], postings[-1][2]], track_id=track_id)
+                if len(postings) >= self.snapshot_every:
+                    self._merge(postings)
+                    self._persist()
+                    postings = []
+        except BaseException:
+            # The buffered tracks are registered and logged: merge their postings, so that the next snapshot
+            # does not persist them without postings
+            if postings:
+                self._merge(postings)
+            raise
 
-        fp['track_id'] = track_id
+        if postings:
+            self._merge(postings)
+            self._persist()
 
-        if self._fps is None:
-            self._fps = fp
+    def _merge(self, postings):
+        """Merges buffered postings into the index, without persisting it.
+
+        Args:
+            postings (list of tuples): keys, codes and indexes of new tracks, see ``_encode``.
+        """
+        keys, codes, indexes = [_concatenate(columns) for columns in zip(*postings)]
+        # Drop the tracks which were buffered then overridden in the same batch: their postings never existed
+        self._grow_tombstones()
+        alive = ~self._deleted[codes]
+        for code in np.unique(codes[~alive]).tolist():
+            self._deleted_postings -= self._postings_count[code]
+            self._postings_count[code] = self._keys_count[code] = 0
+        new_index = InvertedIndex(keys[alive], codes[alive], indexes[alive])
+        new_forward = ForwardIndex.from_postings(keys[alive], codes[alive], indexes[alive], len(self._track_ids))
+        self._forward = new_forward if self._forward is None else self._forward.append(new_forward)
+        df_keys, df_counts = _key_frequencies(new_index.keys, new_index.codes)
+        self._add_key_frequencies(df_keys, df_counts)
+        self._update_bloom(df_keys)
+
+        if self._index is None:
+            self._distinct_keys = len(np.unique(new_index.keys))
+            self._index = new_index
         else:
-            self._fps = pd.concat((self._fps, fp))
+            new_keys = np.unique(new_index.keys)
+            self._distinct_keys += int(np.count_nonzero(~_in_sorted(new_keys, self._index.keys)))
+            self._index = self._index.merge(new_index)
+        self._invalidate_cache()
+
+    def query_keys_arrays(self, keys, track_ids):
+        """Query keys from in memory db, as flat arrays.
+
+        Each entry of the result is a (track code, key) pair, sorted by code then key. The indexes of entry
+        ``i`` are ``indexes[offsets[i]:offsets[i + 1]]``, in increasing order of insertion.
+
+        Args:
+            keys (set of int): Keys to be used to search for the tracks.
+            track_ids (iterator of str): Iterator of track IDs to that correspond best to the queried keys.
+
+        Returns:
+            KeyMatches: namedtuple with fields
+                - track_ids (dict): {code: track_id} for the codes in the result
+                - codes (np.array): track code of each entry
+                - keys (np.array): key of each entry
+                - offsets (np.array): start of each entry in ``indexes``, followed by the length of ``indexes``
+                - indexes (np.array): index_ref of the matching postings
+        """
+        track_ids = list(track_ids)
+
+        def compute():
+            matches = self.query_keys_arrays_many([keys], [track_ids])[0]
+            # The result may be shared through the cache
+            for values in matches[1:]:
+                values.flags.writeable = False
+            return matches
+
+        return self._cached(compute, 'query_keys_arrays', keys, track_ids)
+
+    def query_keys_arrays_many(self, list_of_keys, list_of_track_ids):
+        """Answers many ``query_keys_arrays`` queries.
+
+        The keys of each query are searched in the postings of its tracks only (see ``ForwardIndex``), so the
+        cost depends on the size of the candidate tracks and not on the size of the database.
+
+        Args:
+            list_of_keys (list of sets of int): Keys of each query.
+            list_of_track_ids (list of iterators of str): Track IDs of each query.
+
+        Returns:
+            list of KeyMatches: Result of each query, see ``query_keys_arrays``.
+
+        Raises:
+            ValueError: The two lists do not have the same length
+        """
+        if len(list_of_keys) != len(list_of_track_ids):
+            raise ValueError('There must be as many sets of keys as lists of track IDs')
+        results = []
+        for keys, track_ids in zip(list_of_keys, list_of_track_ids):
+            if self._forward is None:
+                results.append(_key_matches(self._track_ids, *[np.array([], dtype=np.int64)] * 3))
+                continue
+            codes = np.unique(np.array([self._track_codes[track_id] for track_id in track_ids
+                                        if track_id in self._track_codes], dtype=np.int64))
+            keys = np.unique(_as_array(self._live_keys(keys)))
+            results.append(_key_matches(self._track_ids, *self._forward.take(codes, keys)))
+        return results
 
     def query_keys(self, keys, track_ids):
         """Query keys from in memory db
 
+        This builds a dictionary from the result of ``query_keys_arrays``.
+
         Args:
             keys (set of int): Keys to be used to search for the tracks.
             track_ids (iterator of str): Iterator of track IDs to that correspond best to the queried keys.
@@ -85,44 +1567,146 @@ class DbInMemory:
         Results:
             dict: {track_id: {key: [{"index": np.array}, ...] }}
         """
-        result = {}
+        return _matches_to_dict(self.query_keys_arrays(keys, track_ids))
 
-        subfps = self._fps[self._fps.track_id.isin(track_ids) & self._fps.key.isin(keys)]
-        subfps = subfps.rename(columns={'index_ref': 'index'})
-        for track_id, track_id_group in subfps.groupby('track_id'):
-            group = track_id_group.groupby('key')['index'].apply(np.array).to_frame('index')
+    def query_keys_many(self, list_of_keys, list_of_track_ids):
+        """Answers many ``query_keys`` queries, see ``query_keys_arrays_many``.
 
-            result[track_id] = group.to_dict('index')
+        Args:
+            list_of_keys (list of sets of int): Keys of each query.
+            list_of_track_ids (list of iterators of str): Track IDs of each query.
 
-        return result
+        Returns:
+            list of dict: Result of each query, see ``query_keys``.
+        """
+        return [_matches_to_dict(matches) for matches in self.query_keys_arrays_many(list_of_keys, list_of_track_ids)]
 
     def query_track_ids(self, keys, size, quality=5):
         """Query track_ids from a set of integer keys
 
+        The matching postings are counted per track code, then the best ``size * quality`` tracks are
+        selected with a partial sort and only those are sorted. Tracks with the same count are ordered by
+        insertion order.
+
         Args:
             keys (set of int): Keys to be used to search for the tracks.
             size (int): Number of tracks to return as a result.
             quality (Optional[int]): Positive number (greater than 0). This will be passed to Elasticsearch as
-                `size_shard = size * quality`. Defaults to 5.
+                `size_shard = size * quality`. Defaults to 5. Here it is the number of candidates kept by the
+                partial sort; since the counts are exact it only matters when several results are merged.
 
         Returns:
             list of str: Ordered list of track IDs to that correspond best to the queried keys. Ordered from most
                 relevant to less relevant.
+
+        Raises:
+            ValueError: quality is not positive
         """
-        if self._fps is None:
+        return [track_id for track_id, _ in self.query_track_scores(keys, size, quality)]
+
+    def query_track_scores(self, keys, size, quality=5):
+        """Query track_ids from a set of integer keys, along with their number of matching postings.
+
+        This is ``query_track_ids`` with the counts, so that the results of several databases can be merged.
+
+        Args:
+            keys (set of int): Keys to be used to search for the tracks.
+            size (int): Number of tracks to return as a result.
+            quality (Optional[int]): Positive number (greater than 0), see ``query_track_ids``. Defaults to 5.
+
+        Returns:
+            list of tuples (str, int): Track IDs and their number of matching postings (their sum of weights with
+                ``idf_weighting``), in the order of ``query_track_ids``.
+
+        Raises:
+            ValueError: quality is not positive
+        """
+        if quality <= 0:
+            raise ValueError('quality must be greater than 0')
+        if self._index is None:
             return []
-        query = self._fps[self._fps.key.isin(keys)]
-        count = query.groupby('track_id')['track_id'].count()
-        count.sort_values(ascending=False, inplace=True)
-        return count.index[:size].tolist()
+
+        def compute():
+            return self._track_scores_many([keys], size, quality)[0]
+
+        return list(self._cached(compute, 'query_track_scores', keys, size, quality))
+
+    def _track_scores_many(self, list_of_keys, size, quality):
+        """Selects the best tracks of many sets of keys, for ``query_track_scores`` and ``query_track_ids_many``.
+
+        Only the (query, track) pairs which have matching postings are counted, so the memory used does not
+        depend on the number of tracks in the database. The tracks of each query are then selected with
+        ``_top_k``: by decreasing count then increasing code.
+
+        Args:
+            list_of_keys (list of sets of int): Keys of each query.
+            size (int): Number of tracks to return for each query.
+            quality (int): Positive number, see ``query_track_ids``.
+
+        Returns:
+            list of lists of tuples (str, int): Result of each query, see ``query_track_scores``.
+        """
+        n_codes = len(self._track_ids)
+        values, queries, weights = self._postings(list_of_keys, ('codes',), candidates=True)
+        codes = values['codes']
+        self._grow_tombstones()
+        alive = ~np.asarray(self._deleted, dtype=bool)[codes]
+        # Sorted by query then code
+        pairs, inverse = np.unique(queries[alive] * n_codes + codes[alive], return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights=weights[alive] if weights is not None else None,
+                             minlength=len(pairs))
+        queries, codes = pairs // n_codes, pairs % n_codes
+        bounds = np.searchsorted(queries, np.arange(len(list_of_keys) + 1))
+        results = []
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            selected = start + _top_k(counts[start:end], size, int(size * quality))
+            results.append([(self._track_ids[code], count)
+                            for code, count in zip(codes[selected].tolist(), counts[selected].tolist())])
+        return results
+
+    def query_track_ids_many(self, list_of_keys, size, quality=5):
+        """Answers many ``query_track_ids`` queries in a single pass over the index.
+
+        The tracks are selected as in ``query_track_ids``, see ``_track_scores_many``.
+
+        Args:
+            list_of_keys (list of sets of int): Keys of each query.
+            size (int): Number of tracks to return for each query.
+            quality (Optional[int]): Positive number (greater than 0), see ``query_track_ids``. Defaults to 5.
+
+        Returns:
+            list of lists of str: Result of each query, see ``query_track_ids``.
+
+        Raises:
+            ValueError: quality is not positive
+        """
+        if quality <= 0:
+            raise ValueError('quality must be greater than 0')
+        if self._index is None:
+            return [[] for _ in list_of_keys]
+        return [[track_id for track_id, _ in scores]
+                for scores in self._track_scores_many(list_of_keys, size, quality)]
 
     def query_fingerprint(self, track_id=None, return_fields=None):
-        """Query a fingerprint"""
-        if self._fps is None:
+        """Query a fingerprint
+
+        The postings of the track are read from the ``ForwardIndex``, without the deleted keys.
+        """
+        if self._forward is None:
             return None
 
-        fp = self._fps[self._fps.track_id == track_id]
-        fp = fp.drop(['track_id', 'index_ref'], 1)
+        code = self._track_codes.get(track_id)
+        start = end = 0
+        if code is not None and code < self._forward.n_codes:
+            start, end = self._forward.offsets[code], self._forward.offsets[code + 1]
+        keys, indexes = self._forward.keys[start:end], self._forward.indexes[start:end]
+        if len(self._deleted_keys):
+            kept = ~_in_sorted(keys, self._deleted_keys)
+            keys, indexes = keys[kept], indexes[kept]
+        order = np.argsort(indexes, kind='mergesort')
+
+        fp = pd.DataFrame({'key': keys[order]},
+                          index=indexes[order])
 
         return fp
 
@@ -135,12 +1719,13 @@ class DbInMemory:
             size (Optional[int]): How many track IDs  to query
 
         Returns:
-            list of str: List of track IDs
+            list of str: List of track IDs, in insertion order
         """
-        if self._fps is None:
-            return []
-
-        return self._fps.track_id.unique()
+        if len(self._track_codes) == len(self._track_ids):
+            return self._track_ids[offset:offset + size]
+        self._grow_tombstones()
+        codes = np.flatnonzero(~np.asarray(self._deleted, dtype=bool))[offset:offset + size]
+        return [self._track_ids[code] for code in codes.tolist()]
 
 
     def is_ingested_fingerprint(self, track_id, **kwargs):
@@ -155,22 +1740,313 @@ class DbInMemory:
         Raises:
            ValueError if check_partial is True and a partial fingerprint was found
         """
-        if self._fps is None:
-            return False
-
-        return (track_id in self._fps.track_id.values)
+        return track_id in self._track_codes
 
 
     def delete_key(self, key):
-        """Delete one key"""
+        """Delete one key
+
+        The key is ignored by the queries and by the fingerprints inserted later. Its postings are removed by the
+        next compaction.
+
+        Args:
+            key (int): Key to delete.
+        """
+        self._check_writable()
+        if key in self._deleted_keys:
+            return
+        self._log('delete_key', sync=True, key=int(key))
+        self._remove_key(key)
+        if not self._compact_if_needed():
+            self._save_catalog()
+
+    def _remove_key(self, key):
+        """Marks a key as deleted, without persisting it.
+
+        Returns:
+            bool: False if the key was already deleted.
+        """
+        position = np.searchsorted(self._deleted_keys, key)
+        if position < len(self._deleted_keys) and self._deleted_keys[position] == key:
+            return False
+        self._deleted_keys = np.insert(self._deleted_keys, position, key)
+        if self._index is not None:
+            codes = self._index.take(np.array([key]), ('codes',), self._resident)[0]['codes']
+            if len(codes):
+                self._distinct_keys -= 1
+            codes = codes[~self._deleted[codes]]
+            codes, counts = np.unique(codes, return_counts=True)
+            for code, count in zip(codes.tolist(), counts.tolist()):
+                self._postings_count[code] -= count
+                self._keys_count[code] -= 1
+                self._postings_total -= count
+                self._keys_total -= 1
+                self._deleted_postings += count
+                self._deleted_keys_postings += count
+        self._invalidate_cache()
+        return True
+
+    def _remove(self, track_id):
+        """Marks a fingerprint as deleted in the tombstones, without persisting them.
+
+        Returns:
+            bool: True if the fingerprint was found.
+        """
+        code = self._track_codes.pop(track_id, None)
+        if code is None:
+            return False
+        self._track_ids[code] = None
+        self._grow_tombstones()
+        self._deleted[code] = True
+        self._deleted_postings += self._postings_count[code]
+        self._postings_total -= self._postings_count[code]
+        self._keys_total -= self._keys_count[code]
+        self._invalidate_cache()
+        return True
 
     def delete_fingerprint(self, track_id):
-        """Delete one fingerprint"""
-        self._fps = self._fps[self._fps.track_id != track_id]
+        """Delete one fingerprint
+
+        Only the tombstone of the track is written, so this does not depend on the size of the database.
+        """
+        self._check_writable()
+        if track_id not in self._track_codes:
+            return
+        self._log('delete', sync=True, track_id=track_id)
+        self._remove(track_id)
+        if self._compact_if_needed():
+            return
+        if isinstance(self._deleted, np.memmap):
+            self._deleted.flush()
+        else:
+            self._save()
+
+    def _compact_if_needed(self):
+        """Compacts the database if enough postings were deleted, see ``compaction_threshold``.
+
+        Returns:
+            bool: True if the database was compacted (and therefore persisted).
+        """
+        if self.compaction_threshold is None or self._index is None or not self._deleted_postings:
+            return False
+        if self._deleted_postings < self.compaction_threshold * len(self._index):
+            return False
+        self.compact()
+        return True
+
+    def compact(self):
+        """Removes the postings of the deleted tracks and keys, and persists the database.
+
+        The remaining tracks are renumbered so that the codes stay dense.
+        """
+        self._check_writable()
+        self._grow_tombstones()
+        alive = ~np.asarray(self._deleted, dtype=bool)
+        if self._index is not None:
+            kept = alive[self._index.codes] & ~_in_sorted(self._index.keys, self._deleted_keys)
+            index = self._index.select(kept)
+            remap = _compact(np.cumsum(alive) - 1)
+            self._index = InvertedIndex.from_sorted(index.keys, remap[index.codes], index.indexes)
+        logger.info(u'Compacting {0}: removing {1} postings.'.format(self.db_name, self._deleted_postings))
+
+        self._keys_count = [count for count, track_id in zip(self._keys_count, self._track_ids) if track_id is not None]
+        self._track_ids = [track_id for track_id in self._track_ids if track_id is not None]
+        self._track_codes = dict((track_id, code) for code, track_id in enumerate(self._track_ids))
+        keys = codes = np.array([], dtype=np.int64)
+        self._forward = None
+        if self._index is not None:
+            keys, codes = self._index.keys, self._index.codes
+            self._forward = ForwardIndex.from_postings(keys, codes, self._index.indexes, len(self._track_ids))
+        self._postings_count = np.bincount(codes, minlength=len(self._track_ids)).tolist()
+        self._distinct_keys = len(np.unique(keys))
+        self._df_keys, self._df_counts = _key_frequencies(keys, codes)
+        # The keys of the deleted tracks can only be removed from the filter by rebuilding it
+        self._update_bloom()
+        self._deleted = np.zeros(len(self._track_ids), dtype=bool)
+        self._deleted_postings = self._deleted_keys_postings = 0
+        self._invalidate_cache()
+        self._save()
 
     def delete_all(self):
         """Deletes data but not the index. If you change the mapping then it will not update with a delete_all query."""
+        self._check_writable()
+        self._wal.close()
         if os.path.exists(self.store_in):
             shutil.rmtree(self.store_in)
-            os.mkdir(self.store_in)
-        self._fps = None
+        os.mkdir(self.store_in)
+        self._snapshot = 0
+        self._index = self._forward = None
+        self._track_ids = []
+        self._track_codes = {}
+        self._postings_count = []
+        self._keys_count = []
+        self._postings_total = self._keys_total = self._distinct_keys = 0
+        self._deleted = np.zeros(0, dtype=bool)
+        self._deleted_postings = self._deleted_keys_postings = 0
+        self._deleted_keys = np.array([], dtype=np.int64)
+        self._df_keys = np.array([], dtype=np.int64)
+        self._df_counts = np.array([], dtype=np.int64)
+        self._bloom = None
+        self._invalidate_cache()
+        self._save()
+
+
+def _copy(source, destination, length):
+    """Copies bytes between two open files.
+
+    Args:
+        source: File to read from, at its current position.
+        destination: File to write to, at its current position.
+        length (int): Number of bytes to copy.
+
+    Returns:
+        int: CRC32 of the copied bytes.
+
+    Raises:
+        ValueError: The source file is too short
+    """
+    checksum = 0
+    while length:
+        chunk = source.read(min(length, WARM_CHUNK_SIZE))
+        if not chunk:
+            raise ValueError('Unexpected end of file in {0}'.format(source.name))
+        destination.write(chunk)
+        checksum = zlib.crc32(chunk, checksum)
+        length -= len(chunk)
+    return checksum & 0xffffffff
+
+
+def _is_store_file(name):
+    """Checks that a file of an exported database is a file of a store, see ``export_database``.
+
+    Args:
+        name: Path of the file, relative to the store: the catalog, or a file of a snapshot in its directory (or
+            in the store itself, as in older stores).
+
+    Returns:
+        bool
+    """
+    directory, base = os.path.split(name)
+    files = ([TOMBSTONES_FILE, BLOOM_FILE] +
+             [column + '.npy' for column in POSTINGS_COLUMNS + FORWARD_COLUMNS + FREQUENCIES_COLUMNS])
+    if not directory:
+        return base == CATALOG_FILE or base in files
+    return directory.startswith(SNAPSHOT_PREFIX) and directory[len(SNAPSHOT_PREFIX):].isdigit() and base in files
+
+
+def export_database(db_name, path):
+    """Exports an in memory database into a single file.
+
+    The pending changes of the write-ahead log are written in a snapshot first. The file holds the files of
+    the store, each one aligned on a page and followed by a manifest with their offset, size and CRC32.
+
+    Args:
+        db_name: Name of the database.
+        path: Path of the file to write.
+
+    Returns:
+        int: Size of the file, in bytes.
+
+    Raises:
+        ValueError: The database does not exist
+    """
+    if not os.path.exists(os.path.join('/tmp', db_name, CATALOG_FILE)):
+        raise ValueError('No database {0} to export'.format(db_name))
+    db = DbInMemory(db_name)
+    columns = POSTINGS_COLUMNS + FORWARD_COLUMNS + FREQUENCIES_COLUMNS
+    # Paths relative to the store, the files of the snapshot being in their directory
+    snapshot = os.path.relpath(db._snapshot_path(), db.store_in)
+    names = [CATALOG_FILE] + [os.path.normpath(os.path.join(snapshot, name))
+                              for name in [TOMBSTONES_FILE, BLOOM_FILE] + [column + '.npy' for column in columns]]
+    names = [name for name in names if os.path.exists(os.path.join(db.store_in, name))]
+    files = []
+    with open(path + '.tmp', 'wb') as archive:
+        offset = ARCHIVE_ALIGNMENT
+        for name in names:
+            archive.seek(offset)
+            size = os.path.getsize(os.path.join(db.store_in, name))
+            with open(os.path.join(db.store_in, name), 'rb') as f:
+                files.append({'name': name, 'offset': offset, 'size': size, 'crc32': _copy(f, archive, size)})
+            offset += -(-size // ARCHIVE_ALIGNMENT) * ARCHIVE_ALIGNMENT
+        manifest = json.dumps({'db_name': db_name, 'store_version': STORE_VERSION, 'files': files}).encode('utf-8')
+        archive.seek(offset)
+        archive.write(manifest)
+        archive.seek(0)
+        archive.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, offset, len(manifest)))
+    os.rename(path + '.tmp', path)
+    logger.info(u'Exported {0} into {1}'.format(db_name, path))
+    return offset + len(manifest)
+
+
+def _read_manifest(archive):
+    """Reads the manifest of an exported database, see ``export_database``.
+
+    Args:
+        archive: Exported file, open.
+
+    Returns:
+        dict: The manifest.
+
+    Raises:
+        ValueError: The file is not an exported database, or it holds other files than those of a store
+    """
+    magic, version, offset, length = ARCHIVE_HEADER.unpack(archive.read(ARCHIVE_HEADER.size))
+    if magic != ARCHIVE_MAGIC or version != ARCHIVE_VERSION:
+        raise ValueError('{0} is not an exported database'.format(archive.name))
+    archive.seek(offset)
+    manifest = json.loads(archive.read(length).decode('utf-8'))
+    for item in manifest['files']:
+        # Names are joined to the store: anything else could be written outside of it
+        if not _is_store_file(item['name']):
+            raise ValueError('{0} is corrupted: unexpected file {1}'.format(archive.name, item['name']))
+    return manifest
+
+
+def import_database(path, db_name=None, force=False):
+    """Imports a database exported with ``export_database``.
+
+    The files of the store are copied and checked, then the database is opened, memory-mapped: nothing is
+    fingerprinted again.
+
+    Args:
+        path: Path of the exported file.
+        db_name (Optional[str]): Name of the imported database. Defaults to the name of the exported database.
+        force (Optional[bool]): Replace an existing database with the same name. Defaults to False.
+
+    Returns:
+        DbInMemory: The imported database.
+
+    Raises:
+        ValueError: The file is not an exported database, or it is corrupted, or it holds other files than those
+            of a store
+        ValueError: The database already exists and force is False
+    """
+    with open(path, 'rb') as archive:
+        manifest = _read_manifest(archive)
+        db_name = db_name or manifest['db_name']
+        store_in = os.path.join('/tmp', db_name)
+        if os.path.exists(store_in) and not force:
+            raise ValueError('Database {0} already exists'.format(db_name))
+
+        # The files are copied aside, so that a failed import leaves no half-written database
+        staging = store_in + '.import'
+        if os.path.exists(staging):
+            shutil.rmtree(staging)
+        os.mkdir(staging)
+        try:
+            for item in manifest['files']:
+                archive.seek(item['offset'])
+                directory = os.path.dirname(os.path.join(staging, item['name']))
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+                with open(os.path.join(staging, item['name']), 'wb') as f:
+                    if _copy(archive, f, item['size']) != item['crc32']:
+                        raise ValueError('{0} is corrupted: wrong checksum for {1}'.format(path, item['name']))
+        except Exception:
+            shutil.rmtree(staging)
+            raise
+    if os.path.exists(store_in):
+        shutil.rmtree(store_in)
+    os.rename(staging, store_in)
+    logger.info(u'Imported {0} from {1}'.format(db_name, path))
+    return DbInMemory(db_name)
@@ -113,20 +113,39 @@ def fingerprint_files(filepaths, fingerprinting_instance):
     return track_ids_fp_paths
 
 
-def ingest_fingerprints(track_ids_fp_paths, db_instance):
-    """Returns the list of valid files to process, and the list of files whose ingestion went wrong.
+def read_fingerprints(track_ids_fp_paths, db_instance):
+    """Reads the fingerprints which are not ingested yet.
 
     Args:
         track_ids_fp_paths (iterator): iterator of tuples (track_id, paths to the fingerprints to ingest)
         db_instance: the instance of the db in which to ingest
+
+    Yields:
+        tuple: (track_id, pandas.DataFrame of the fingerprint)
     """
     for track_id, fp_path in track_ids_fp_paths:
         logger.info(u'Ingesting fingerprint {f} for track_id {t}'.format(f=fp_path, t=track_id))
         if db_instance.is_ingested_fingerprint(track_id):
             logger.info(u'Already ingested. Skipping.')
             continue
-        fp = pd.read_json(fp_path, 'records')
-        db_instance.insert_fingerprint(fp, track_id)
+        yield track_id, pd.read_json(fp_path, 'records')
+
+
+def ingest_fingerprints(track_ids_fp_paths, db_instance):
+    """Returns the list of valid files to process, and the list of files whose ingestion went wrong.
+
+    The fingerprints are bulk inserted if the database implements ``insert_fingerprints``.
+
+    Args:
+        track_ids_fp_paths (iterator): iterator of tuples (track_id, paths to the fingerprints to ingest)
+        db_instance: the instance of the db in which to ingest
+    """
+    fingerprints = read_fingerprints(track_ids_fp_paths, db_instance)
+    if hasattr(db_instance, 'insert_fingerprints'):
+        db_instance.insert_fingerprints(fingerprints)
+    else:
+        for track_id, fp in fingerprints:
+            db_instance.insert_fingerprint(fp, track_id)
 
 
 def ingest_files(list_of_files,
@@ -94,21 +94,43 @@ class SampleMatching(object):
         tracks_scored_unsorted = []
 
         track_ids = self.db.query_track_ids(fp.key, 10)
-        all_queried_keys = self.db.query_keys(fp.key, track_ids)
-
-        for track_id in track_ids:
-            queried_keys = all_queried_keys[track_id]
+        if hasattr(self.db, 'query_keys_arrays'):
+            scores = self.get_scores_arrays(self.db.query_keys_arrays(fp.key, track_ids), current_segment_indexes)
+        else:
+            all_queried_keys = self.db.query_keys(fp.key, track_ids)
             # Sum of common indexes
-            score = sum(len(np.intersect1d(current_segment_indexes, value['index'], assume_unique=True)) for key, value in queried_keys.iteritems())
+            scores = dict((track_id, sum(len(np.intersect1d(current_segment_indexes, value['index'], assume_unique=True))
+                                         for key, value in all_queried_keys[track_id].iteritems()))
+                          for track_id in track_ids)
 
+        for track_id in track_ids:
             tracks_scored_unsorted.append({
                 'track_id': track_id,
-                'score': score,
+                'score': scores.get(track_id, 0),
             })
         tracks_scored = pd.DataFrame(tracks_scored_unsorted).sort_values('score', ascending=False)
 
         return tracks_scored
 
+    @staticmethod
+    def get_scores_arrays(matches, current_segment_indexes):
+        """Counts, for each track, the matching indexes which are in the current segment.
+
+        Args:
+            matches: KeyMatches returned by the ``query_keys_arrays`` method of the database
+            current_segment_indexes (np.array): consecutive indexes of the current segment
+
+        Returns:
+            dict: {track_id: score}
+        """
+        if not len(current_segment_indexes):
+            return {}
+        codes = np.repeat(matches.codes, np.diff(matches.offsets))
+        in_segment = ((matches.indexes >= current_segment_indexes[0]) &
+                      (matches.indexes <= current_segment_indexes[-1]))
+        codes, scores = np.unique(codes[in_segment], return_counts=True)
+        return dict((matches.track_ids[code], score) for code, score in zip(codes.tolist(), scores.tolist()))
+
 
 class SampleTracklisting(Tracklisting):
     """Simplest possible tracklisting algorithm
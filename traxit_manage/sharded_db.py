@@ -0,0 +1,357 @@
+"""Fingerprint database partitioned across shard processes."""
+
+import logging
+import multiprocessing
+from multiprocessing.connection import Client
+from multiprocessing.connection import Listener
+import os
+import threading
+import zlib
+
+from traxit_manage.in_memory_db import DbInMemory
+from traxit_manage.utility import _import
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(track_id, n_shards):
+    """Finds the shard holding a track.
+
+    The hash is stable across processes and hosts, unlike ``hash``.
+
+    Args:
+        track_id: The id referencing the fingerprint.
+        n_shards (int): Number of shards.
+
+    Returns:
+        int: Number of the shard.
+    """
+    return (zlib.crc32(u'{0}'.format(track_id).encode('utf-8')) & 0xffffffff) % n_shards
+
+
+def serve_shard(db_name, address=('localhost', 0), authkey=None, db_class=DbInMemory, ready=None,
+                **kwargs):
+    """Serves a database to ``ShardedDb`` clients until one of them sends ``close``.
+
+    Each request is a pickled tuple (method name, args, kwargs) sent over a ``multiprocessing.connection``
+    socket. The response is a tuple (True, result) or (False, exception). Nothing is shared but the socket,
+    so the shard may run on another host. Each client is served in its own thread, and the requests of all the
+    clients are run one at a time on the database.
+
+    Args:
+        db_name: Name of the database of the shard.
+        address (Optional[tuple]): (host, port) to listen on. Defaults to a free port on localhost.
+        authkey (Optional[bytes]): Key authenticating the clients.
+        db_class (Optional[str or class]): Database class of the shard. Defaults to ``DbInMemory``.
+        ready (Optional[multiprocessing.Connection]): The address listened on is sent to it once listening.
+        kwargs: passed to the database class.
+    """
+    if isinstance(db_class, basestring):
+        db_class = _import(db_class)
+    db = db_class(db_name, **kwargs)
+    listener = Listener(address, authkey=authkey)
+    if ready is not None:
+        ready.send(listener.address)
+        ready.close()
+    logger.info(u'Serving {0} on {1}'.format(db, listener.address))
+    lock = threading.Lock()
+    closing = threading.Event()
+    try:
+        while not closing.is_set():
+            conn = listener.accept()
+            thread = threading.Thread(target=_serve_client, args=(db, conn, lock, closing, listener.address, authkey))
+            thread.daemon = True
+            thread.start()
+    finally:
+        listener.close()
+
+
+def _serve_client(db, conn, lock, closing, address, authkey):
+    """Answers the requests of one client of ``serve_shard`` until it disconnects or sends ``close``."""
+    try:
+        while True:
+            try:
+                method, args, method_kwargs = conn.recv()
+            except EOFError:
+                break
+            if method == 'close':
+                conn.send((True, None))
+                closing.set()
+                # Wakes up the listener, which checks closing after each connection
+                Client(address, authkey=authkey).close()
+                break
+            try:
+                with lock:
+                    result = getattr(db, method)(*args, **method_kwargs)
+            except Exception as e:
+                logger.exception(u'{0} failed on {1}'.format(method, db))
+                conn.send((False, e))
+            else:
+                conn.send((True, result))
+    finally:
+        conn.close()
+
+
+class ShardedDb(object):
+    """Fingerprint database whose tracks are partitioned across shards.
+
+    A track is stored in the shard given by ``shard_of``. Queries on keys are sent to all the shards at
+    once, which answer in parallel, then the results are merged; queries on tracks only go to their shard.
+    The number of shards must not change for a given database. With ``idf_weighting``, each shard weighs
+    the keys with its own key frequencies.
+
+    A pickled copy connects to the same shards with its own sockets, so it can be used by another process. It
+    does not own the local shard processes: closing it only disconnects it.
+
+    By default the shards are local processes started with ``serve_shard``, each holding a database named
+    ``<db_name>_shard<i>``. Shards started elsewhere can be given with ``addresses``.
+
+    Args:
+        db_name: Name of the database.
+        n_shards (Optional[int]): Number of local shard processes to start. Defaults to 4.
+        shard_class (Optional[str or class]): Database class of the local shards. Defaults to ``DbInMemory``.
+        addresses (Optional[list of tuples]): (host, port) of running shards. If given, no process is started.
+        authkey (Optional[bytes]): Key authenticating to the shards. Defaults to a random key for local shards.
+        batch_size (Optional[int]): Number of tracks sent to a shard in each message by ``insert_fingerprints``.
+            Each message is persisted by the shard. Defaults to 10000.
+        kwargs: passed to the database class of the local shards.
+    """
+
+    def __init__(self, db_name, n_shards=4, shard_class=DbInMemory, addresses=None, authkey=None,
+                 batch_size=10000, **kwargs):
+        self.db_name = db_name
+        self.batch_size = batch_size
+        self._processes = []
+        if addresses is None:
+            authkey = authkey or os.urandom(20)
+            addresses = [self._start_shard(u'{0}_shard{1}'.format(db_name, i), shard_class, authkey, kwargs)
+                         for i in range(n_shards)]
+        self.addresses = [tuple(address) for address in addresses]
+        self._authkey = authkey
+        self._connections = [Client(address, authkey=authkey) for address in self.addresses]
+        self.n_shards = len(self._connections)
+
+    def __getstate__(self):
+        """Only the name of the database and the addresses of the shards are pickled."""
+        return {'db_name': self.db_name, 'addresses': self.addresses, 'authkey': self._authkey,
+                'batch_size': self.batch_size}
+
+    def __setstate__(self, state):
+        """Connects to the shards of the pickled database."""
+        self.__init__(state['db_name'], addresses=state['addresses'], authkey=state['authkey'],
+                      batch_size=state['batch_size'])
+
+    def _start_shard(self, db_name, shard_class, authkey, kwargs):
+        """Starts a local shard process and returns its address."""
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=serve_shard, args=(db_name,),
+                                          kwargs=dict(kwargs, authkey=authkey, db_class=shard_class, ready=sender))
+        process.daemon = True
+        process.start()
+        sender.close()
+        self._processes.append(process)
+        return receiver.recv()
+
+    def __repr__(self):
+        return u'ShardedDb {0} ({1} shards)'.format(self.db_name, self.n_shards)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def _scatter(self, requests):
+        """Sends one request per shard, then gathers the responses.
+
+        Args:
+            requests (dict): {shard: (method, args, kwargs)}
+
+        Returns:
+            dict: {shard: result}
+
+        Raises:
+            Exception: The exception raised by a shard.
+        """
+        for shard, request in requests.items():
+            self._connections[shard].send(request)
+        results = {}
+        error = None
+        for shard in requests:
+            ok, result = self._connections[shard].recv()
+            if ok:
+                results[shard] = result
+            elif error is None:
+                error = result
+        if error is not None:
+            raise error
+        return results
+
+    def _broadcast(self, method, *args, **kwargs):
+        """Calls a method on all the shards. Returns the list of results, by shard."""
+        results = self._scatter(dict((shard, (method, args, kwargs)) for shard in range(self.n_shards)))
+        return [results[shard] for shard in range(self.n_shards)]
+
+    def _call(self, track_id, method, *args, **kwargs):
+        """Calls a method on the shard of a track."""
+        shard = shard_of(track_id, self.n_shards)
+        return self._scatter({shard: (method, args, kwargs)})[shard]
+
+    def _by_shard(self, track_ids):
+        """Groups track ids by shard. Returns {shard: [track_id, ...]}."""
+        groups = {}
+        for track_id in track_ids:
+            groups.setdefault(shard_of(track_id, self.n_shards), []).append(track_id)
+        return groups
+
+    def close(self):
+        """Stops the local shard processes and disconnects from the shards."""
+        for process, conn in zip(self._processes, self._connections):
+            conn.send(('close', (), {}))
+            conn.recv()
+        for conn in self._connections:
+            conn.close()
+        for process in self._processes:
+            process.join()
+        self._processes = []
+        self._connections = []
+
+    def insert_fingerprint(self, fp, track_id, override=False):
+        """Inserts a fingerprint into its shard, see ``DbInMemory.insert_fingerprint``."""
+        self._call(track_id, 'insert_fingerprints', [(track_id, fp)], override=override)
+
+    def insert_fingerprints(self, fps, override=False):
+        """Inserts many fingerprints, in parallel in each shard. See ``DbInMemory.insert_fingerprints``.
+
+        The fingerprints are read as they are sent: once ``batch_size`` tracks are buffered for a shard, the
+        buffered tracks of all the shards are sent, so at most ``n_shards * batch_size`` tracks are held in memory.
+
+        Args:
+            fps (iterable): Iterable of tuples (track_id, fp) where fp is a pandas dataframe with a column named `key`.
+            override: Boolean to replace previously existing fingerprints.
+        """
+        groups = {}
+        try:
+            for track_id, fp in fps:
+                shard_fps = groups.setdefault(shard_of(track_id, self.n_shards), [])
+                shard_fps.append((track_id, fp))
+                if len(shard_fps) >= self.batch_size:
+                    groups, batch = {}, groups
+                    self._insert_batch(batch, override)
+        except BaseException:
+            # The tracks read before the error are inserted, as with DbInMemory.insert_fingerprints
+            if groups:
+                self._insert_batch(groups, override)
+            raise
+        if groups:
+            self._insert_batch(groups, override)
+
+    def _insert_batch(self, groups, override):
+        """Sends buffered fingerprints to their shards, see ``insert_fingerprints``.
+
+        Args:
+            groups (dict): {shard: [(track_id, fp), ...]}
+            override: Boolean to replace previously existing fingerprints.
+        """
+        self._scatter(dict((shard, ('insert_fingerprints', (shard_fps,), {'override': override}))
+                           for shard, shard_fps in groups.items()))
+
+    def query_track_ids(self, keys, size, quality=5):
+        """Query track_ids from a set of integer keys
+
+        Each shard returns its ``size * quality`` best tracks with their number of matching postings, and the
+        best ``size`` are kept. Since a track is entirely in one shard, its count is exact.
+
+        Args:
+            keys (set of int): Keys to be used to search for the tracks.
+            size (int): Number of tracks to return as a result.
+            quality (Optional[int]): Positive number (greater than 0). Defaults to 5.
+
+        Returns:
+            list of str: Ordered list of track IDs to that correspond best to the queried keys. Ordered from most
+                relevant to less relevant. Tracks with the same count are ordered by shard.
+        """
+        return [track_id for track_id, _ in self.query_track_scores(keys, size, quality)]
+
+    def query_track_scores(self, keys, size, quality=5):
+        """Query track_ids from a set of integer keys, along with their number of matching postings.
+
+        See ``DbInMemory.query_track_scores``.
+        """
+        keys = list(keys)
+        scores = self._broadcast('query_track_scores', keys, int(size * quality), 1)
+        merged = [(-count, shard, rank, track_id)
+                  for shard, shard_scores in enumerate(scores)
+                  for rank, (track_id, count) in enumerate(shard_scores)]
+        return [(track_id, -count) for count, _, _, track_id in sorted(merged)[:size]]
+
+    def query_keys(self, keys, track_ids):
+        """Query keys from the shards of the tracks
+
+        Args:
+            keys (set of int): Keys to be used to search for the tracks.
+            track_ids (iterator of str): Iterator of track IDs to that correspond best to the queried keys.
+
+        Results:
+            dict: {track_id: {key: [{"index": np.array}, ...] }}
+        """
+        keys = list(keys)
+        results = self._scatter(dict((shard, ('query_keys', (keys, shard_track_ids), {}))
+                                     for shard, shard_track_ids in self._by_shard(track_ids).items()))
+        merged = {}
+        for result in results.values():
+            merged.update(result)
+        return merged
+
+    def query_fingerprint(self, track_id=None, return_fields=None):
+        """Query a fingerprint"""
+        return self._call(track_id, 'query_fingerprint', track_id)
+
+    def get_fp_ids(self, offset=0, size=10):
+        """Get track IDs for fingerprints
+
+        Args:
+            offset (Optional[int]): Where to begin in the whole list of IDs. Defaults to 0.
+            size (Optional[int]): How many track IDs  to query
+
+        Returns:
+            list of str: List of track IDs, shard by shard
+        """
+        fp_ids = []
+        for shard, count in enumerate(self._broadcast('keys_count')):
+            if len(fp_ids) >= size:
+                break
+            if offset >= count:
+                offset -= count
+                continue
+            fp_ids.extend(self._scatter({shard: ('get_fp_ids', (offset, size - len(fp_ids)), {})})[shard])
+            offset = 0
+        return fp_ids
+
+    def is_ingested_fingerprint(self, track_id, **kwargs):
+        """Checks if the fingerprint was already ingested
+
+        Args:
+            track_id: id of the fingerprint
+
+        Returns:
+            A boolean which is True if the fingerprint was ingested, False otherwise
+        """
+        return self._call(track_id, 'is_ingested_fingerprint', track_id, **kwargs)
+
+    def keys_count(self):
+        """Counts the number of distinct track ids in the database.
+
+        Returns:
+            int: Total number of keys
+        """
+        return sum(self._broadcast('keys_count'))
+
+    def delete_key(self, key):
+        """Delete one key from all the shards"""
+        self._broadcast('delete_key', key)
+
+    def delete_fingerprint(self, track_id):
+        """Delete one fingerprint"""
+        self._call(track_id, 'delete_fingerprint', track_id)
+
+    def delete_all(self):
+        """Deletes the data of all the shards."""
+        self._broadcast('delete_all')
@@ -0,0 +1,272 @@
+"""Fingerprint database stored in SQLite."""
+
+import logging
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS tracks (code INTEGER PRIMARY KEY, track_id TEXT NOT NULL UNIQUE)',
+    'CREATE TABLE IF NOT EXISTS postings (key INTEGER NOT NULL, code INTEGER NOT NULL, index_ref INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS postings_key ON postings (key, code)',
+    'CREATE INDEX IF NOT EXISTS postings_code ON postings (code)',
+)
+
+
+def _integers(values, name):
+    """Converts an array of integers into a list of Python ints, for SQLite.
+
+    Raises:
+        TypeError: The values are not integers
+    """
+    values = np.asarray(values)
+    if len(values) and values.dtype.kind not in 'iub':
+        raise TypeError('Fingerprint {0} must be integers, not {1}'.format(name, values.dtype))
+    return values.tolist()
+
+
+class DbSqlite(object):
+    """Fingerprint database stored in a SQLite file, ``/tmp/<db_name>.sqlite3``.
+
+    Tracks are mapped to integer codes in the ``tracks`` table. Each posting (key, code, index_ref) is a row
+    of the ``postings`` table, indexed by key and by code. The file is in write-ahead logging mode, so other
+    processes can query the database while it is written. Pickling an instance (for instance to send it to a
+    ``multiprocessing.Pool``) only sends its name, and the worker opens its own connection.
+
+    Select it with ``--database-class-path traxit_manage.sqlite_db.DbSqlite``.
+
+    Args:
+        db_name: Name of the database.
+        commit_every (Optional[int]): Number of tracks inserted in each transaction by ``insert_fingerprints``.
+            Defaults to 1000.
+    """
+
+    def __init__(self, db_name, commit_every=1000):
+        self.db_name = db_name
+        self.commit_every = commit_every
+        self.path = os.path.join('/tmp', db_name + '.sqlite3')
+        self._connection = sqlite3.connect(self.path)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        with self._connection:
+            for statement in SCHEMA:
+                self._connection.execute(statement)
+            self._connection.execute('CREATE TEMP TABLE query_keys (key INTEGER PRIMARY KEY)')
+
+    def __getstate__(self):
+        """Only the name of the database is pickled."""
+        return {'db_name': self.db_name, 'commit_every': self.commit_every}
+
+    def __setstate__(self, state):
+        """Opens a new connection to the pickled database."""
+        self.__init__(state['db_name'], commit_every=state['commit_every'])
+
+    def __repr__(self):
+        return u'SQLite database {0}'.format(self.path)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def _code(self, track_id):
+        """Returns the code of a track, or None."""
+        row = self._connection.execute('SELECT code FROM tracks WHERE track_id = ?', (track_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_query_keys(self, keys):
+        """Fills the temporary table joined with the postings by the queries.
+
+        This opens a transaction, which the query must commit: until then, the connection keeps reading the
+        database as it was, without the tracks committed by other connections.
+        """
+        self._connection.execute('DELETE FROM query_keys')
+        self._connection.executemany('INSERT OR IGNORE INTO query_keys (key) VALUES (?)',
+                                     ((key,) for key in _integers(list(keys), 'keys')))
+
+    def keys_count(self):
+        """Counts the number of distinct track ids in the database.
+
+        Returns:
+            int: Total number of keys
+        """
+        return self._connection.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+
+    def insert_fingerprint(self, fp, track_id, override=False):
+        """Inserts a fingerprint into the database.
+
+        If a fingerprint with a given track_id exists, it is replaced if override is True.
+        The postings of a fingerprint are inserted in the same transaction as the track, so a fingerprint is
+        never partial.
+
+        Args:
+            fp: A pandas dataframes with a column named `key`.
+            track_id: The id referencing the fingerprint.
+            override: Boolean to replace a previously existing fingerprint.
+        """
+        self.insert_fingerprints([(track_id, fp)], override=override)
+
+    def insert_fingerprints(self, fps, override=False):
+        """Inserts many fingerprints into the database, ``commit_every`` tracks per transaction.
+
+        Args:
+            fps (iterable): Iterable of tuples (track_id, fp) where fp is a pandas dataframe with a column named `key`.
+            override: Boolean to replace previously existing fingerprints.
+        """
+        inserted = 0
+        try:
+            for track_id, fp in fps:
+                if not isinstance(fp, pd.DataFrame):
+                    raise TypeError('fp must be a pandas dataframe')
+                code = self._code(track_id)
+                if code is not None:
+                    if not override:
+                        logger.warning(u'Fingerprint {0} already ingested. Skipping.'.format(track_id))
+                        continue
+                    self._delete(code)
+
+                logger.info(u'Constructing the documents for {0}.'.format(track_id))
+                keys, indexes = _integers(fp['key'].values, 'keys'), _integers(fp.index.values, 'indexes')
+                code = self._connection.execute('INSERT INTO tracks (track_id) VALUES (?)', (track_id,)).lastrowid
+                self._connection.executemany('INSERT INTO postings (key, code, index_ref) VALUES (?, ?, ?)',
+                                             ((key, code, index) for key, index in zip(keys, indexes)))
+                inserted += 1
+                if inserted % self.commit_every == 0:
+                    self._connection.commit()
+        except Exception:
+            # Only the tracks of the current transaction are lost
+            self._connection.rollback()
+            raise
+        self._connection.commit()
+
+    def query_track_ids(self, keys, size, quality=5):
+        """Query track_ids from a set of integer keys
+
+        Args:
+            keys (set of int): Keys to be used to search for the tracks.
+            size (int): Number of tracks to return as a result.
+            quality (Optional[int]): Positive number (greater than 0). This will be passed to Elasticsearch as
+                `size_shard = size * quality`. Defaults to 5. The counts are exact here, so it is not used.
+
+        Returns:
+            list of str: Ordered list of track IDs to that correspond best to the queried keys. Ordered from most
+                relevant to less relevant. Tracks with the same count are ordered by insertion order.
+
+        Raises:
+            ValueError: quality is not positive
+        """
+        return [track_id for track_id, _ in self.query_track_scores(keys, size, quality)]
+
+    def query_track_scores(self, keys, size, quality=5):
+        """Query track_ids from a set of integer keys, along with their number of matching postings.
+
+        Args:
+            keys (set of int): Keys to be used to search for the tracks.
+            size (int): Number of tracks to return as a result.
+            quality (Optional[int]): Positive number (greater than 0), see ``query_track_ids``. Defaults to 5.
+
+        Returns:
+            list of tuples (str, int): Track IDs and their number of matching postings, in the order of
+                ``query_track_ids``.
+
+        Raises:
+            ValueError: quality is not positive
+        """
+        if quality <= 0:
+            raise ValueError('quality must be greater than 0')
+        with self._connection:
+            self._set_query_keys(keys)
+            return self._connection.execute(
+                'SELECT tracks.track_id, counts.n FROM '
+                '(SELECT postings.code AS code, COUNT(*) AS n FROM query_keys '
+                'JOIN postings ON postings.key = query_keys.key GROUP BY postings.code) AS counts '
+                'JOIN tracks ON tracks.code = counts.code ORDER BY counts.n DESC, counts.code LIMIT ?',
+                (int(size),)).fetchall()
+
+    def query_keys(self, keys, track_ids):
+        """Query keys from the database
+
+        Args:
+            keys (set of int): Keys to be used to search for the tracks.
+            track_ids (iterator of str): Iterator of track IDs to that correspond best to the queried keys.
+
+        Results:
+            dict: {track_id: {key: [{"index": np.array}, ...] }}
+        """
+        codes = {}
+        for track_id in track_ids:
+            code = self._code(track_id)
+            if code is not None:
+                codes[code] = track_id
+        if not codes:
+            return {}
+        with self._connection:
+            self._set_query_keys(keys)
+            rows = self._connection.execute(
+                'SELECT postings.code, postings.key, postings.index_ref FROM query_keys '
+                'JOIN postings ON postings.key = query_keys.key '
+                'WHERE postings.code IN ({0}) ORDER BY postings.code, postings.key, postings.rowid'
+                .format(', '.join('?' * len(codes))), list(codes)).fetchall()
+        indexes = {}
+        for code, key, index in rows:
+            indexes.setdefault((code, key), []).append(index)
+        result = {}
+        for (code, key), values in indexes.items():
+            result.setdefault(codes[code], {})[key] = {'index': np.array(values)}
+        return result
+
+    def query_fingerprint(self, track_id=None, return_fields=None):
+        """Query a fingerprint"""
+        rows = self._connection.execute(
+            'SELECT postings.index_ref, postings.key FROM postings JOIN tracks ON tracks.code = postings.code '
+            'WHERE tracks.track_id = ? ORDER BY postings.index_ref, postings.rowid', (track_id,)).fetchall()
+        return pd.DataFrame({'key': [key for _, key in rows]}, index=[index for index, _ in rows])
+
+    def get_fp_ids(self, offset=0, size=10):
+        """Get track IDs for fingerprints
+
+        Args:
+            offset (Optional[int]): Where to begin in the whole list of IDs. Defaults to 0.
+            size (Optional[int]): How many track IDs  to query
+
+        Returns:
+            list of str: List of track IDs, in insertion order
+        """
+        return [track_id for track_id, in self._connection.execute(
+            'SELECT track_id FROM tracks ORDER BY code LIMIT ? OFFSET ?', (size, offset))]
+
+    def is_ingested_fingerprint(self, track_id, **kwargs):
+        """Checks if the fingerprint was already ingested
+
+        Args:
+            track_id: id of the fingerprint
+
+        Returns:
+            A boolean which is True if the fingerprint was ingested, False otherwise
+        """
+        return self._code(track_id) is not None
+
+    def delete_key(self, key):
+        """Delete one key"""
+        with self._connection:
+            self._connection.execute('DELETE FROM postings WHERE key = ?', (int(key),))
+
+    def _delete(self, code):
+        """Deletes the track and the postings of a code, without committing."""
+        self._connection.execute('DELETE FROM postings WHERE code = ?', (code,))
+        self._connection.execute('DELETE FROM tracks WHERE code = ?', (code,))
+
+    def delete_fingerprint(self, track_id):
+        """Delete one fingerprint"""
+        code = self._code(track_id)
+        if code is not None:
+            with self._connection:
+                self._delete(code)
+
+    def delete_all(self):
+        """Deletes all the fingerprints."""
+        with self._connection:
+            self._connection.execute('DELETE FROM postings')
+            self._connection.execute('DELETE FROM tracks')
@@ -1,6 +1,12 @@
+from collections import deque
+import copy
 import json
 import logging
+from multiprocessing import cpu_count
+from multiprocessing import Pool
 import os
+import pickle
+import time
 
 import click
 import pandas as pd
@@ -10,8 +16,8 @@ from traxit_manage.config import configure_fingerprinting
 from traxit_manage.config import configure_matching
 from traxit_manage.config import configure_tracklisting
 from traxit_manage.decode import Decode
-from traxit_manage.decode import decode_wave
-from traxit_manage.decode import length_wave
+from traxit_manage.decode import StreamSource
+from traxit_manage.decode import WaveSource
 from traxit_manage.utility import _import
 from traxit_manage.utility import clean_list_of_files
 from traxit_manage.utility import dict_to_xml
@@ -28,6 +34,8 @@ logger = logging.getLogger(__name__)
 
 time_format = '%Y-%m-%d-%H-%M-%S'
 audio_cache_filetype = 'cache.wav'
+# Seconds between two checkpoints of the tracklisting of a file
+checkpoint_interval = 60.
 
 
 def tracklist_helper(corpus,
@@ -44,6 +52,8 @@ def tracklist_helper(corpus,
                      matching_class_path=None,
                      tracklisting_class_path=None,
                      database_class_path=None,
+                     jobs=1,
+                     chunk_jobs=1,
                      ):
     """Tracklists a file 'audio.*' in the broadcast. Gives an option to export the audio file of the detection.
 
@@ -66,6 +76,9 @@ def tracklist_helper(corpus,
         matching_class_path (string): Path to a matching class using dot notation. Example: myalgorithm.Matching. Defaults to None.
         tracklisting_class_path (string): Path to a tracklisting class using dot notation. Example: myalgorithm.Tracklisting. Defaults to None.
         database_class_path (string): Path to a database class using dot notation. Example: myalgorithm.Database. Defaults to None.
+        jobs (int): Number of files tracklisted in parallel, see ``get_tracklist``. Defaults to 1.
+        chunk_jobs (int): Number of processes matching the segments of each file, see ``get_tracklist``.
+            Defaults to 1.
 
 
     Returns:
@@ -76,29 +89,15 @@ def tracklist_helper(corpus,
             db_name = make_db_name(corpus, broadcast)
         else:
             db_name = make_db_name(corpus)
-    db_instance = configure_database(db_name=db_name)
+    db_instance = configure_database(db_name=db_name, db_class=database_class_path)
     print('Using database {db}'.format(db=db_instance))
+    if cli and hasattr(db_instance, 'warm'):
+        with click.progressbar(length=db_instance.memory_usage()['postings_bytes'],
+                               label='Loading the database') as bar:
+            db_instance.warm(progress=bar.update)
 
     if pipeline is None:
-        pipeline = {}
-        # TODO: Put this logic in bin instead and take a pipeline as input for this function
-        if fingerprinting_class_path is not None:
-            pipeline['fingerprinting'] = {
-                'class': _import(fingerprinting_class_path),
-                'params': None
-            }
-        if matching_class_path is not None:
-            pipeline['matching'] = {
-                'class': _import(matching_class_path),
-                'params': None
-            }
-        if tracklisting_class_path is not None:
-            pipeline['tracklisting'] = {
-                'class': _import(tracklisting_class_path),
-                'params': None
-            }
-        if pipeline == {}:
-            pipeline = None
+        pipeline = make_pipeline(fingerprinting_class_path, matching_class_path, tracklisting_class_path)
 
     fingerprinting_instance = configure_fingerprinting(pipeline=pipeline)
     matching_instance = configure_matching(pipeline=pipeline,
@@ -129,11 +128,13 @@ def tracklist_helper(corpus,
                                        reset_cache=reset_cache,
                                        reset_history_tracklist=reset_history_tracklist,
                                        cli=cli,
+                                       pipeline=pipeline,
                                        introspect_trackids=introspect_trackids,
-                                       detection_file_append=detection_file_append)
-    ok = list(set(list_of_valid))
+                                       detection_file_append=detection_file_append,
+                                       jobs=jobs,
+                                       chunk_jobs=chunk_jobs)
     detection_dict = {}
-    for audio_file_path, tl in zip(ok, tls):
+    for audio_file_path, tl in zip(list_of_valid, tls):
         detection_dict = store_tracklist(broadcast,
                                          corpus_path,
                                          db_name,
@@ -145,6 +146,147 @@ def tracklist_helper(corpus,
     return detection_dict
 
 
+def make_pipeline(fingerprinting_class_path=None, matching_class_path=None, tracklisting_class_path=None):
+    """Builds a pipeline from class paths.
+
+    Args:
+        fingerprinting_class_path (string): Path to a fingerprinting class using dot notation. Example: myalgorithm.Fingerprinting. Defaults to None.
+        matching_class_path (string): Path to a matching class using dot notation. Example: myalgorithm.Matching. Defaults to None.
+        tracklisting_class_path (string): Path to a tracklisting class using dot notation. Example: myalgorithm.Tracklisting. Defaults to None.
+
+    Returns:
+        dict or None: The pipeline, or None if no class path is given.
+    """
+    pipeline = {}
+    # TODO: Put this logic in bin instead and take a pipeline as input for tracklist_helper
+    if fingerprinting_class_path is not None:
+        pipeline['fingerprinting'] = {
+            'class': _import(fingerprinting_class_path),
+            'params': None
+        }
+    if matching_class_path is not None:
+        pipeline['matching'] = {
+            'class': _import(matching_class_path),
+            'params': None
+        }
+    if tracklisting_class_path is not None:
+        pipeline['tracklisting'] = {
+            'class': _import(tracklisting_class_path),
+            'params': None
+        }
+    return pipeline or None
+
+
+def live_tracklist_helper(corpus,
+                          broadcast,
+                          stream,
+                          globaldb=False,
+                          db_name=None,
+                          pipeline=None,
+                          introspect_trackids=None,
+                          fingerprinting_class_path=None,
+                          matching_class_path=None,
+                          tracklisting_class_path=None,
+                          database_class_path=None,
+                          **kwargs):
+    """Tracklists a live stream, see ``tracklist_stream``.
+
+    Args:
+        corpus: name of the corpus
+        broadcast: name of the broadcast
+        stream: file object to read the audio from, opened in binary mode: stdin, a FIFO or a growing file.
+        globaldb: use a corpus-wide database. Defaults to False
+        db_name: the name to instanciate the db with. If None (default), the name is set to
+        ``db_name = make_db_name(corpus, broadcast)``
+        pipeline: (Optional[string or dict]): see ``tracklist_helper``.
+        introspect_trackids: list or None.
+        fingerprinting_class_path (string): Path to a fingerprinting class using dot notation. Example: myalgorithm.Fingerprinting. Defaults to None.
+        matching_class_path (string): Path to a matching class using dot notation. Example: myalgorithm.Matching. Defaults to None.
+        tracklisting_class_path (string): Path to a tracklisting class using dot notation. Example: myalgorithm.Tracklisting. Defaults to None.
+        database_class_path (string): Path to a database class using dot notation. Example: myalgorithm.Database. Defaults to None.
+        kwargs: passed to ``StreamSource``, for instance ``follow=True`` for a growing file.
+
+    Yields:
+        dict: Tracklist items, as soon as they are final. The filename of the reference is added under
+            ``filename`` when the track is a reference of the broadcast.
+    """
+    if db_name is None:
+        db_name = make_db_name(corpus) if globaldb else make_db_name(corpus, broadcast)
+    db_instance = configure_database(db_name=db_name, db_class=database_class_path)
+    logger.info(u'Using database {0}'.format(db_instance))
+    if pipeline is None:
+        pipeline = make_pipeline(fingerprinting_class_path, matching_class_path, tracklisting_class_path)
+    fingerprinting_instance = configure_fingerprinting(pipeline=pipeline)
+    matching_instance = configure_matching(pipeline=pipeline,
+                                           fingerprinting_instance=fingerprinting_instance,
+                                           db_instance=db_instance)
+    tracklisting_instance = configure_tracklisting(pipeline=pipeline,
+                                                   db_instance=db_instance)
+    filenames = dict((track_id, filename)
+                     for filename, track_id in read_references(path_corpus(corpus), broadcast).iteritems())
+    for item in tracklist_stream(StreamSource(stream, **kwargs), fingerprinting_instance, matching_instance,
+                                 tracklisting_instance, introspect_trackids):
+        if item.get('id') in filenames:
+            item['filename'] = filenames[item['id']]
+        yield item
+
+
+def _final_items(tracklisting_instance, history):
+    """Computes the tracklist items of a part of the history of a tracklisting instance."""
+    instance = copy.copy(tracklisting_instance)
+    instance.history_tracklist = history
+    return instance.compute_tracklist()
+
+
+def tracklist_stream(source, fingerprinting_instance, matching_instance, tracklisting_instance,
+                     introspect_trackids=None):
+    """Tracklists audio as it is received.
+
+    Segments are generated with ``tracklisting_instance.pre_processing`` as soon as their audio is received, so
+    the latency is bounded by the size of a segment and not by the length of the stream. The end of a tracklist
+    item is the start of the next one, so an item is final once the next entry of ``history_tracklist`` exists,
+    that is once ``post_processing`` has seen enough segments (``vote_horizon`` for ``TracklistingV1``). The last
+    item ends with the stream. The entries of ``history_tracklist`` are dropped once their item is final, except
+    for the last one, so the memory does not grow with the stream.
+
+    Args:
+        source (StreamSource): the audio stream
+        fingerprinting_instance: instance of traxit_algorithm.fingerprinting.Fingerprinting
+        matching_instance: instance of traxit_algorithm.matching.Matching
+        tracklisting_instance: instance of traxit_manage.tracklisting.Tracklisting
+        introspect_trackids: list or None.
+
+    Yields:
+        dict: Tracklist items (see ``Tracklisting.compute_tracklist``), in order, as soon as they are final
+    """
+    tracklisting_instance.reset()
+    t1 = t2 = 0
+    # Same segments as times_list, whose end is only known once the stream ends
+    while not (source.ended and t2 > source.length):
+        t1, t2 = tracklisting_instance.pre_processing(t1, t2)
+        buf_start, buf_end = fingerprinting_instance.how_much_audio(t1, t2)
+        source.wait(buf_end)
+        if source.ended and buf_start >= source.n_frames:
+            break
+        logger.info('Live segment from {0} to {1}'.format(t1, t2))
+        post_process_chunks(tracklisting_instance,
+                            [(t1, t2, match_chunk(fingerprinting_instance, matching_instance, source, t1, t2,
+                                                  introspect_trackids))])
+        # The next segments start later
+        source.discard(buf_start)
+        history = tracklisting_instance.history_tracklist
+        while len(history) > 1:
+            item = _final_items(tracklisting_instance, history[:2])[0]
+            # post_processing only appends to the history, the last entry is kept for the next item
+            del history[0]
+            yield item
+    history = tracklisting_instance.history_tracklist
+    if history:
+        item = _final_items(tracklisting_instance, history)[-1]
+        item['end'] = source.length
+        yield item
+
+
 def store_tracklist(broadcast,
                     corpus_path,
                     db_name,
@@ -192,7 +334,30 @@ def process_chunk(fingerprinting_instance, matching_instance, tracklisting_insta
         fingerprinting_instance: instance of traxit_algorithm.fingerprinting.Fingerprinting
         matching_instance: instance of traxit_algorithm.matching.Matching
         tracklisting_instance: instance of traxit_manage.tracklisting.Tracklisting
-        filecache: a file path with extension .cache (which really raw wave)
+        filecache: a file path with extension .cache (which really raw wave), or its WaveSource
+        start (float): audio segment start time (in seconds)
+        end (float): audio segment end time (in seconds)
+        introspect_trackids: list or None. An introspect.json file will be output in the broadcast folder.
+
+    Returns:
+        pd.DataFrame: Matches for this chunk
+    """
+    source = filecache if isinstance(filecache, WaveSource) else WaveSource(filecache, 11025)
+    match = match_chunk(fingerprinting_instance, matching_instance, source, start, end, introspect_trackids)
+    logger.info('Adding segment from {0} to {1} to tracklist'.format(start, end))
+    tracklisting_instance.post_processing(match, start, end)
+    return match
+
+
+def match_chunk(fingerprinting_instance, matching_instance, source, start, end, introspect_trackids):
+    """Decodes, fingerprints and matches an audio segment, without post-processing it.
+
+    This does not depend on the previous segments, so segments can be matched in any order.
+
+    Args:
+        fingerprinting_instance: instance of traxit_algorithm.fingerprinting.Fingerprinting
+        matching_instance: instance of traxit_algorithm.matching.Matching
+        source (WaveSource): the decoded audio, from the file with extension .cache (which really raw wave)
         start (float): audio segment start time (in seconds)
         end (float): audio segment end time (in seconds)
         introspect_trackids: list or None. An introspect.json file will be output in the broadcast folder.
@@ -201,7 +366,7 @@ def process_chunk(fingerprinting_instance, matching_instance, tracklisting_insta
         pd.DataFrame: Matches for this chunk
     """
     buf_start, buf_end = fingerprinting_instance.how_much_audio(start, end)
-    audio, _ = decode_wave(filecache, buf_start, buf_end, 11025)
+    audio, _ = source.read(buf_start, buf_end)
     logger.info('Fingerprinting segment from {0} to {1}'.format(start, end))
     fp = fingerprinting_instance.get_fingerprint(audio, start, end)
     logger.info('Matching segment from {0} to {1}'.format(start, end))
@@ -210,11 +375,187 @@ def process_chunk(fingerprinting_instance, matching_instance, tracklisting_insta
                                           end,
                                           introspect_trackids=introspect_trackids,
                                           query_keys_n_jobs=int(os.environ.get('QUERY_N_JOBS', 8)))
-    logger.info('Adding segment from {0} to {1} to tracklist'.format(start, end))
-    tracklisting_instance.post_processing(match, start, end)
     return match
 
 
+def iter_matches(times, fingerprinting_instance, matching_instance, source, introspect_trackids, pool=None,
+                 lookahead=None):
+    """Matches audio segments, in order.
+
+    With a pool, the segments are matched ahead by its workers (see ``_init_worker``): at most ``lookahead``
+    segments are submitted and not consumed yet, which bounds the memory used by the results waiting.
+
+    Args:
+        times (list of tuples): (start, end) of each segment, see ``Tracklisting.times_list``
+        fingerprinting_instance: instance of traxit_algorithm.fingerprinting.Fingerprinting
+        matching_instance: instance of traxit_algorithm.matching.Matching
+        source (WaveSource): the decoded audio. The workers of the pool map the same file.
+        introspect_trackids: list or None. An introspect.json file will be output in the broadcast folder.
+        pool (Optional[multiprocessing.Pool]): Pool initialized with ``_init_worker``. Defaults to None: the
+            segments are matched one after the other with the given instances.
+        lookahead (Optional[int]): Number of segments matched ahead. Defaults to twice the number of CPUs.
+
+    Yields:
+        tuple: start, end and matches (pd.DataFrame) of each segment, in the order of times
+    """
+    if pool is None:
+        for start, end in times:
+            yield start, end, match_chunk(fingerprinting_instance, matching_instance, source, start, end,
+                                          introspect_trackids)
+        return
+    lookahead = max(1, lookahead or 2 * cpu_count())
+    times = iter(times)
+    pending = deque()
+    while True:
+        while len(pending) < lookahead:
+            try:
+                start, end = next(times)
+            except StopIteration:
+                break
+            pending.append((start, end, pool.apply_async(_match_chunk_worker,
+                                                         ((source.path, start, end, introspect_trackids),))))
+        if not pending:
+            return
+        start, end, result = pending.popleft()
+        yield start, end, result.get()
+
+
+def post_process_chunks(tracklisting_instance, chunks, checkpoint=None):
+    """Adds matched audio segments to the tracklist, in order.
+
+    Args:
+        tracklisting_instance: instance of traxit_manage.tracklisting.Tracklisting
+        chunks (iterable): start, end and matches of each segment, see ``iter_matches``
+        checkpoint (Optional[TracklistCheckpoint]): Checkpoint updated after each segment. Defaults to None.
+
+    Returns:
+        list of pd.DataFrame: Matches of each segment
+    """
+    matches = []
+    for start, end, match in chunks:
+        logger.info('Adding segment from {0} to {1} to tracklist'.format(start, end))
+        tracklisting_instance.post_processing(match, start, end)
+        matches.append(match)
+        if checkpoint is not None:
+            checkpoint.add(match, start, end)
+    return matches
+
+
+class TracklistCheckpoint(object):
+    """Checkpoint of the tracklisting of a file, to resume it after a crash.
+
+    The matches of each segment are appended to a file of JSON lines, ``<path>l``. Every ``interval`` seconds,
+    this file is synced and the state of the tracklisting (``Tracklisting.checkpoint``), the number of segments
+    done, the last window and the size of the matches file are written to ``path``, atomically. The matches
+    appended after the last checkpoint are truncated when it is loaded.
+
+    Args:
+        path (str): path of the checkpoint
+        tracklisting_instance: instance of traxit_manage.tracklisting.Tracklisting
+        length (float): length of the audio file in seconds, to check that it did not change
+        interval (Optional[float]): seconds between two checkpoints. Defaults to ``checkpoint_interval``.
+    """
+
+    def __init__(self, path, tracklisting_instance, length, interval=None):
+        self.path = path
+        self.matches_path = path + 'l'
+        self.tracklisting_instance = tracklisting_instance
+        self.length = length
+        self.interval = checkpoint_interval if interval is None else interval
+        self.segments = 0
+        self.last_window = None
+        self._matches_file = None
+        self._saved_at = time.time()
+
+    def load(self, times):
+        """Restores the tracklisting instance from the checkpoint, if there is a valid one.
+
+        Args:
+            times (list of tuples): (start, end) of each segment of the file, see ``Tracklisting.times_list``
+
+        Returns:
+            list of pd.DataFrame: Matches of the segments done, which are the first segments of times
+        """
+        if not os.path.exists(self.path):
+            # Matches appended before a first checkpoint
+            self.remove()
+            return []
+        try:
+            with open(self.path, 'rb') as f:
+                state = json.load(f)
+            segments = state['segments']
+            if (state['length'] != self.length or not 0 < segments <= len(times) or
+                    list(times[segments - 1]) != state['last_window']):
+                raise ValueError('the checkpoint does not match the audio file')
+            with open(self.matches_path, 'r+b') as f:
+                f.truncate(state['matches_size'])
+                matches = [json.loads(line) for line in f]
+            matches = [pd.DataFrame(match['data'], index=match['index'], columns=match['columns'])
+                       for match in matches]
+            if len(matches) != segments:
+                raise ValueError('{0} matches saved instead of {1}'.format(len(matches), segments))
+            self.tracklisting_instance.restore(state['tracklisting'])
+        except (IOError, ValueError, KeyError) as e:
+            logger.warning(u'Ignoring the checkpoint {0}: {1}'.format(self.path, e))
+            self.remove()
+            return []
+        self.segments, self.last_window = segments, state['last_window']
+        logger.info(u'Resuming tracklisting after the window {0}'.format(self.last_window))
+        return matches
+
+    def add(self, match, start, end):
+        """Records a segment added to the tracklist, and saves the checkpoint every ``interval`` seconds.
+
+        Args:
+            match (pd.DataFrame): matches of the segment
+            start (float): audio segment start time (in seconds)
+            end (float): audio segment end time (in seconds)
+        """
+        if self._matches_file is None:
+            self._matches_file = open(self.matches_path, 'ab')
+        self._matches_file.write(match.to_json(orient='split') + '\n')
+        self.segments += 1
+        self.last_window = [start, end]
+        if time.time() - self._saved_at >= self.interval:
+            self.save()
+
+    def save(self):
+        """Saves the checkpoint."""
+        if self._matches_file is None:
+            return
+        self._matches_file.flush()
+        os.fsync(self._matches_file.fileno())
+        state = {'length': self.length,
+                 'segments': self.segments,
+                 'last_window': self.last_window,
+                 'matches_size': self._matches_file.tell(),
+                 'tracklisting': self.tracklisting_instance.checkpoint()}
+        with open(self.path + '.tmp', 'wb') as f:
+            json_dump(state, f)
+        os.rename(self.path + '.tmp', self.path)
+        self._saved_at = time.time()
+        logger.debug(u'Checkpoint saved after the window {0}'.format(self.last_window))
+
+    def close(self):
+        """Closes the matches file, without saving the checkpoint.
+
+        The checkpoint is only saved by ``add``, between two segments: after an error, for instance an interrupt
+        in ``post_processing``, the state of the tracklisting may hold a segment which was not counted.
+        """
+        if self._matches_file is not None:
+            self._matches_file.close()
+            self._matches_file = None
+
+    def remove(self):
+        """Deletes the checkpoint."""
+        if self._matches_file is not None:
+            self._matches_file.close()
+            self._matches_file = None
+        for path in (self.path, self.matches_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
 def get_tracklist(list_of_files,
                   db_instance,
                   fingerprinting_instance,
@@ -227,9 +568,22 @@ def get_tracklist(list_of_files,
                   cli=False,
                   pipeline=None,
                   introspect_trackids=None,
-                  detection_file_append=''):
+                  detection_file_append='',
+                  jobs=1,
+                  chunk_jobs=1):
     """Compute the tracklists for a list of files.
 
+    With ``jobs`` greater than 1, the files are tracklisted in a pool of processes. Each process builds its own
+    fingerprinting, matching and tracklisting instances from ``pipeline`` and unpickles its own copy of the
+    database, even when the process is forked: ``DbInMemory`` attaches to the saved database read-only, without
+    copying the postings, ``DbSqlite`` opens its own connection and ``ShardedDb`` connects to the shards with its
+    own sockets. The database class must therefore be picklable.
+
+    With ``chunk_jobs`` greater than 1, the files are tracklisted one after the other, but the segments of a file
+    are decoded, fingerprinted and matched ahead in a pool of processes (see ``iter_matches``). Only the
+    post-processing, which depends on the previous segments, is done in order by ``tracklisting_instance``. The
+    introspection of the matching is not collected from the processes.
+
     Args:
         list_of_files: list of audio file paths
         db_instance: db_instance: the instance of the db with which to tracklist
@@ -247,35 +601,135 @@ def get_tracklist(list_of_files,
             If pipeline is None (default) then we set the pipeline value to ``default``.
         introspect_trackids: list or None. An introspect.json file will be output in the broadcast folder.
         detection_file_append: an extra string for files produced during the process. Defaults to an empty string
+        jobs (int): Number of files tracklisted in parallel. Defaults to 1.
+        chunk_jobs (int): Number of processes matching the segments of each file. Defaults to 1.
 
     Returns:
-        a tuple (list_of_files [cleaned], traxit_algorithm.Tracklisting.Tracklist instances)
+        a tuple (list_of_files [cleaned], traxit_algorithm.Tracklisting.Tracklist instances), in the same order
+
+    Raises:
+        ValueError: jobs and chunk_jobs are both greater than 1
     """
+    if jobs > 1 and chunk_jobs > 1:
+        raise ValueError('Files and segments cannot both be processed in parallel')
     # If wave is reset then reset also history
     if reset_cache:
         reset_history_tracklist = True
 
     list_of_files = clean_list_of_files(list_of_files)
+    if jobs > 1 and len(list_of_files) > 1:
+        return list_of_files, _get_tracklist_parallel(list_of_files, db_instance, pipeline, corpus_path, broadcast,
+                                                      reset_cache, reset_history_tracklist, cli, introspect_trackids,
+                                                      detection_file_append, jobs)
     tls = []
-    for filepath in list_of_files:
-        tl = get_tracklist_file(broadcast,
-                                cli,
-                                corpus_path,
-                                filepath,
-                                fingerprinting_instance,
-                                introspect_trackids,
-                                matching_instance,
-                                reset_cache,
-                                reset_history_tracklist,
-                                tracklisting_instance,
-                                detection_file_append)
-        tls.append(tl)
+    pool = Pool(chunk_jobs, _init_worker, (db_instance, pipeline)) if chunk_jobs > 1 and list_of_files else None
+    try:
+        for filepath in list_of_files:
+            tl = get_tracklist_file(broadcast,
+                                    cli,
+                                    corpus_path,
+                                    filepath,
+                                    fingerprinting_instance,
+                                    introspect_trackids,
+                                    matching_instance,
+                                    reset_cache,
+                                    reset_history_tracklist,
+                                    tracklisting_instance,
+                                    detection_file_append,
+                                    pool=pool,
+                                    lookahead=2 * chunk_jobs)
+            tls.append(tl)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
     return list_of_files, tls
 
 
+# Instances used by the files tracklisted in a worker process, see _init_worker
+_worker_instances = {}
+
+
+def _init_worker(db_instance, pipeline):
+    """Builds the fingerprinting, matching and tracklisting instances of a worker process.
+
+    A forked process inherits ``db_instance`` itself rather than a pickled copy, with the connections of the
+    parent process: it is copied through pickle so that each worker has its own.
+    """
+    db_instance = pickle.loads(pickle.dumps(db_instance, pickle.HIGHEST_PROTOCOL))
+    fingerprinting_instance = configure_fingerprinting(pipeline=pipeline)
+    _worker_instances['fingerprinting'] = fingerprinting_instance
+    _worker_instances['matching'] = configure_matching(pipeline=pipeline,
+                                                       fingerprinting_instance=fingerprinting_instance,
+                                                       db_instance=db_instance)
+    _worker_instances['tracklisting'] = configure_tracklisting(pipeline=pipeline,
+                                                               db_instance=db_instance)
+
+
+def _get_tracklist_file_worker(args):
+    """Tracklists one file in a worker process."""
+    (broadcast, corpus_path, filepath, introspect_trackids, reset_cache, reset_history_tracklist,
+     detection_file_append) = args
+    return get_tracklist_file(broadcast,
+                              False,
+                              corpus_path,
+                              filepath,
+                              _worker_instances['fingerprinting'],
+                              introspect_trackids,
+                              _worker_instances['matching'],
+                              reset_cache,
+                              reset_history_tracklist,
+                              _worker_instances['tracklisting'],
+                              detection_file_append)
+
+
+def _worker_source(filecache):
+    """Returns the WaveSource of a cache file in a worker process, mapped once while the file is unchanged."""
+    stat = os.stat(filecache)
+    key = (filecache, stat.st_mtime, stat.st_size)
+    if _worker_instances.get('source_key') != key:
+        _worker_instances['source'] = WaveSource(filecache, 11025)
+        _worker_instances['source_key'] = key
+    return _worker_instances['source']
+
+
+def _match_chunk_worker(args):
+    """Matches one audio segment in a worker process."""
+    filecache, start, end, introspect_trackids = args
+    return match_chunk(_worker_instances['fingerprinting'], _worker_instances['matching'], _worker_source(filecache),
+                       start, end, introspect_trackids)
+
+
+def _get_tracklist_parallel(list_of_files, db_instance, pipeline, corpus_path, broadcast, reset_cache,
+                            reset_history_tracklist, cli, introspect_trackids, detection_file_append, jobs):
+    """Tracklists files in a pool of processes, see ``get_tracklist``.
+
+    Returns:
+        list: traxit_algorithm.Tracklisting.Tracklist of each file, in the order of list_of_files
+    """
+    tasks = [(broadcast, corpus_path, filepath, introspect_trackids, reset_cache, reset_history_tracklist,
+              detection_file_append) for filepath in list_of_files]
+    pool = Pool(min(jobs, len(list_of_files)), _init_worker, (db_instance, pipeline))
+    try:
+        # imap keeps the order of the files, whichever finishes first
+        results = pool.imap(_get_tracklist_file_worker, tasks)
+        if cli:
+            with click.progressbar(results, length=len(tasks), label='Tracklisting in progress') as bar:
+                tls = list(bar)
+        else:
+            tls = list(results)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return tls
+
+
 def get_tracklist_file(broadcast, cli, corpus_path, filepath, fingerprinting_instance, introspect_trackids,
                        matching_instance, reset_cache, reset_history_tracklist, tracklisting_instance,
-                       detection_file_append):
+                       detection_file_append, pool=None, lookahead=None):
     """Get the tracklist for one file.
 
     Args:
@@ -291,12 +745,13 @@ def get_tracklist_file(broadcast, cli, corpus_path, filepath, fingerprinting_ins
         tracklisting_instance: instance of traxit_manage.tracklisting.Tracklisting
         introspect_trackids: list or None. An introspect.json file will be output in the broadcast folder.
         detection_file_append: an extra string for files produced during the process.
+        pool (Optional[multiprocessing.Pool]): Pool matching the segments ahead, see ``iter_matches``.
+        lookahead (Optional[int]): Number of segments matched ahead by the pool, see ``iter_matches``.
 
     Returns:
         traxit_algorithm.Tracklisting.Tracklist: Tracklist of the file
 
     """
-    matches = []
     filecache = filepath + '.' + audio_cache_filetype
     _, filename_no_ext, _ = split_dir_file_ext(filepath)
     logger.info('Caching decoded {0} into {1}'.format(filepath, filecache))
@@ -308,36 +763,40 @@ def get_tracklist_file(broadcast, cli, corpus_path, filepath, fingerprinting_ins
         d.start()
     matches_saved = file_path(corpus_path, broadcast, '_'.join((filename_no_ext, detection_file_append)), 'matches')
     tracklist_saved = file_path(corpus_path, broadcast, '_'.join((filename_no_ext, detection_file_append)), 'tracklist')
-    if reset_history_tracklist and os.path.exists(tracklist_saved):
-        os.remove(tracklist_saved)
-    end_file = length_wave(filecache)
+    checkpoint_saved = file_path(corpus_path, broadcast, '_'.join((filename_no_ext, detection_file_append)), 'checkpoint')
+    source = WaveSource(filecache, 11025)
+    end_file = source.length
+    checkpoint = TracklistCheckpoint(checkpoint_saved, tracklisting_instance, end_file)
+    if reset_history_tracklist:
+        if os.path.exists(tracklist_saved):
+            os.remove(tracklist_saved)
+        checkpoint.remove()
     if not os.path.exists(tracklist_saved):
         tracklisting_instance.reset()
         logger.info('Starting tracklisting with length {0}s'.format(end_file))
-        # In order to mimic a do() while.
-        if cli:
-            with click.progressbar(tracklisting_instance.times_list(end_file),
-                                   label='Tracklisting in progress') as bar:
-                for start, end in bar:
-                    matches.append(process_chunk(fingerprinting_instance,
-                                                 matching_instance,
-                                                 tracklisting_instance,
-                                                 filecache, start, end,
-                                                 introspect_trackids))
-        else:
-            for start, end in tracklisting_instance.times_list(end_file):
-                matches.append(process_chunk(fingerprinting_instance,
-                                             matching_instance,
-                                             tracklisting_instance,
-                                             filecache, start, end,
-                                             introspect_trackids))
+        times = tracklisting_instance.times_list(end_file)
+        # Resume after the segments of the last checkpoint
+        matches = checkpoint.load(times)
+        chunks = iter_matches(times[len(matches):], fingerprinting_instance, matching_instance, source,
+                              introspect_trackids, pool=pool, lookahead=lookahead)
+        try:
+            if cli:
+                with click.progressbar(chunks, length=len(times) - len(matches),
+                                       label='Tracklisting in progress') as bar:
+                    matches += post_process_chunks(tracklisting_instance, bar, checkpoint)
+            else:
+                matches += post_process_chunks(tracklisting_instance, chunks, checkpoint)
+        finally:
+            checkpoint.close()
         with open(matches_saved, 'wb+') as f:
             pd.concat(matches).to_json(f, 'records')
         with open(tracklist_saved, 'wb+') as f:
             json.dump(tracklisting_instance.history_tracklist, f)
+        checkpoint.remove()
     else:
         with open(tracklist_saved, 'rb') as f:
             tracklisting_instance.history_tracklist = json.load(f)
+    source.close()
     tl = tracklisting_instance.get_tracklist(end_file)
     if introspect_trackids:
         with open(os.path.join(corpus_path, broadcast,
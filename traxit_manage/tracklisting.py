@@ -13,6 +13,7 @@ import six
 import time
 
 import numpy as np
+import pandas as pd
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +39,29 @@ class Tracklisting(object):
         self.history_matches = []
         self.history_tracklist = []
 
+    def checkpoint(self):
+        """Returns the state of the tracklisting, to resume it later with ``restore``.
+
+        Returns:
+            dict: ``history_tracklist`` and ``history_matches``, serializable with ``json_dump``
+        """
+        return {'history_tracklist': self.history_tracklist,
+                'history_matches': [(match.to_json(orient='split'), t1, t2)
+                                    for match, t1, t2 in self.history_matches]}
+
+    def restore(self, checkpoint):
+        """Restores a state returned by ``checkpoint``.
+
+        Args:
+            checkpoint (dict): the state, see ``checkpoint``
+        """
+        self.history_tracklist = checkpoint['history_tracklist']
+        self.history_matches = []
+        for match, t1, t2 in checkpoint['history_matches']:
+            match = json.loads(match)
+            self.history_matches.append((pd.DataFrame(match['data'], index=match['index'], columns=match['columns']),
+                                         t1, t2))
+
     def get_tracklist(self,
                       end,
                       tracklist_id=None):
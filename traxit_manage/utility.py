@@ -108,7 +108,10 @@ def _import(class_path):
         sys.path.append(os.getcwd())
     components = class_path.split('.')
     mod = __import__(components[0])
-    for comp in components[1:]:
+    for i, comp in enumerate(components[1:], 1):
+        if not hasattr(mod, comp):
+            # Submodules are only attributes of their package once imported
+            __import__('.'.join(components[:i + 1]))
         mod = getattr(mod, comp)
     return mod
 